@@ -6,10 +6,23 @@ from application import Application
 class AppController:
     def __init__(self, root):
         self.root = root
-        self.db = DataManager()
+        # writes are coalesced and done off the Tk thread
+        self.db = DataManager(write_behind=1.0)
         self.current_screen = None
+        self.root.protocol("WM_DELETE_WINDOW", self.exit)
         self.show_welcome(first=True)
 
+    def exit(self):
+        self.close()
+        self.root.destroy()
+
+    def close(self):
+        # tear down the open screen (device, recorder, workers), then flush
+        # anything still pending before the process ends
+        if hasattr(self.current_screen, "shutdown"):
+            self.current_screen.shutdown()
+        self.db.close()
+
     def show_welcome(self, first=False):
         # Only clear widgets if switching from another screen
         if not first and self.current_screen:
@@ -1,11 +1,12 @@
 import tkinter as tk
-from tkinter import messagebox
-from rounding_helper import RoundingHelper
-import serial.tools.list_ports
-import uart_comm
+from tkinter import messagebox, filedialog
 import egram_manager
-import uart_comm
-from reports import generate_report
+from report_jobs import ReportRunner
+from dcm_session import (DCMSession, MODES, MODE_PARAMETERS, PARAM_CONFIG, PARAM_UNITS,
+                         adjust_lrl_step, round_param)
+from session_recorder import SessionReader
+from device_monitor import DeviceMonitor
+import perf_stats
 
 
 class Application:
@@ -16,19 +17,11 @@ class Application:
         self.__logout_comp = logout
         self.__serial_port = None
         self.__current_serial = None
-        self.__uart = None
-        self.__egram_queue = egram_manager.FloatQueue()
-
-        self.__mode_parameters = {
-            "AOO":  ["Lower Rate Limit", "Upper Rate Limit", "Atrial Amplitude", "Atrial Pulse Width"],
-            "VOO":  ["Lower Rate Limit", "Upper Rate Limit", "Ventricular Amplitude", "Ventricular Pulse Width"],
-            "AAI":  ["Lower Rate Limit", "Upper Rate Limit", "Atrial Amplitude", "Atrial Pulse Width", "Atrial Sensitivity", "ARP", "PVARP", "Hysteresis", "Rate Smoothing"],
-            "VVI":  ["Lower Rate Limit", "Upper Rate Limit", "Ventricular Amplitude", "Ventricular Pulse Width", "Ventricular Sensitivity", "VRP", "Hysteresis", "Rate Smoothing"],
-            "AOOR": ["Lower Rate Limit", "Upper Rate Limit", "Atrial Amplitude", "Atrial Pulse Width","Activity Threshold", "Reaction Time", "Response Factor", "Recovery Time"],
-            "VOOR": ["Lower Rate Limit", "Upper Rate Limit", "Ventricular Amplitude", "Ventricular Pulse Width","Activity Threshold", "Reaction Time", "Response Factor", "Recovery Time"],
-            "AAIR": ["Lower Rate Limit", "Upper Rate Limit", "Maximum Sensor Rate", "Atrial Amplitude", "Atrial Pulse Width", "Atrial Sensitivity", "ARP", "PVARP", "Hysteresis", "Rate Smoothing", "Activity Threshold", "Reaction Time", "Response Factor", "Recovery Time"],
-            "VVIR": ["Lower Rate Limit", "Upper Rate Limit", "Maximum Sensor Rate", "Ventricular Amplitude", "Ventricular Pulse Width", "Ventricular Sensitivity", "VRP", "Hysteresis", "Rate Smoothing", "Activity Threshold", "Reaction Time", "Response Factor", "Recovery Time"]
-        }
+        self.__closed = False
+        # device, parameters, egram stream and recording live in the session;
+        # this class only presents them
+        self.__session = DCMSession(db, username)
+        self.__egram_queue = self.__session.queue
 
         self.__root.title("Pacemaker DCM")
         self.__root.geometry("800x600")
@@ -41,6 +34,14 @@ class Application:
         self.__create_device_id_section()    
         self.__create_egram_panel()
         self.__create_serial_display()
+        self.__create_report_status()
+
+        # PDFs are built on a worker thread; progress comes back via root.after
+        self.__reports = ReportRunner(self.__root, on_update=self.__report_update)
+
+        # port hot-plug is watched off the Tk thread
+        self.__monitor = DeviceMonitor()
+        self.__monitor.start()
         self.__check_device()
 
     def __create_status_display(self):
@@ -71,6 +72,21 @@ class Application:
         tk.OptionMenu(switch_frame, self.__egram_enabled, "On", "Off",
                     command=lambda m: self.__toggle_egram()).grid(row=0, column=1, padx=(10,0))
 
+        # seconds of signal shown in the graph
+        self.__egram_windows = {"10 s": 10.0, "30 s": 30.0, "1 min": 60.0, "5 min": 300.0}
+        self.__egram_window = tk.StringVar(value="10 s")
+        self.__egram_graph = None
+
+        tk.Label(switch_frame, text="Window:").grid(row=0, column=2, padx=(20,0))
+        tk.OptionMenu(switch_frame, self.__egram_window, *self.__egram_windows,
+                    command=lambda w: self.__set_egram_window()).grid(row=0, column=3, padx=(5,0))
+
+        # live performance overlay (also turns the perf counters on)
+        self.__egram_stats = tk.StringVar(value="On" if perf_stats.enabled() else "Off")
+        tk.Label(switch_frame, text="Stats:").grid(row=0, column=4, padx=(20,0))
+        tk.OptionMenu(switch_frame, self.__egram_stats, "On", "Off",
+                    command=lambda s: self.__toggle_stats()).grid(row=0, column=5, padx=(5,0))
+
         self.__btn_frame = tk.Frame(self.__egram_frame)
         self.__btn_frame.grid(row=1, column=0, pady=(10, 10), sticky="w")
 
@@ -86,6 +102,9 @@ class Application:
                                 command=lambda: self.__show_egram("BOTH"))
         self.__btn_B.grid(row=0, column=2, padx=5)
 
+        tk.Button(self.__btn_frame, text="Review...", width=12,
+                  command=self.__review_session).grid(row=0, column=3, padx=5)
+
 
         self.__egram_canvas = tk.Frame(self.__egram_frame, bg="white")
         self.__egram_canvas.grid(row=2, column=0, sticky="nsew")
@@ -105,20 +124,8 @@ class Application:
             self.__btn_V.config(state="normal")
             self.__btn_B.config(state="normal")
 
-    def __adjust_lrl_step(self, value):
-        v = int(value)
-        if 30 <= v <= 50:
-            return 30 + round((v - 30) / 5) * 5
-        elif 50 < v <= 90:
-            return 51 + round((v - 51) / 1) * 1
-        return 90 + round((v - 90) / 5) * 5
-
-
-    def __round_and_set(self, param_name, var, sv, slider, lo, hi, step):
-        if param_name == "Lower Rate Limit":
-            rounded = self.__adjust_lrl_step(sv.get())
-        else:
-            rounded = RoundingHelper.round_value(sv.get(), lo, hi, step)
+    def __round_and_set(self, param_name, var, sv, slider):
+        rounded = round_param(param_name, sv.get())
 
         if rounded is None:
             sv.set(str(var.get()))
@@ -163,49 +170,6 @@ class Application:
             "Recovery Time": tk.IntVar(value=5),       
         }
 
-        self.__param_config = {
-            "Lower Rate Limit": (30, 175, 1),
-            "Upper Rate Limit": (50, 175, 5),
-            "Maximum Sensor Rate": (50, 175, 5),
-            "Atrial Amplitude": (0.0, 5.0, 0.1),
-            "Atrial Pulse Width": (1, 30, 1),
-            "Ventricular Amplitude": (0.0, 5.0, 0.1),
-            "Ventricular Pulse Width": (1, 30, 1),
-            "Atrial Sensitivity": (0.0, 5.0, 0.1),
-            "Ventricular Sensitivity": (0.0, 5.0, 0.1),
-            "PVARP": (150, 500, 10),
-            "VRP": (150, 500, 5),
-            "ARP": (150, 500, 5),
-            "Hysteresis": (0, 1, 1),
-            "Rate Smoothing": (0, 25, 1),
-            "Activity Threshold": (1, 7, 1),
-            "Reaction Time": (10, 50, 10),
-            "Response Factor": (1, 16, 1),
-            "Recovery Time": (2, 16, 1),
-        }
-
-        self.__param_units = {
-            "Lower Rate Limit": "ppm",
-            "Upper Rate Limit": "ppm",
-            "Maximum Sensor Rate": "ppm",
-            "Atrial Amplitude": "V",
-            "Atrial Pulse Width": "ms",
-            "Ventricular Amplitude": "V",
-            "Ventricular Pulse Width": "ms",
-            "Atrial Sensitivity": "mV",
-            "Ventricular Sensitivity": "mV",
-            "PVARP": "ms",
-            "VRP": "ms",
-            "ARP": "ms",
-            "Hysteresis": "",
-            "Rate Smoothing": "%",
-            "Activity Threshold": "",
-            "Reaction Time": "sec",
-            "Response Factor": "",
-            "Recovery Time": "min",
-        }
-
-
         existing = self.__db.get_parameters(self.__username, state_name=self.__db.get_state(self.__username))
         if existing:
             for p, v in self.__parameters.items():
@@ -224,11 +188,11 @@ class Application:
                 w.grid_forget()
 
         row = 1
-        allowed = self.__mode_parameters.get(mode, [])
+        allowed = MODE_PARAMETERS.get(mode, [])
 
         for param in allowed:
             var = self.__parameters[param]
-            label_text = f"{param} ({self.__param_units.get(param, '')})" if self.__param_units.get(param, "") else param
+            label_text = f"{param} ({PARAM_UNITS.get(param, '')})" if PARAM_UNITS.get(param, "") else param
 
             tk.Label(self.__param_frame, text=label_text, font=("Arial", 10)) .grid(row=row, column=0, sticky="e", pady=1, padx=(0, 5))
 
@@ -263,7 +227,7 @@ class Application:
                 continue
 
             
-            low, high, step = self.__param_config[param]
+            low, high, step = PARAM_CONFIG[param]
             val_var = tk.StringVar()
             val_var.set(str(var.get()))
 
@@ -276,7 +240,7 @@ class Application:
 
                 def sync_lrl(*a, v=var, sv=val_var, s=slider):
                     raw = v.get()
-                    snap = self.__adjust_lrl_step(raw)
+                    snap = adjust_lrl_step(raw)
                     if snap != raw:
                         v.set(snap)
                     sv.set(str(snap))
@@ -301,13 +265,11 @@ class Application:
             entry = tk.Entry(self.__param_frame, textvariable=val_var, width=6)
             entry.grid(row=row, column=2, padx=(5, 0))
 
-            entry.bind("<Return>", lambda e, p=param, v=var, sv=val_var,
-                    sl=slider, lo=low, hi=high, st=step:
-                    self.__round_and_set(p, v, sv, sl, lo, hi, st))
+            entry.bind("<Return>", lambda e, p=param, v=var, sv=val_var, sl=slider:
+                    self.__round_and_set(p, v, sv, sl))
 
-            entry.bind("<FocusOut>", lambda e, p=param, v=var, sv=val_var,
-                    sl=slider, lo=low, hi=high, st=step:
-                    self.__round_and_set(p, v, sv, sl, lo, hi, st))
+            entry.bind("<FocusOut>", lambda e, p=param, v=var, sv=val_var, sl=slider:
+                    self.__round_and_set(p, v, sv, sl))
 
             row += 1
 
@@ -340,10 +302,9 @@ class Application:
         frame.grid(row=0, column=0, sticky="nw", padx=10, pady=5)
         tk.Label(frame, text="States", font=("Arial", 10, "bold")).grid(row=0, column=0, columnspan=4, sticky="w")
         self.__state_buttons = {}
-        modes = ["AOO", "VOO", "AAI", "VVI", "AOOR", "VOOR", "AAIR", "VVIR"]
         row = 1
         col = 0
-        for name in modes:
+        for name in MODES:
             b = tk.Button(frame, text=name, width=6, height=1, font=("Arial", 9),
                         command=lambda n=name: self.__select_state(n))
             b.grid(row=row, column=col, padx=3, pady=2)
@@ -393,80 +354,54 @@ class Application:
 
     def __send_to_device(self):
         try:
-            mode = self.__db.get_state(self.__username)
-            allowed = self.__mode_parameters.get(mode, [])
+            mode = self.__session.mode
+            current = self.__current_values(mode)
 
-            current = {}
-            for p in allowed:
-                current[p] = self.__parameters[p].get()
+            # saved and on disk before it goes out; the echo is awaited off
+            # the Tk thread and __finish_send picks it up
+            future = self.__session.send(current, mode=mode)
+            self.__root.after(50, self.__finish_send, future)
 
-            self.__db.save_parameters(self.__username, current, state_name=mode)
-            self.__db.save_state(self.__username, mode)
+        except Exception as e:
+            messagebox.showerror("UART Error", str(e))
 
-            if not self.__uart:
-                self.__uart = uart_comm.UARTComm(queue=self.__egram_queue)
+    def __current_values(self, mode):
+        return {p: self.__parameters[p].get() for p in MODE_PARAMETERS.get(mode, [])}
 
-            self.__uart.send_to_device(self.__username)
-            messagebox.showinfo("Success", "Parameters sent.")
+    def __finish_send(self, future):
+        if not future.done():
+            self.__root.after(50, self.__finish_send, future)
+            return
 
+        try:
+            result = future.result()
         except Exception as e:
             messagebox.showerror("UART Error", str(e))
+            return
+
+        if result.ok:
+            messagebox.showinfo("Success", f"Parameters sent and confirmed "
+                                f"({result.latency * 1000:.0f} ms, attempt {result.attempts}).")
+        elif result.echo is None:
+            messagebox.showerror("UART Error", f"No echo from device after {result.attempts} attempts.")
+        else:
+            fields = ", ".join(field for field, _, _ in result.mismatches)
+            messagebox.showerror("UART Error", f"Device echoed different values for: {fields}")
 
 
     def __select_state(self, name):
         for s, b in self.__state_buttons.items():
             b.config(bg="lightgreen" if s == name else "white")
 
-        last = self.__db.get_state(self.__username)
-
-        if last:
-            saved = {}
-            for p in self.__mode_parameters.get(last, []):
-                saved[p] = self.__parameters[p].get()
-            self.__db.save_parameters(self.__username, saved, state_name=last)
-
-        self.__db.save_state(self.__username, name)
-
-        params = self.__db.get_parameters(self.__username, state_name=name)
-        allowed = self.__mode_parameters.get(name, [])
-
-        defaults = {
-            "Lower Rate Limit": 60,
-            "Upper Rate Limit": 120,
-            "Maximum Sensor Rate": 120,
-            "Atrial Amplitude": 5,
-            "Atrial Pulse Width": 1,
-            "Ventricular Amplitude": 5,
-            "Ventricular Pulse Width": 1,
-            "Atrial Sensitivity": 0,
-            "Ventricular Sensitivity": 0,
-            "PVARP": 250,
-            "VRP": 320,
-            "ARP": 250,
-            "Hysteresis": 0,
-            "Rate Smoothing": 0,
-            "Activity Threshold": 4,
-            "Reaction Time": 30,
-            "Response Factor": 8,
-            "Recovery Time": 5,
-        }
+        # keep what is on screen for the old mode, load the new one
+        last = self.__session.mode
+        params = self.__session.select_mode(name, self.__current_values(last) if last else None)
 
-        for p in allowed:
-            if params and p in params:
-                self.__parameters[p].set(float(params[p]))
-            else:
-                self.__parameters[p].set(defaults[p])
+        for p, value in params.items():
+            self.__parameters[p].set(float(value))
 
         self.__rebuild_parameter_rows(name)
 
-        current = {}
-        for p in allowed:
-            current[p] = self.__parameters[p].get()
-
-        self.__db.save_parameters(self.__username, current, state_name=name)
-
-
-
 
     def __create_serial_display(self):
         self.__serial_label = tk.Label(self.__root, text="Serial: None", font=("Arial", 10, "italic"), fg="gray")
@@ -481,29 +416,50 @@ class Application:
         for w in self.__egram_canvas.winfo_children():
             w.destroy()
 
-        graph = EgramGraph(self.__egram_canvas, self.__egram_queue, mode)
+        window = self.__egram_windows[self.__egram_window.get()]
+        graph = EgramGraph(self.__egram_canvas, self.__egram_queue, mode, window=window)
         graph.pack(fill="both", expand=True)
+        graph.show_stats(self.__egram_stats.get() == "On")
+        self.__egram_graph = graph
 
+    def __review_session(self):
+        filename = filedialog.askopenfilename(initialdir="sessions",
+                                              filetypes=[("Egram sessions", "*.egram")])
+        if not filename:
+            return
 
-    def __save_parameters(self):
-        mode = self.__db.get_state(self.__username)
-        if not mode:
-            messagebox.showerror("Error", "No pacing mode selected.")
+        try:
+            reader = SessionReader(filename)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Review Error", str(e))
             return
 
-        allowed = self.__mode_parameters.get(mode, [])
+        window = self.__egram_windows[self.__egram_window.get()]
+        egram_manager.open_session_playback(self.__root, reader, "BOTH", window=window)
 
-        lrl = self.__parameters["Lower Rate Limit"].get()
-        url = self.__parameters["Upper Rate Limit"].get()
+    def __set_egram_window(self):
+        graph = self.__egram_graph
+        if graph and graph.winfo_exists():
+            graph.set_window(self.__egram_windows[self.__egram_window.get()])
 
-        if lrl > url:
-            messagebox.showerror("Invalid Parameter", "LRL cannot exceed URL")
-            return
+    def __toggle_stats(self):
+        on = self.__egram_stats.get() == "On"
+        perf_stats.enable(on)
+        graph = self.__egram_graph
+        if graph and graph.winfo_exists():
+            graph.show_stats(on)
 
-        data = {p: self.__parameters[p].get() for p in allowed}
+    def __save_parameters(self):
+        mode = self.__session.mode
+        if not mode:
+            messagebox.showerror("Error", "No pacing mode selected.")
+            return
 
-        _, msg = self.__db.save_parameters(self.__username, data, state_name=mode)
-        messagebox.showinfo("Saved", f"{msg} (Mode: {mode})")
+        ok, msg = self.__session.set_parameters(self.__current_values(mode))
+        if not ok:
+            messagebox.showerror("Invalid Parameter", msg)
+            return
+        messagebox.showinfo("Saved", msg)
 
 
 
@@ -513,95 +469,143 @@ class Application:
 
 
     def __check_device(self):
-        ports = list(serial.tools.list_ports.comports())
-
-        if ports:
-            p = ports[0]
+        # stop once the screen has been torn down (logout)
+        if not self.__serial_label.winfo_exists():
+            return
 
-            serial_number = (
-                getattr(p, "serial_number", None)
-                or getattr(p, "device", None)
-                or f"{getattr(p, 'vid', '0')}:{getattr(p, 'pid', '0')}"
-            )
+        with perf_stats.timed("check_device"):
+            # Ports are enumerated by the monitor thread; only its cached list is
+            # used here. Probing happens on hot-plug events only (the monitor's
+            # first snapshot reports every port present as added).
+            events = self.__monitor.poll()
+            ports = self.__monitor.ports()
+
+            # the port we are talking to went away
+            uart = self.__session.uart
+            for kind, p in events:
+                if kind == "removed" and uart and uart.ser and uart.ser.port == p.device:
+                    self.__drop_connection()
+
+            if events:
+                self.__update_device(ports)
+
+        self.__root.after(200, self.__check_device)
+
+    def __update_device(self, ports):
+        if not ports:
+            self.__drop_connection()
+        elif not self.__session.uart:
+            # probing can take a while; it runs off the Tk thread and
+            # __finish_connect picks up the result
+            future = self.__session.connect_async(ports)
+            self.__root.after(50, self.__finish_connect, future)
 
-            if serial_number != self.__current_serial:
-                self.__current_serial = serial_number
-                self.__save_device(serial_number)
-                self.__set_led(True)
+        self.__update_serial_label()
 
-                if not self.__uart:
-                    self.__uart = uart_comm.UARTComm(queue=self.__egram_queue)
+    def __finish_connect(self, future):
+        if not self.__serial_label.winfo_exists():
+            return
+        if not future.done():
+            self.__root.after(50, self.__finish_connect, future)
+            return
 
-                    ok = self.__uart.connect()
+        try:
+            ok = future.result() and self.__session.connected
+        except Exception as e:
+            print("CONNECT ERROR:", e)
+            ok = False
+        if ok:
+            self.__current_serial = self.__session.uart.ser.port
+            self.__save_device(self.__current_serial)
+            self.__pump_egram()
+        else:
+            self.__current_serial = None
 
-                    if ok:
-                        self.__current_serial = self.__uart.ser.port
-                        self.__save_device(self.__current_serial)
-                        self.__pump_egram()
-                    
-                    else:
-                        self.__current_serial = None
+        self.__set_led(ok)
+        self.__update_serial_label()
 
+    def __drop_connection(self):
+        self.__current_serial = None
+        self.__serial_label.config(text="Serial: None", fg="gray")
+        self.__set_led(False)
 
-        else:
-            self.__current_serial = None
-            self.__serial_label.config(text="Serial: None", fg="gray")
-            self.__set_led(False)
+        self.__session.disconnect()
 
-            if self.__uart:
-                try:
-                    self.__uart.ser.close()
-                except:
-                    pass
-                self.__uart = None
+    def __create_report_status(self):
+        f = tk.Frame(self.__root)
+        f.place(relx=0.0, rely=1.0, anchor="sw", x=10, y=-8)
 
+        tk.Button(f, text="Report All Modes", font=("Arial", 9),
+                  command=self.__generate_all_reports).pack(side="left", padx=(0, 5))
+        tk.Button(f, text="Cancel Reports", font=("Arial", 9),
+                  command=self.__cancel_reports).pack(side="left", padx=(0, 10))
+        self.__report_label = tk.Label(f, text="", font=("Arial", 9), fg="gray")
+        self.__report_label.pack(side="left")
 
-        self.__update_serial_label()
-        self.__root.after(2000, self.__check_device)
+    def __submit_report(self, mode, params, egram_data):
+        kwargs = self.__session.report_kwargs(mode, params, self.__device_id_var.get(),
+                                              egram_data=egram_data)
+        return self.__reports.submit(mode, **kwargs)
 
     def __generate_report(self):
-        mode = self.__db.get_state(self.__username)
+        mode = self.__session.mode
 
         if not mode:
             messagebox.showerror("Error", "No mode selected.")
             return
 
-        device_id = self.__device_id_var.get() or "UNKNOWN"
-        dcm_serial = self.__username
+        self.__submit_report(mode, self.__current_values(mode), self.__session.egram_source())
 
-        parameters = []
-        labels = []
+    def __generate_all_reports(self):
+        # One report per mode with saved parameters; the current mode uses
+        # the values on screen
+        current = self.__session.mode
+        egram = self.__session.egram_source()
+        queued = 0
+
+        for mode in MODES:
+            if mode == current:
+                params = self.__current_values(mode)
+            elif self.__db.get_parameters(self.__username, state_name=mode):
+                params = self.__session.parameters(mode)
+            else:
+                continue
 
-        for p in self.__mode_parameters[mode]:
-            labels.append(p)
-            parameters.append(self.__parameters[p].get())
+            self.__submit_report(mode, params, egram)
+            queued += 1
 
-        output_name = f"{self.__username}_{mode}_report.pdf".replace(" ", "_")
+        if not queued:
+            messagebox.showerror("Error", "No saved parameters to report.")
 
-        try:
-            generate_report(
-                device_model="Pacemaker",
-                device_serial=device_id,
-                application_model="Pacemaker",
-                application_version="1.0",
-                dcm_serial=dcm_serial,
-                report_name=f"{mode} Parameter Report",
-                labels=labels,
-                parameters=parameters,
-                egram_data=self.__egram_queue.get_report_data(),
-                output_filename=output_name
-            )
-
-
-            messagebox.showinfo("Report Generated", f"Saved as {output_name}")
+    def __cancel_reports(self):
+        self.__reports.cancel_all()
 
-        except Exception as e:
-            messagebox.showerror("PDF Error", str(e))
+    def __report_update(self, job):
+        if not self.__report_label.winfo_exists():
+            return
+
+        waiting = len(self.__reports.active()) - (0 if job.finished else 1)
+        queued = f" ({waiting} queued)" if waiting > 0 else ""
+
+        if job.status == "running":
+            text = f"Report {job.name}: {job.stage} {job.progress:.0%}{queued}"
+        elif job.status == "done":
+            text = f"Saved {job.output} in {job.elapsed:.1f} s{queued}"
+        elif job.status == "failed":
+            text = f"Report {job.name} failed{queued}"
+            messagebox.showerror("PDF Error", job.error)
+        else:
+            text = f"Report {job.name}: {job.status}{queued}"
+
+        self.__report_label.config(text=text)
 
 
     def __pump_egram(self):
-        if self.__uart:
-            self.__uart.poll_egram()
+        # Frames are read off-thread by UARTComm; this only drains them.
+        # Stops with the connection, so a reconnect starts a single new loop.
+        if not self.__session.connected or not self.__serial_label.winfo_exists():
+            return
+        self.__session.poll()
         self.__root.after(40, self.__pump_egram)
 
 
@@ -630,8 +634,22 @@ class Application:
             self.__serial_label.config(text="Serial: None", fg="gray")
 
 
-    def __logout(self):
-        if self.__uart and self.__uart.ser:
-            self.__uart.ser.close()
+    def shutdown(self):
+        # Stop every worker and close the session (the recorder writes its
+        # last chunk); safe to call more than once. Also used when the
+        # window is closed without logging out.
+        if self.__closed:
+            return
+        self.__closed = True
+
+        self.__reports.shutdown()
+        self.__monitor.stop()
+        self.__session.logout()
 
+        if perf_stats.enabled():
+            perf_stats.export_json("perf_stats.json")
+            print("PERF STATS saved to perf_stats.json")
+
+    def __logout(self):
+        self.shutdown()
         self.__logout_comp()
\ No newline at end of file
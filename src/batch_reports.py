@@ -0,0 +1,166 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from datamanager import DataManager
+from dcm_session import report_kwargs
+from reports import generate_report
+from session_recorder import SessionReader
+
+
+def _device_serial(data, username):
+    # device id of the pacemaker the user talked to last
+    devices = data["devices"].get(username, {})
+    if not devices:
+        return "UNKNOWN"
+    last = max(devices.values(), key=lambda d: d.get("last_used", ""))
+    return last.get("device_id") or "UNKNOWN"
+
+
+def _job(data, username, mode, params, out_dir, session=None, **options):
+    name = f"{username}_{mode}"
+    if session:
+        name += "_" + os.path.splitext(os.path.basename(session))[0][len(username) + 1:]
+
+    # same metadata and parameter order as GUI and CLI reports
+    report = report_kwargs(username, mode, params, _device_serial(data, username),
+                           os.path.join(out_dir, f"{name}_report.pdf".replace(" ", "_")), **options)
+    if session:
+        report["report_name"] += " (session)"
+    return {"user": username, "mode": mode, "session": session, "report": report}
+
+
+def _session_params(path, data, username):
+    # parameters last sent during the session, else the user's current mode
+    mode, params = None, None
+    reader = SessionReader(path)
+    try:
+        for _, fields in reader.events:
+            if fields.get("kind") == "params_sent":
+                mode, params = fields.get("mode"), fields.get("params")
+    finally:
+        reader.close()
+
+    if not mode:
+        mode = data["states"].get(username)
+        params = data["parameters"].get(username, {}).get(mode)
+    return mode or "UNKNOWN", params or {}
+
+
+def collect_jobs(data, out_dir, sessions_dir=None, users=None, **options):
+    # One report per stored (user, mode), plus one per recorded session
+    jobs = []
+    for username, modes in data["parameters"].items():
+        if users and username not in users:
+            continue
+        for mode, params in modes.items():
+            if params:
+                jobs.append(_job(data, username, mode, params, out_dir, **options))
+
+    if sessions_dir:
+        for path in sorted(glob.glob(os.path.join(sessions_dir, "*.egram"))):
+            # sessions/{user}_{YYYYmmdd}_{HHMMSS}.egram
+            username = os.path.basename(path).rsplit("_", 2)[0]
+            if users and username not in users:
+                continue
+            try:
+                mode, params = _session_params(path, data, username)
+            except (OSError, ValueError) as e:
+                print("SKIPPED SESSION:", path, e)
+                continue
+            jobs.append(_job(data, username, mode, params, out_dir, session=path, **options))
+
+    return jobs
+
+
+def build(job):
+    # Runs in a worker process; sessions are opened there, not pickled
+    start = time.perf_counter()
+    entry = {"user": job["user"], "mode": job["mode"], "session": job["session"],
+             "output": job["report"]["output_filename"]}
+    reader = None
+    try:
+        if job["session"]:
+            reader = SessionReader(job["session"])
+        generate_report(**dict(job["report"], egram_data=reader))
+        entry["status"] = "ok"
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["error"] = str(e)
+    finally:
+        if reader:
+            reader.close()
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def run(jobs, workers=None):
+    entries = []
+    if workers == 1:
+        for job in jobs:
+            entries.append(build(job))
+            print(f"{entries[-1]['status']:>6}  {entries[-1]['seconds']:7.2f} s  {entries[-1]['output']}")
+        return entries
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for fut in as_completed([pool.submit(build, job) for job in jobs]):
+            entry = fut.result()
+            entries.append(entry)
+            print(f"{entry['status']:>6}  {entry['seconds']:7.2f} s  {entry['output']}")
+
+    # manifest in a stable order, not completion order
+    entries.sort(key=lambda e: e["output"])
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate reports for every stored user, mode and session")
+    parser.add_argument("--db", default="pacemaker_data.db", help="DataManager store to read")
+    parser.add_argument("--sessions", default="sessions",
+                        help="directory of recorded .egram sessions ('' to skip)")
+    parser.add_argument("--out", default=os.path.join("reports", datetime.now().strftime("%Y%m%d_%H%M%S")),
+                        help="output directory for the PDFs and manifest.json")
+    parser.add_argument("--user", action="append", dest="users", help="only this user (repeatable)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--seconds-per-row", type=float, default=5.0)
+    parser.add_argument("--appendix", action="store_true", help="include the full egram data appendix")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        # DataManager would quietly create an empty store (or import a JSON one)
+        parser.error(f"no store at {args.db}")
+
+    db = DataManager(args.db)
+    try:
+        data = db.data
+        os.makedirs(args.out, exist_ok=True)
+        jobs = collect_jobs(data, args.out, args.sessions or None, args.users,
+                            seconds_per_row=args.seconds_per_row, data_appendix=args.appendix)
+    finally:
+        db.close()
+
+    started = datetime.now().isoformat(timespec="seconds")
+    start = time.perf_counter()
+    entries = run(jobs, args.jobs)
+
+    manifest = {
+        "started": started,
+        "seconds": round(time.perf_counter() - start, 3),
+        "workers": args.jobs or os.cpu_count(),
+        "reports": entries,
+    }
+    manifest_path = os.path.join(args.out, "manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    failed = sum(e["status"] != "ok" for e in entries)
+    print(f"{len(entries) - failed} reports written, {failed} failed, manifest: {manifest_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:      # not available on Windows
+    resource = None
+
+from uart_comm import UARTComm
+from datamanager import DataManager
+from egram_manager import FloatQueue, EgramRenderer
+from device_simulator import SimulatedPacemaker, LoopbackSerial
+from reports import generate_report
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(name, unit, items, latencies):
+    # items processed in total; latencies in seconds per timed step
+    lat = np.asarray(latencies)
+    total = lat.sum()
+    return {
+        "stage": name,
+        "unit": unit,
+        "throughput": items / total if total > 0 else 0.0,
+        "p50_ms": float(np.percentile(lat, 50) * 1000),
+        "p99_ms": float(np.percentile(lat, 99) * 1000),
+    }
+
+
+class _Replay:
+    # LoopbackSerial device streaming prebuilt bytes, one chunk per ~1 ms
+    def __init__(self, data, chunk=16384):
+        self.data = data
+        self.chunk = chunk
+
+    def receive(self, data):
+        return b""
+
+    def run(self, write, stop):
+        for i in range(0, len(self.data), self.chunk):
+            if stop.is_set():
+                return
+            write(self.data[i:i + self.chunk])
+            stop.wait(0.001)
+
+
+def bench_parse(frames, timeout=60.0):
+    # The whole UART receive path: reader thread + FrameParser, then
+    # poll_egram -> np.array -> push_many on the polling thread. Throughput
+    # is frames through the queue per wall second; latencies are per poll.
+    data = SimulatedPacemaker(sample_rate=1000, seed=1).ecg_frames(frames)
+    queue = FloatQueue()
+    latencies = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DataManager(os.path.join(tmp, "bench.db"))
+        uart = UARTComm(queue=queue, db=db)
+        uart.ser = LoopbackSerial(_Replay(data), timeout=0.05)
+
+        start = time.perf_counter()
+        uart.start_reader()
+        while queue.written < frames and time.perf_counter() - start < timeout:
+            t = time.perf_counter()
+            uart.poll_egram()
+            queue.drain()
+            latencies.append(time.perf_counter() - t)
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+
+        uart.disconnect()
+        db.close()
+
+    result = summarize("parse", "frames/s", queue.written, latencies)
+    result["throughput"] = queue.written / elapsed
+    return result
+
+
+def bench_queue(samples, batch=1000):
+    # Per-sample push/pop, timed in batches
+    queue = FloatQueue(max_store=samples)
+    latencies = []
+
+    for _ in range(samples // batch):
+        start = time.perf_counter()
+        for i in range(batch):
+            queue.push({"A": 1.0, "V": 2.0})
+        while not queue.empty():
+            queue.pop()
+        latencies.append(time.perf_counter() - start)
+
+    return summarize("queue", "samples/s", samples // batch * batch, latencies)
+
+
+def bench_queue_bulk(samples, batch=1000):
+    queue = FloatQueue(max_store=samples)
+    block = np.random.default_rng(1).random((batch, 2), dtype=np.float32) * 5
+    latencies = []
+
+    for _ in range(samples // batch):
+        start = time.perf_counter()
+        queue.push_many(block)
+        queue.drain()
+        latencies.append(time.perf_counter() - start)
+
+    return summarize("queue_bulk", "samples/s", samples // batch * batch, latencies)
+
+
+def bench_render(frames, samples_per_frame=33, mode="BOTH", window=10.0):
+    # One GUI frame at ~30 fps of a 1 kHz stream, on a headless Agg canvas
+    renderer = EgramRenderer(mode, window=window)
+    sim = SimulatedPacemaker(sample_rate=1000, seed=1)
+    raw = np.frombuffer(sim.ecg_frames(frames * samples_per_frame), dtype=np.uint8).reshape(-1, 3)
+    a_vals = raw[:, 1].astype(np.float32) * (5.0 / 255.0)
+    v_vals = raw[:, 2].astype(np.float32) * (5.0 / 255.0)
+    latencies = []
+
+    for i in range(frames):
+        s = slice(i * samples_per_frame, (i + 1) * samples_per_frame)
+        start = time.perf_counter()
+        renderer.render(a_vals[s], v_vals[s])
+        latencies.append(time.perf_counter() - start)
+
+    return summarize("render", "frames/s", frames, latencies)
+
+
+def bench_report(samples, runs=3):
+    rng = np.random.default_rng(1)
+    egram = [{"A": float(a), "V": float(v)} for a, v in rng.random((samples, 2)) * 5]
+    labels = ["Lower Rate Limit", "Upper Rate Limit"]
+    latencies = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(runs):
+            start = time.perf_counter()
+            generate_report("Pacemaker", "BENCH", "Pacemaker", "1.0", "bench", "Benchmark",
+                            labels, [60, 120], egram_data=egram,
+                            output_filename=os.path.join(tmp, f"bench_{i}.pdf"))
+            latencies.append(time.perf_counter() - start)
+
+    return summarize("report", "reports/s", runs, latencies)
+
+
+STAGES = {
+    "parse": bench_parse,
+    "queue": bench_queue,
+    "queue_bulk": bench_queue_bulk,
+    "render": bench_render,
+    "report": bench_report,
+}
+
+
+def _run_stage(stage, args, kwargs):
+    # Runs in a fresh process, so peak RSS is this stage's alone
+    result = STAGES[stage](*args, **kwargs)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_all(quick=False):
+    scale = 0.1 if quick else 1.0
+    plan = [
+        ("parse", (int(200_000 * scale),), {}),
+        ("queue", (int(100_000 * scale),), {}),
+        ("queue_bulk", (int(1_000_000 * scale),), {}),
+        ("render", (max(10, int(300 * scale)),), {}),
+        ("report", (int(5000 * scale),), {"runs": 2 if quick else 3}),
+    ]
+
+    # ru_maxrss only ever grows, so each stage gets its own process
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for stage, args, kwargs in plan:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            results.append(pool.submit(_run_stage, stage, args, kwargs).result())
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Regression: throughput below, or p99 above, baseline by more than tolerance
+    base = {r["stage"]: r for r in baseline}
+    failures = []
+    for r in results:
+        b = base.get(r["stage"])
+        if not b:
+            continue
+        if r["throughput"] < b["throughput"] * (1 - tolerance):
+            failures.append(f"{r['stage']}: throughput {r['throughput']:.0f} < baseline {b['throughput']:.0f} {r['unit']}")
+        if r["p99_ms"] > b["p99_ms"] * (1 + tolerance):
+            failures.append(f"{r['stage']}: p99 {r['p99_ms']:.3f} ms > baseline {b['p99_ms']:.3f} ms")
+    return failures
+
+
+def print_table(results):
+    print(f"{'stage':<12}{'throughput':>16} {'unit':<11}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}")
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.1f}" if r["peak_rss_mb"] is not None else "-"
+        print(f"{r['stage']:<12}{r['throughput']:>16.1f} {r['unit']:<11}"
+              f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{rss:>13}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Egram pipeline benchmarks")
+    parser.add_argument("--baseline", default="benchmark_baseline.json",
+                        help="baseline file to compare against or save to")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before a stage counts as regressed")
+    parser.add_argument("--quick", action="store_true", help="smaller workloads")
+    args = parser.parse_args(argv)
+
+    results = run_all(quick=args.quick)
+    print_table(results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args.tolerance)
+        for line in failures:
+            print("REGRESSION", line)
+        return 1 if failures else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,274 @@
+import copy
+import functools
 import json
 import hashlib
 import os
+import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
+from threading import Lock, RLock, Thread, Event
+
+import perf_stats
+
+
+def _empty_data():
+    return {
+        "users": {},
+        "parameters": {},
+        "states": {},
+        "devices": {}
+    }
+
+
+# Sections whose entries are keyed twice (user -> state / serial -> value)
+NESTED_SECTIONS = ("parameters", "devices")
+
+
+class JsonStore:
+    per_key = False      # save() always writes the whole document
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def load(self):
+        with open(self.filename, "r") as f:
+            try:
+                data = json.load(f)
+
+                if "devices" not in data:
+                    data["devices"] = {}
+
+            except json.JSONDecodeError:
+                data = _empty_data()
+        return data
+
+    def save(self, data, changes=None):
+        # The whole document is rewritten whatever changed. Write a temp file
+        # and rename it over the old one so a crash never leaves it truncated.
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    per_key = True       # save(data, changes) only reads the changed paths
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = Lock()
+        self.new = not os.path.exists(filename)
+
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " section TEXT NOT NULL, owner TEXT NOT NULL, key TEXT NOT NULL,"
+            " value TEXT NOT NULL, PRIMARY KEY (section, owner, key))"
+        )
+        self.conn.commit()
+
+    def exists(self):
+        return not self.new
+
+    def load(self):
+        data = _empty_data()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT section, owner, key, value FROM records ORDER BY rowid").fetchall()
+
+        for section, owner, key, value in rows:
+            value = json.loads(value)
+            if section in NESTED_SECTIONS:
+                data.setdefault(section, {}).setdefault(owner, {})[key] = value
+            else:
+                data.setdefault(section, {})[owner] = value
+        return data
+
+    def save(self, data, changes=None):
+        # changes: set of (section, owner, key) to upsert; None rewrites everything
+        with self.lock, self.conn:
+            if changes is None:
+                self.conn.execute("DELETE FROM records")
+                changes = self._all_paths(data)
+
+            for section, owner, key in changes:
+                value = data.get(section, {}).get(owner)
+                if key and isinstance(value, dict):
+                    value = value.get(key)
+
+                if value is None:
+                    self.conn.execute(
+                        "DELETE FROM records WHERE section = ? AND owner = ? AND key = ?",
+                        (section, owner, key))
+                else:
+                    self.conn.execute(
+                        "INSERT INTO records (section, owner, key, value) VALUES (?, ?, ?, ?)"
+                        " ON CONFLICT (section, owner, key) DO UPDATE SET value = excluded.value",
+                        (section, owner, key, json.dumps(value)))
+
+    def _all_paths(self, data):
+        paths = []
+        for section, entries in data.items():
+            for owner, value in entries.items():
+                if section in NESTED_SECTIONS and isinstance(value, dict):
+                    paths.extend((section, owner, key) for key in value)
+                else:
+                    paths.append((section, owner, ""))
+        return paths
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def _mutation(method):
+    # Run a mutator under the lock and commit its changes as one batch
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.batch():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class DataManager:
-    def __init__(self, filename="pacemaker_data.json"):
+    def __init__(self, filename="pacemaker_data.db", legacy_json="pacemaker_data.json",
+                 write_behind=None):
         self.filename = filename
-        self.data = {
-            "users": {},
-            "parameters": {},
-            "states": {},
-            "devices": {}
-        }
+        self.data = _empty_data()
+
+        # .json keeps the original single-document file, anything else is SQLite
+        if filename.endswith(".json"):
+            self.store = JsonStore(filename)
+            self.legacy_json = None
+        else:
+            self.store = SqliteStore(filename)
+            self.legacy_json = legacy_json
+
+        # changed (section, owner, key) paths not yet written
+        self.changes = set()
+        self.batch_depth = 0
+
+        # lock guards data/changes, write_lock keeps store writes in order
+        self.lock = RLock()
+        self.write_lock = Lock()
+
         self.load_data()
 
+        # write_behind: seconds to coalesce mutations before a background write
+        self.write_behind = write_behind
+        self.flusher = None
+        self.dirty = Event()
+        self.closing = Event()
+        if write_behind:
+            self.flusher = Thread(target=self._flusher_loop, name="db-flusher", daemon=True)
+            self.flusher.start()
+
     def load_data(self):
-        if os.path.exists(self.filename):
-            with open(self.filename, "r") as f:
-                try:
-                    self.data = json.load(f)
-
-                    if "devices" not in self.data:
-                        self.data["devices"] = {}
-
-                except json.JSONDecodeError:
-                    self.data = {
-                        "users": {},
-                        "parameters": {},
-                        "states": {},
-                        "devices": {}
-                    }
+        if self.store.exists():
+            self.data = self.store.load()
+
+        elif self.legacy_json and os.path.exists(self.legacy_json):
+            # One-time import of the old JSON database into a new store
+            self.data = JsonStore(self.legacy_json).load()
+            self.save_data()
+
         else:
             self.save_data()
 
     def save_data(self):
-        with open(self.filename, "w") as f:
-            json.dump(self.data, f, indent=4)
+        with self.lock, self.write_lock:
+            self.changes.clear()
+            with perf_stats.timed("save_data"):
+                self.store.save(self.data)
+
+    def _changed(self, section, owner, key=""):
+        # written when the enclosing batch ends
+        self.changes.add((section, owner, key))
+
+    def _commit(self):
+        if self.write_behind:
+            self.dirty.set()
+        else:
+            self.flush()
+
+    def flush(self):
+        # Write every pending change now. Locks are always taken in the order
+        # lock -> write_lock. Our hold on the data lock ends before the disk
+        # write, but a flush at the end of a write-through batch() runs with
+        # the RLock still held re-entrantly by the caller.
+        with self.lock:
+            if not self.changes:
+                return
+            changes, self.changes = self.changes, set()
+            # the flusher thread must not see the dict change mid-write
+            data = self._snapshot(changes) if self.write_behind else self.data
+            self.write_lock.acquire()
+        try:
+            with perf_stats.timed("save_data"):
+                self.store.save(data, changes)
+        finally:
+            self.write_lock.release()
+
+    def _snapshot(self, changes):
+        # Copies of just the changed values, laid out like self.data, so a
+        # write costs the size of the change. Paths missing here are deleted
+        # by the store, as they would be from the full data.
+        if not self.store.per_key:
+            return copy.deepcopy(self.data)
+
+        part = _empty_data()
+        for section, owner, key in changes:
+            value = self.data.get(section, {}).get(owner)
+            if value is None:
+                continue
+            if key and isinstance(value, dict):
+                if key in value:
+                    part.setdefault(section, {}).setdefault(owner, {})[key] = copy.deepcopy(value[key])
+            else:
+                part.setdefault(section, {})[owner] = copy.deepcopy(value)
+        return part
+
+    def _flusher_loop(self):
+        while not self.closing.is_set():
+            self.dirty.wait()
+            # let further mutations pile up, then write them in one go
+            self.closing.wait(self.write_behind)
+            self.dirty.clear()
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        # Group several mutations into a single write
+        with self.lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self._commit()
+
+    def close(self):
+        if self.closing.is_set():
+            return
+        self.closing.set()
+        self.dirty.set()
+        if self.flusher:
+            self.flusher.join()
+        self.flush()
+        self.store.close()
 
+    @_mutation
     def add_user(self, username, password):
         if username in self.data["users"]:
             return False, "User already exists"
@@ -45,33 +277,36 @@ class DataManager:
 
         hashed_pw = hashlib.sha256(password.encode()).hexdigest()
         self.data["users"][username] = hashed_pw
-        self.save_data()
+        self._changed("users", username)
         return True, "User registered"
 
     def validate_user(self, username, password):
         hashed_pw = hashlib.sha256(password.encode()).hexdigest()
         return self.data["users"].get(username) == hashed_pw
 
+    @_mutation
     def save_parameters(self, username, params, state_name="default"):
         if username not in self.data["parameters"]:
             self.data["parameters"][username] = {}
         self.data["parameters"][username][state_name] = params
-        self.save_data()
+        self._changed("parameters", username, state_name)
         return True, f"Parameters for {state_name} saved successfully."
 
     def get_parameters(self, username, state_name="default"):
         return self.data["parameters"].get(username, {}).get(state_name)
 
+    @_mutation
     def save_state(self, username, state):
         if username not in self.data["users"]:
             return False, "User not found"
         self.data["states"][username] = state
-        self.save_data()
+        self._changed("states", username)
         return True, f"State '{state}' saved"
 
     def get_state(self, username):
         return self.data["states"].get(username)
 
+    @_mutation
     def save_device_id(self, username, serial_number, device_id):
         if not serial_number:
             return  # don't save invalid key
@@ -83,9 +318,29 @@ class DataManager:
             "device_id": device_id,
             "last_used": datetime.now().strftime("%Y-%m-%d %H:%M")
         }
-        self.save_data()
+        self._changed("devices", username, serial_number)
 
 
+    @_mutation
+    def save_device_port(self, username, serial_number, port):
+        # Remember which port answered for this device
+        if not serial_number:
+            return
+
+        devs = self.data["devices"].setdefault(username, {})
+        dev = devs.setdefault(serial_number, {"device_id": None})
+        if dev.get("port") == port:
+            return
+        dev["port"] = port
+        dev["last_used"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+        self._changed("devices", username, serial_number)
+
+    def get_device_port(self, username, serial_number):
+        dev = self.data["devices"].get(username, {}).get(serial_number)
+        if dev:
+            return dev.get("port")
+        return None
+
     def get_device_id(self, username, serial_number):
         user_devs = self.data["devices"].get(username, {})
         dev = user_devs.get(serial_number)
@@ -96,8 +351,9 @@ class DataManager:
     def get_devices(self, username):
         return self.data["devices"].get(username, [])
 
+    @_mutation
     def update_device_last_used(self, username, serial_number):
         devs = self.data["devices"].get(username, {})
         if serial_number in devs:
             devs[serial_number]["last_used"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-            self.save_data()
+            self._changed("devices", username, serial_number)
@@ -0,0 +1,184 @@
+import argparse
+import getpass
+import sys
+import time
+
+from datamanager import DataManager
+from dcm_session import DCMSession, MODES
+from multi_device import MultiDeviceSession
+from session_recorder import SessionReader
+
+
+def _parse_sets(items):
+    # ["Lower Rate Limit=70", ...] -> {"Lower Rate Limit": "70"}
+    params = {}
+    for item in items or []:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"expected NAME=VALUE, got {item!r}")
+        params[name.strip()] = value.strip()
+    return params
+
+
+def _connect(session, args):
+    if args.simulate:
+        session.connect_simulated()
+        return True
+    return session.connect()
+
+
+def _describe(result, mode):
+    if result.ok:
+        return f"VERIFIED {mode} in {result.latency * 1000:.1f} ms (attempt {result.attempts})"
+    if result.echo is None:
+        return f"NO ECHO after {result.attempts} attempts"
+    return "MISMATCH: " + ", ".join(f"{f} sent {s} got {g}" for f, s, g in result.mismatches)
+
+
+def _program_all(session, args):
+    multi = MultiDeviceSession(session.db, session.username)
+    try:
+        if args.simulate:
+            multi.connect_simulated(args.devices)
+        else:
+            multi.connect_all()
+        if not multi.devices:
+            print("NO DEVICE CONNECTED")
+            return 1
+
+        futures = multi.program_all(session.mode, timeout=args.timeout, retries=args.retries)
+        results = multi.wait_results(futures, timeout=args.wait)
+
+        failed = 0
+        for device, result in sorted(results.items()):
+            if isinstance(result, Exception):
+                print(f"{device}: ERROR: {result}")
+                failed += 1
+            else:
+                print(f"{device}: {_describe(result, session.mode)}")
+                failed += not result.ok
+        print(f"{len(results) - failed}/{len(results)} devices verified {session.mode}")
+        return 1 if failed else 0
+    finally:
+        multi.disconnect_all()
+
+
+def _report(session, args):
+    reader = SessionReader(args.session) if args.session else None
+    try:
+        output = session.report(output_filename=args.output, egram_data=reader)
+    finally:
+        if reader:
+            reader.close()
+    print("REPORT:", output)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pacemaker DCM without a display")
+    parser.add_argument("--db", default="pacemaker_data.db")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", help="prompted for when omitted")
+    parser.add_argument("--mode", choices=MODES, help="select this pacing mode first")
+    parser.add_argument("--simulate", action="store_true", help="talk to a simulated pacemaker")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("params", help="show, validate or save parameters")
+    p.add_argument("--set", action="append", metavar="NAME=VALUE")
+    p.add_argument("--check", action="store_true", help="validate only, do not save")
+
+    p = sub.add_parser("send", help="save, send and verify parameters")
+    p.add_argument("--set", action="append", metavar="NAME=VALUE")
+    p.add_argument("--timeout", type=float, default=0.5)
+    p.add_argument("--retries", type=int, default=3)
+
+    p = sub.add_parser("program-all", help="send and verify the saved parameters on every device")
+    p.add_argument("--timeout", type=float, default=0.5)
+    p.add_argument("--retries", type=int, default=3)
+    p.add_argument("--wait", type=float, default=30.0, help="give up on devices after this long")
+    p.add_argument("--devices", type=int, default=2, help="simulated pacemakers with --simulate")
+
+    p = sub.add_parser("egram", help="stream egram samples for a while")
+    p.add_argument("--seconds", type=float, default=5.0)
+
+    p = sub.add_parser("report", help="write a PDF report for the current mode")
+    p.add_argument("--output")
+    p.add_argument("--seconds", type=float, default=0.0,
+                   help="connect and record egram this long first (0: no device needed)")
+    p.add_argument("--session", help="take the egram from this recorded .egram file")
+
+    args = parser.parse_args(argv)
+    if args.command == "egram" and args.seconds <= 0:
+        parser.error("egram --seconds must be positive")
+
+    db = DataManager(args.db)
+    session = DCMSession(db)
+    try:
+        password = args.password if args.password is not None else getpass.getpass()
+        ok, msg = session.login(args.user, password)
+        if not ok:
+            print(msg)
+            return 1
+
+        if args.mode:
+            session.select_mode(args.mode)
+        mode = session.mode
+        if not mode:
+            print("No pacing mode selected (use --mode)")
+            return 1
+
+        if args.command == "params":
+            params = _parse_sets(args.set)
+            if params:
+                clean, errors = session.validate(params)
+                for e in errors:
+                    print("INVALID:", e)
+                if errors:
+                    return 1
+                if not args.check:
+                    print(session.set_parameters(clean)[1])
+            for name, value in session.parameters().items():
+                print(f"{name:<26}{value}")
+            return 0
+
+        if args.command == "program-all":
+            return _program_all(session, args)
+
+        if args.command == "report" and args.seconds <= 0:
+            # parameters (and a recorded session, if given) need no device
+            return _report(session, args)
+
+        if not _connect(session, args):
+            print("NO DEVICE CONNECTED")
+            return 1
+
+        if args.command == "send":
+            future = session.send(_parse_sets(args.set) or None,
+                                  timeout=args.timeout, retries=args.retries)
+            result = future.result()
+            print(_describe(result, mode))
+            return 0 if result.ok else 1
+
+        reader = session.subscribe_egram("cli")
+        seconds = args.seconds
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            session.poll()
+            samples += len(reader.drain()[0])
+            time.sleep(0.04)
+
+        if args.command == "egram":
+            print(f"{samples} samples in {seconds:g} s ({samples / seconds:.0f} Hz), "
+                  f"{reader.dropped} dropped, {session.uart.parser.dropped} bytes resynced")
+            return 0
+
+        return _report(session, args)
+
+    finally:
+        session.logout()
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+from concurrent.futures import Future
+from datetime import datetime
+from threading import Thread
+
+import uart_comm
+from datamanager import DataManager
+from egram_buffer import FloatQueue
+from reports import generate_report
+from rounding_helper import RoundingHelper
+from session_recorder import SessionRecorder, recorded_chunks
+
+MODES = ("AOO", "VOO", "AAI", "VVI", "AOOR", "VOOR", "AAIR", "VVIR")
+
+# Parameters each pacing mode uses, in display order
+MODE_PARAMETERS = {
+    "AOO":  ["Lower Rate Limit", "Upper Rate Limit", "Atrial Amplitude", "Atrial Pulse Width"],
+    "VOO":  ["Lower Rate Limit", "Upper Rate Limit", "Ventricular Amplitude", "Ventricular Pulse Width"],
+    "AAI":  ["Lower Rate Limit", "Upper Rate Limit", "Atrial Amplitude", "Atrial Pulse Width", "Atrial Sensitivity", "ARP", "PVARP", "Hysteresis", "Rate Smoothing"],
+    "VVI":  ["Lower Rate Limit", "Upper Rate Limit", "Ventricular Amplitude", "Ventricular Pulse Width", "Ventricular Sensitivity", "VRP", "Hysteresis", "Rate Smoothing"],
+    "AOOR": ["Lower Rate Limit", "Upper Rate Limit", "Atrial Amplitude", "Atrial Pulse Width","Activity Threshold", "Reaction Time", "Response Factor", "Recovery Time"],
+    "VOOR": ["Lower Rate Limit", "Upper Rate Limit", "Ventricular Amplitude", "Ventricular Pulse Width","Activity Threshold", "Reaction Time", "Response Factor", "Recovery Time"],
+    "AAIR": ["Lower Rate Limit", "Upper Rate Limit", "Maximum Sensor Rate", "Atrial Amplitude", "Atrial Pulse Width", "Atrial Sensitivity", "ARP", "PVARP", "Hysteresis", "Rate Smoothing", "Activity Threshold", "Reaction Time", "Response Factor", "Recovery Time"],
+    "VVIR": ["Lower Rate Limit", "Upper Rate Limit", "Maximum Sensor Rate", "Ventricular Amplitude", "Ventricular Pulse Width", "Ventricular Sensitivity", "VRP", "Hysteresis", "Rate Smoothing", "Activity Threshold", "Reaction Time", "Response Factor", "Recovery Time"]
+}
+
+# Values used when a mode has nothing saved yet
+PARAM_DEFAULTS = {
+    "Lower Rate Limit": 60,
+    "Upper Rate Limit": 120,
+    "Maximum Sensor Rate": 120,
+    "Atrial Amplitude": 5,
+    "Atrial Pulse Width": 1,
+    "Ventricular Amplitude": 5,
+    "Ventricular Pulse Width": 1,
+    "Atrial Sensitivity": 0,
+    "Ventricular Sensitivity": 0,
+    "PVARP": 250,
+    "VRP": 320,
+    "ARP": 250,
+    "Hysteresis": 0,
+    "Rate Smoothing": 0,
+    "Activity Threshold": 4,
+    "Reaction Time": 30,
+    "Response Factor": 8,
+    "Recovery Time": 5,
+}
+
+# (low, high, step) per parameter
+PARAM_CONFIG = {
+    "Lower Rate Limit": (30, 175, 1),
+    "Upper Rate Limit": (50, 175, 5),
+    "Maximum Sensor Rate": (50, 175, 5),
+    "Atrial Amplitude": (0.0, 5.0, 0.1),
+    "Atrial Pulse Width": (1, 30, 1),
+    "Ventricular Amplitude": (0.0, 5.0, 0.1),
+    "Ventricular Pulse Width": (1, 30, 1),
+    "Atrial Sensitivity": (0.0, 5.0, 0.1),
+    "Ventricular Sensitivity": (0.0, 5.0, 0.1),
+    "PVARP": (150, 500, 10),
+    "VRP": (150, 500, 5),
+    "ARP": (150, 500, 5),
+    "Hysteresis": (0, 1, 1),
+    "Rate Smoothing": (0, 25, 1),
+    "Activity Threshold": (1, 7, 1),
+    "Reaction Time": (10, 50, 10),
+    "Response Factor": (1, 16, 1),
+    "Recovery Time": (2, 16, 1),
+}
+
+PARAM_UNITS = {
+    "Lower Rate Limit": "ppm",
+    "Upper Rate Limit": "ppm",
+    "Maximum Sensor Rate": "ppm",
+    "Atrial Amplitude": "V",
+    "Atrial Pulse Width": "ms",
+    "Ventricular Amplitude": "V",
+    "Ventricular Pulse Width": "ms",
+    "Atrial Sensitivity": "mV",
+    "Ventricular Sensitivity": "mV",
+    "PVARP": "ms",
+    "VRP": "ms",
+    "ARP": "ms",
+    "Hysteresis": "",
+    "Rate Smoothing": "%",
+    "Activity Threshold": "",
+    "Reaction Time": "sec",
+    "Response Factor": "",
+    "Recovery Time": "min",
+}
+
+
+def adjust_lrl_step(value):
+    # LRL moves in 5 ppm steps below 50 and above 90, 1 ppm in between
+    v = int(value)
+    if 30 <= v <= 50:
+        return 30 + round((v - 30) / 5) * 5
+    elif 50 < v <= 90:
+        return 51 + round((v - 51) / 1) * 1
+    return 90 + round((v - 90) / 5) * 5
+
+
+def round_param(name, value):
+    # Snap a value onto the parameter's range and step; None if not a number
+    if name == "Lower Rate Limit":
+        low, high, _ = PARAM_CONFIG[name]
+        try:
+            return adjust_lrl_step(min(max(float(value), low), high))
+        except (TypeError, ValueError):
+            return None
+    low, high, step = PARAM_CONFIG[name]
+    value = RoundingHelper.round_value(value, low, high, step)
+    # drop float noise from the step arithmetic (0.1 * 3 -> 0.3)
+    return round(value, 6) if isinstance(value, float) else value
+
+
+def report_kwargs(username, mode, params, device_serial="UNKNOWN", output_filename=None,
+                  egram_data=None, **options):
+    # generate_report arguments for one user/mode; params in display order
+    labels = [p for p in MODE_PARAMETERS.get(mode, params) if p in params]
+    return dict(
+        device_model="Pacemaker",
+        device_serial=device_serial or "UNKNOWN",
+        application_model="Pacemaker",
+        application_version="1.0",
+        dcm_serial=username,
+        report_name=f"{mode} Parameter Report",
+        labels=labels,
+        parameters=[params[p] for p in labels],
+        egram_data=egram_data,
+        output_filename=output_filename or f"{username}_{mode}_report.pdf".replace(" ", "_"),
+        **options,
+    )
+
+
+class DCMSession:
+    # Everything a DCM user can do, without a display: the Tk Application
+    # and command line tools both drive one of these
+    def __init__(self, db=None, username=None, sessions_dir="sessions"):
+        self.db = db if db is not None else DataManager()
+        self.username = username
+        self.sessions_dir = sessions_dir
+
+        # live egram stream; readers subscribe, nothing drains the main cursor
+        self.queue = FloatQueue()
+        self.queue.pause()
+
+        self.uart = None
+        self.recorder = None
+        self.recording = None      # (file, samples) of the current or last recording
+
+    # --- login ---
+
+    def login(self, username, password):
+        if not self.db.validate_user(username, password):
+            return False, "Invalid username or password"
+        self.username = username
+        return True, "Logged in"
+
+    def register(self, username, password):
+        return self.db.add_user(username, password)
+
+    def logout(self):
+        self.disconnect()
+        self.db.flush()
+        self.username = None
+
+    # --- modes and parameters ---
+
+    @property
+    def mode(self):
+        return self.db.get_state(self.username)
+
+    def parameters(self, mode=None):
+        # saved values of a mode, defaults for anything not saved yet
+        mode = mode or self.mode
+        saved = self.db.get_parameters(self.username, state_name=mode) or {}
+        return {p: saved.get(p, PARAM_DEFAULTS[p]) for p in MODE_PARAMETERS.get(mode, [])}
+
+    def validate(self, params, mode=None):
+        # Returns (rounded params of the mode, list of error messages)
+        mode = mode or self.mode
+        if mode not in MODE_PARAMETERS:
+            return {}, ["No pacing mode selected."]
+
+        clean, errors = {}, []
+        for p in MODE_PARAMETERS[mode]:
+            if p not in params:
+                continue
+            value = round_param(p, params[p])
+            if value is None:
+                errors.append(f"{p}: not a number")
+            else:
+                clean[p] = value
+
+        for p in params:
+            if p not in MODE_PARAMETERS[mode]:
+                errors.append(f"{p} is not used in {mode}")
+
+        lrl = clean.get("Lower Rate Limit")
+        url = clean.get("Upper Rate Limit")
+        if lrl is not None and url is not None and lrl > url:
+            errors.append("LRL cannot exceed URL")
+
+        return clean, errors
+
+    def set_parameters(self, params, mode=None):
+        # Validate and save; returns (ok, message)
+        mode = mode or self.mode
+        clean, errors = self.validate(params, mode)
+        if errors:
+            return False, "; ".join(errors)
+
+        _, msg = self.db.save_parameters(self.username, dict(self.parameters(mode), **clean),
+                                         state_name=mode)
+        return True, f"{msg} (Mode: {mode})"
+
+    def select_mode(self, name, current=None):
+        # Keep the outgoing mode's `current` values, switch, and return the
+        # new mode's parameters (saved, else defaults), all in one write
+        with self.db.batch():
+            last = self.mode
+            if last and current:
+                self.db.save_parameters(self.username, current, state_name=last)
+
+            self.db.save_state(self.username, name)
+
+            params = self.parameters(name)
+            self.db.save_parameters(self.username, params, state_name=name)
+        return params
+
+    # --- device ---
+
+    def _uart(self):
+        if not self.uart:
+            self.uart = uart_comm.UARTComm(queue=self.queue, db=self.db)
+        return self.uart
+
+    @property
+    def connected(self):
+        return bool(self.uart and self.uart.ser and self.uart.ser.is_open)
+
+    def connect(self, ports=None, record=True, program=False):
+        # program=True probes by sending the saved parameters (see UARTComm.connect)
+        uart = self._uart()
+        if not uart.connect(self.username, ports, program):
+            if self.uart is uart:
+                self.uart = None
+            return False
+        if self.uart is not uart:
+            # disconnected (or logged out) while the ports were being probed
+            uart.disconnect()
+            return False
+        if record:
+            self.start_recording()
+        return True
+
+    def connect_async(self, ports=None, record=True, program=False):
+        # connect() on a worker thread, since probing silent ports takes up
+        # to probe_timeout; returns a Future resolving to True/False
+        self._uart()
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def work():
+            try:
+                future.set_result(self.connect(ports, record, program))
+            except Exception as e:
+                future.set_exception(e)
+
+        Thread(target=work, name="uart-connect", daemon=True).start()
+        return future
+
+    def connect_simulated(self, record=True, **options):
+        # a simulated pacemaker instead of a serial port, for load tests
+        from device_simulator import connect_loopback
+        device = connect_loopback(self._uart(), **options)
+        if record:
+            self.start_recording()
+        return device
+
+    def disconnect(self):
+        if self.uart:
+            try:
+                self.uart.disconnect()
+            except Exception:
+                pass
+            self.uart = None
+        self.stop_recording()
+
+    def send(self, params=None, mode=None, **verify_args):
+        # Save `params` (if given), make sure they are on disk, then send and
+        # verify; returns a Future resolving to a uart_comm.VerifyResult
+        mode = mode or self.mode
+        if params is not None:
+            clean, errors = self.validate(params, mode)
+            if errors:
+                raise ValueError("; ".join(errors))
+            with self.db.batch():
+                # a partial set only changes the parameters it names
+                self.db.save_parameters(self.username, dict(self.parameters(mode), **clean),
+                                        state_name=mode)
+                self.db.save_state(self.username, mode)
+        self.db.flush()
+
+        if not self.connected:
+            raise Exception("Device not connected")
+        return self.uart.send_and_verify(self.username, mode=mode, **verify_args)
+
+    def poll(self):
+        # Move decoded frames into the egram stream; latest echo or None
+        if self.uart:
+            return self.uart.poll_egram()
+        return None
+
+    # --- egram ---
+
+    def subscribe_egram(self, name=None):
+        return self.queue.subscribe(name)
+
+    def egram_snapshot(self):
+        # copies of the report history, safe to hand to another thread
+        return tuple(x.copy() for x in self.queue.get_report_arrays())
+
+    def egram_source(self):
+        # Report egram data: the current (else last) recording up to now,
+        # streamed from its file. Only without any recording does the report
+        # fall back to the queue's short history.
+        if self.recorder:
+            self.recorder.flush()
+            self.recording = (self.recorder.filename, self.recorder.samples_written)
+        if self.recording:
+            return recorded_chunks(*self.recording)
+        return self.egram_snapshot()
+
+    def start_recording(self):
+        # every connection gets its own session file
+        self.stop_recording()
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.recorder = SessionRecorder(f"{self.sessions_dir}/{self.username}_{stamp}.egram")
+        if self.uart:
+            self.uart.recorder = self.recorder
+
+    def stop_recording(self):
+        if self.recorder:
+            if self.uart:
+                self.uart.recorder = None
+            self.recorder.close()
+            self.recording = (self.recorder.filename, self.recorder.samples_written)
+            self.recorder = None
+
+    # --- reports ---
+
+    def report_kwargs(self, mode=None, params=None, device_serial=None, egram_data=None, **options):
+        mode = mode or self.mode
+        params = params if params is not None else self.parameters(mode)
+        if egram_data is None:
+            egram_data = self.egram_source()
+        return report_kwargs(self.username, mode, params, device_serial, egram_data=egram_data,
+                             **options)
+
+    def report(self, mode=None, **options):
+        # Build a report now (blocking); returns the output file name
+        kwargs = self.report_kwargs(mode, **options)
+        generate_report(**kwargs)
+        return kwargs["output_filename"]
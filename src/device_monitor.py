@@ -0,0 +1,134 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+from queue import Queue, Empty
+from threading import Thread, Event, Lock
+
+import serial.tools.list_ports
+
+# inotify flags (linux/inotify.h)
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000            # same value as O_NONBLOCK
+IN_EVENT = struct.Struct("iIII")   # wd, mask, cookie, name length
+
+# Device node prefixes that can be serial ports
+SERIAL_PREFIXES = ("tty", "cu.", "rfcomm")
+
+
+def _open_inotify(path):
+    # Returns an inotify fd watching `path`, or None where unsupported
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, path.encode(), IN_CREATE | IN_DELETE) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+class DeviceMonitor:
+    def __init__(self, interval=2.0, settle=0.3, watch_dir="/dev"):
+        self.interval = interval    # fallback polling period (s)
+        self.settle = settle        # wait after a /dev event before enumerating
+        self.watch_dir = watch_dir
+
+        self.events = Queue()       # ("added" | "removed", port) for the GUI
+        self.lock = Lock()
+        self.known = {}             # device path -> ListPortInfo
+        self.stop_event = Event()
+        self.thread = None
+        self.inotify_fd = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+
+        # Take the first snapshot synchronously so ports() is valid at once
+        self._rescan()
+
+        self.stop_event.clear()
+        self.inotify_fd = _open_inotify(self.watch_dir)
+        target = self._watch_loop if self.inotify_fd is not None else self._poll_loop
+        self.thread = Thread(target=target, name="device-monitor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=2.0)
+        self.thread = None
+
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+    def ports(self):
+        # Cached list, never enumerates
+        with self.lock:
+            return list(self.known.values())
+
+    def poll(self):
+        # Drain pending connect/disconnect events (GUI thread)
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Empty:
+                return events
+
+    def _rescan(self):
+        current = {p.device: p for p in serial.tools.list_ports.comports()}
+
+        with self.lock:
+            added = [p for d, p in current.items() if d not in self.known]
+            removed = [p for d, p in self.known.items() if d not in current]
+            self.known = current
+
+        for p in removed:
+            self.events.put(("removed", p))
+        for p in added:
+            self.events.put(("added", p))
+
+    def _poll_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self._rescan()
+
+    def _watch_loop(self):
+        fd = self.inotify_fd
+
+        while not self.stop_event.is_set():
+            # Wake at most once a second to notice stop()
+            ready, _, _ = select.select([fd], [], [], 1.0)
+            if not ready:
+                continue
+
+            try:
+                data = os.read(fd, 4096)
+            except OSError:
+                continue
+
+            if self._touches_serial(data):
+                # let udev finish creating the node before enumerating
+                self.stop_event.wait(self.settle)
+                self._rescan()
+
+    def _touches_serial(self, data):
+        off = 0
+        while off + IN_EVENT.size <= len(data):
+            _, _, _, length = IN_EVENT.unpack_from(data, off)
+            off += IN_EVENT.size
+            name = data[off:off + length].rstrip(b"\0").decode(errors="ignore")
+            off += length
+            if name.startswith(SERIAL_PREFIXES):
+                return True
+        return False
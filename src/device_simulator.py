@@ -0,0 +1,177 @@
+import os
+import time
+from threading import Thread, Event, Condition, Lock
+
+import numpy as np
+
+from packet_codec import HDR1, HDR2, ECG_HDR, ECHO_STRUCT, expected_echo
+from uart_comm import FrameParser
+
+
+class SimulatedPacemaker:
+    # Speaks the real UART framing: two-byte ECG frames out, parameter
+    # frames in, each answered with an echo of what was received
+    def __init__(self, sample_rate=1000, noise=0.05, burst=1, corruption=0.0, seed=None):
+        self.sample_rate = sample_rate   # ECG frames per second
+        self.noise = noise               # gaussian noise (V)
+        self.burst = burst               # frames written together
+        self.corruption = corruption     # chance a frame loses its header byte
+        self.rng = np.random.default_rng(seed)
+
+        self.params = expected_echo("AOO", None)
+        self.parser = FrameParser()
+        self.lock = Lock()
+        self.sample_index = 0
+        self.frames_sent = 0
+        self.frames_corrupted = 0
+
+    def receive(self, data):
+        # Bytes from the DCM; returns the bytes the device sends back
+        out = bytearray()
+        with self.lock:
+            for kind, value in self.parser.feed(data):
+                if kind == "ECHO":
+                    self.params = value
+                    out += bytes([HDR1, HDR2]) + ECHO_STRUCT.pack(*value)
+        return bytes(out)
+
+    def ecg_frames(self, n):
+        t = (self.sample_index + np.arange(n)) / self.sample_rate
+        self.sample_index += n
+
+        # one atrial then one ventricular spike per beat at the programmed rate
+        period = 60.0 / max(1, self.params.lrl)
+        phase = t % period
+        a = 0.5 + 4.0 * np.exp(-((phase - 0.02) / 0.01) ** 2)
+        v = 0.5 + 4.2 * np.exp(-((phase - 0.17) / 0.012) ** 2)
+        a += self.rng.normal(0.0, self.noise, n)
+        v += self.rng.normal(0.0, self.noise, n)
+
+        frames = np.empty((n, 3), dtype=np.uint8)
+        frames[:, 0] = ECG_HDR
+        frames[:, 1] = np.clip(a / 5.0 * 255.0, 0, 255)
+        frames[:, 2] = np.clip(v / 5.0 * 255.0, 0, 255)
+
+        if self.corruption:
+            hit = self.rng.random(n) < self.corruption
+            frames[hit, 0] = self.rng.integers(0, 0xA0, hit.sum())
+            self.frames_corrupted += int(hit.sum())
+
+        self.frames_sent += n
+        return frames.tobytes()
+
+    def run(self, write, stop):
+        # Call write(bytes) at sample_rate until stop is set
+        start = time.perf_counter()
+        sent = 0
+        tick = self.burst / self.sample_rate
+
+        while not stop.is_set():
+            due = int((time.perf_counter() - start) * self.sample_rate) - sent
+            if due >= self.burst:
+                write(self.ecg_frames(due))
+                sent += due
+            stop.wait(max(tick, 0.001))
+
+
+class LoopbackSerial:
+    # In-memory stand-in for serial.Serial, with no baud rate limit
+    def __init__(self, device, timeout=0.3, port="loop://simulator"):
+        self.device = device
+        self.timeout = timeout
+        self.port = port
+        self.is_open = True
+
+        self.buf = bytearray()
+        self.cond = Condition()
+        self.stop = Event()
+        self.thread = Thread(target=device.run, args=(self._deliver, self.stop),
+                             name="simulator", daemon=True)
+        self.thread.start()
+
+    def _deliver(self, data):
+        with self.cond:
+            self.buf += data
+            self.cond.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self.buf)
+
+    def read(self, size=1):
+        with self.cond:
+            if not self.buf and self.is_open:
+                self.cond.wait(self.timeout)
+            data = bytes(self.buf[:size])
+            del self.buf[:size]
+        return data
+
+    def write(self, data):
+        reply = self.device.receive(data)
+        if reply:
+            self._deliver(reply)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self.cond:
+            self.buf.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.stop.set()
+        self.is_open = False
+        with self.cond:
+            self.cond.notify_all()
+
+
+def connect_loopback(uart, device=None, **options):
+    # Attach a UARTComm to a simulator without any serial hardware
+    device = device or SimulatedPacemaker(**options)
+    uart.ser = LoopbackSerial(device)
+    uart.start_reader()
+    return device
+
+
+class PtySimulator:
+    # Simulator behind a pseudo-terminal pair; `port` opens like a real device
+    def __init__(self, device=None, **options):
+        import pty
+        import tty
+
+        self.device = device or SimulatedPacemaker(**options)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.stop_event = Event()
+
+        self.writer = Thread(target=self.device.run, args=(self._write, self.stop_event),
+                             name="pty-simulator", daemon=True)
+        self.reader = Thread(target=self._read_loop, name="pty-simulator-rx", daemon=True)
+        self.writer.start()
+        self.reader.start()
+
+    def _write(self, data):
+        try:
+            os.write(self.master, data)
+        except OSError:
+            self.stop_event.set()
+
+    def _read_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            reply = self.device.receive(data)
+            if reply:
+                self._write(reply)
+
+    def close(self):
+        self.stop_event.set()
+        os.close(self.slave)
+        os.close(self.master)
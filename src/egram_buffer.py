@@ -0,0 +1,301 @@
+import time
+
+import numpy as np
+
+import perf_stats
+
+
+class Subscription:
+    # One reader's cursor into a FloatQueue's shared ring. Cursors count
+    # samples ever written, so readers never disturb each other.
+    def __init__(self, queue, name=None):
+        self.queue = queue
+        self.name = name
+        self.cursor = queue.written
+        self.dropped = 0          # samples lost to overflow before this reader got them
+        self.closed = False
+
+    @property
+    def count(self):
+        if self.closed:
+            return 0
+        return self.queue.written - self.cursor
+
+    def empty(self):
+        return self.count == 0
+
+    def drain(self):
+        # Every unread sample as (t, A, V) arrays; views are only valid until
+        # the next push
+        if self.closed:
+            self.cursor = self.queue.written
+        start, self.cursor = self.cursor, self.queue.written
+        return self.queue._span(start, self.cursor)
+
+    def pop(self):
+        if self.empty():
+            return None
+        q = self.queue
+        i = self.cursor % q.capacity
+        self.cursor += 1
+
+        sample = {"t": float(q.buf_t[i])}
+        if not np.isnan(q.buf_a[i]):
+            sample["A"] = float(q.buf_a[i])
+        if not np.isnan(q.buf_v[i]):
+            sample["V"] = float(q.buf_v[i])
+        return sample
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.subscribers.remove(self)
+
+
+class FloatQueue:
+    # Live samples go into one shared ring; every reader (graphs, analysers)
+    # holds its own Subscription. The ring grows up to max_capacity, then the
+    # policy either drops the slowest readers' oldest unread samples or halves
+    # the backlog's resolution. drain()/pop()/empty() read the queue's own
+    # main subscription, as before.
+    POLICIES = ("drop-oldest", "decimate")
+
+    def __init__(self, max_store=5000, capacity=4096, max_capacity=65536, policy="drop-oldest"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown overflow policy: {policy}")
+        self.t0 = time.monotonic()   # timestamps are seconds since creation
+
+        # live ring for plotting (time, atrial, ventricular), indexed by
+        # absolute sample number modulo capacity
+        self.capacity = min(capacity, max_capacity)
+        self.max_capacity = max_capacity
+        self.policy = policy
+        self.buf_t = np.zeros(self.capacity, dtype=np.float32)
+        self.buf_a = np.full(self.capacity, np.nan, dtype=np.float32)
+        self.buf_v = np.full(self.capacity, np.nan, dtype=np.float32)
+        self.written = 0             # samples ever written to the ring
+
+        # live samples lost to overflow (all readers), and skipped while
+        # nobody was subscribed
+        self.dropped = 0
+        self.skipped = 0
+
+        self.subscribers = []
+        self.main = self.subscribe("main")
+
+        # saved data for reports (bounded)
+        self.max_store = max_store
+        self.hist_t = np.zeros(max_store, dtype=np.float32)
+        self.hist_a = np.full(max_store, np.nan, dtype=np.float32)
+        self.hist_v = np.full(max_store, np.nan, dtype=np.float32)
+        self.hist_len = 0
+
+    def subscribe(self, name=None):
+        # New reader starting at the next sample pushed
+        sub = Subscription(self, name)
+        self.subscribers.append(sub)
+        return sub
+
+    @property
+    def paused(self):
+        # with no readers the live ring is not written at all
+        return not self.subscribers
+
+    def pause(self):
+        # Detach the main reader (graphs hold their own subscriptions)
+        self.main.close()
+
+    def resume(self):
+        if self.main.closed:
+            self.main = self.subscribe("main")
+
+    @property
+    def count(self):
+        return self.main.count
+
+    def push(self, sample):
+        # Ensure valid dictionary format
+        if not isinstance(sample, dict):
+            return
+
+        # Must contain at least one channel
+        if "A" not in sample and "V" not in sample:
+            return
+
+        t = sample.get("t")
+        if t is None:
+            t = time.monotonic() - self.t0
+        a = np.nan if sample.get("A") is None else sample["A"]
+        v = np.nan if sample.get("V") is None else sample["V"]
+
+        if self.paused:
+            self.skipped += 1
+        else:
+            self._make_room(1)
+            i = self.written % self.capacity
+            self.buf_t[i] = t
+            self.buf_a[i] = a
+            self.buf_v[i] = v
+            self.written += 1
+
+        # Save sample history (bounded)
+        if self.hist_len < self.max_store:
+            j = self.hist_len
+            self.hist_t[j] = t
+            self.hist_a[j] = a
+            self.hist_v[j] = v
+            self.hist_len += 1
+
+    def push_many(self, samples, t=None):
+        # samples: (n, 2) array of atrial/ventricular values; NaN marks a missing channel
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1, 2)
+        n = len(samples)
+        if n == 0:
+            return
+
+        if t is None:
+            t = np.full(n, time.monotonic() - self.t0, dtype=np.float32)
+        else:
+            t = np.asarray(t, dtype=np.float32)
+
+        a = samples[:, 0]
+        v = samples[:, 1]
+
+        # Save sample history (bounded)
+        keep = min(n, self.max_store - self.hist_len)
+        if keep > 0:
+            j = self.hist_len
+            self.hist_t[j:j + keep] = t[:keep]
+            self.hist_a[j:j + keep] = a[:keep]
+            self.hist_v[j:j + keep] = v[:keep]
+            self.hist_len += keep
+
+        if self.paused:
+            self.skipped += n
+            return
+
+        # a block larger than the whole ring is thinned before it goes in
+        if n > self.max_capacity:
+            if self.policy == "decimate":
+                step = -(-n // self.max_capacity)
+                t, a, v = t[::step], a[::step], v[::step]
+            else:
+                t, a, v = t[-self.max_capacity:], a[-self.max_capacity:], v[-self.max_capacity:]
+            self._drop(None, n - len(t))
+            n = len(t)
+
+        self._make_room(n)
+        tail = self.written % self.capacity
+        first = min(n, self.capacity - tail)
+        for dst, src in ((self.buf_t, t), (self.buf_a, a), (self.buf_v, v)):
+            dst[tail:tail + first] = src[:first]
+            dst[:n - first] = src[first:]
+        self.written += n
+
+    def _drop(self, sub, n):
+        if sub is not None:
+            sub.dropped += n
+        self.dropped += n
+        perf_stats.count("queue_dropped", n)
+
+    def _backlog(self):
+        # unread samples of the slowest reader
+        return max(sub.count for sub in self.subscribers)
+
+    def _make_room(self, n):
+        # Grow up to max_capacity, then apply the overflow policy
+        if self._backlog() + n <= self.capacity:
+            return
+        if self.capacity < self.max_capacity:
+            self._grow(min(max(self.capacity * 2, self._backlog() + n), self.max_capacity))
+            if self._backlog() + n <= self.capacity:
+                return
+
+        w = self.written
+        if self.policy == "drop-oldest" or n >= self.capacity:
+            oldest = w + n - self.capacity
+            for sub in self.subscribers:
+                if sub.cursor < oldest:
+                    self._drop(sub, min(oldest, w) - sub.cursor)
+                    sub.cursor = min(oldest, w)
+            return
+
+        # decimate: keep every other backlog sample (counting back from the
+        # newest) until the new block fits; readers keep their relative place
+        k = self._backlog()
+        t, a, v = (x.copy() for x in self._span(w - k, w))
+        halvings = 0
+        while k + n > self.capacity:
+            t, a, v = t[(k - 1) % 2::2], a[(k - 1) % 2::2], v[(k - 1) % 2::2]
+            k = len(t)
+            halvings += 1
+
+        idx = np.arange(w - k, w) % self.capacity
+        self.buf_t[idx] = t
+        self.buf_a[idx] = a
+        self.buf_v[idx] = v
+
+        for sub in self.subscribers:
+            left = sub.count
+            for _ in range(halvings):
+                left = (left + 1) // 2
+            self._drop(sub, sub.count - left)
+            sub.cursor = w - left
+
+    def _grow(self, size):
+        # Enlarge the ring, moving the samples readers still need
+        w = self.written
+        k = self._backlog()
+        t, a, v = self._span(w - k, w)
+
+        buf_t = np.zeros(size, dtype=np.float32)
+        buf_a = np.full(size, np.nan, dtype=np.float32)
+        buf_v = np.full(size, np.nan, dtype=np.float32)
+        idx = np.arange(w - k, w) % size
+        buf_t[idx] = t
+        buf_a[idx] = a
+        buf_v[idx] = v
+
+        self.buf_t, self.buf_a, self.buf_v = buf_t, buf_a, buf_v
+        self.capacity = size
+
+    def _span(self, start, stop):
+        # Samples [start, stop) by absolute number: views when contiguous,
+        # copies when the span wraps
+        n = stop - start
+        i = start % self.capacity
+        if i + n <= self.capacity:
+            return (self.buf_t[i:i + n], self.buf_a[i:i + n], self.buf_v[i:i + n])
+
+        wrap = i + n - self.capacity
+        return tuple(np.concatenate((buf[i:], buf[:wrap]))
+                     for buf in (self.buf_t, self.buf_a, self.buf_v))
+
+    def pop(self):
+        return self.main.pop()
+
+    def drain(self):
+        # Take every unread sample of the main reader as (t, A, V) arrays.
+        # Views are only valid until the next push.
+        return self.main.drain()
+
+    def empty(self):
+        return self.main.empty()
+
+    def get_report_arrays(self):
+        n = self.hist_len
+        return self.hist_t[:n], self.hist_a[:n], self.hist_v[:n]
+
+    def get_report_data(self):
+        data = []
+        for t, a, v in zip(*(x.tolist() for x in self.get_report_arrays())):
+            sample = {"t": t}
+            if a == a:   # skip NaN (missing channel)
+                sample["A"] = a
+            if v == v:
+                sample["V"] = v
+            data.append(sample)
+        return data
+
+    def clear_report_data(self):
+        self.hist_len = 0
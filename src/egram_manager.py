@@ -1,146 +1,333 @@
 import tkinter as tk
-from collections import deque
 import random
+import time
+
+import numpy as np
 
 import matplotlib
 matplotlib.use("TkAgg")
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
 
+import perf_stats
+from egram_buffer import FloatQueue, Subscription   # live sample ring (no Tk needed)
+
+
+class MinMaxDecimator:
+    def __init__(self, buckets, per_bucket):
+        self.buckets = buckets          # one bucket per horizontal pixel
+        self.per_bucket = per_bucket    # samples folded into each bucket
+
+        # envelope per bucket, newest at the end
+        self.mins = np.zeros(buckets, dtype=np.float32)
+        self.maxs = np.zeros(buckets, dtype=np.float32)
+
+        # samples of the bucket still being filled
+        self.partial = np.empty(per_bucket, dtype=np.float32)
+        self.fill = 0
+
+    def push(self, samples):
+        samples = samples[~np.isnan(samples)]
+        pb = self.per_bucket
+
+        # top up the open bucket first
+        if self.fill:
+            take = min(pb - self.fill, len(samples))
+            self.partial[self.fill:self.fill + take] = samples[:take]
+            self.fill += take
+            samples = samples[take:]
+            if self.fill < pb:
+                return
+            self._shift_in(self.partial.min(keepdims=True), self.partial.max(keepdims=True))
+            self.fill = 0
+
+        # fold whole buckets in one vectorised step
+        whole = len(samples) // pb * pb
+        if whole:
+            blocks = samples[:whole].reshape(-1, pb)
+            self._shift_in(blocks.min(axis=1), blocks.max(axis=1))
+
+        rest = samples[whole:]
+        self.partial[:len(rest)] = rest
+        self.fill = len(rest)
+
+    def set_per_bucket(self, per_bucket):
+        # Buckets from here on fold `per_bucket` samples; drawn ones stay
+        if per_bucket == self.per_bucket:
+            return
+        partial = self.partial[:self.fill]
+        self.per_bucket = per_bucket
+        self.partial = np.empty(per_bucket, dtype=np.float32)
+        self.fill = 0
+        self.push(partial)
+
+    def _shift_in(self, mins, maxs):
+        k = len(mins)
+        if k >= self.buckets:
+            self.mins[:] = mins[-self.buckets:]
+            self.maxs[:] = maxs[-self.buckets:]
+            return
+        self.mins[:-k] = self.mins[k:]
+        self.maxs[:-k] = self.maxs[k:]
+        self.mins[-k:] = mins
+        self.maxs[-k:] = maxs
+
+    def envelope(self, out):
+        # interleave min/max so one polyline shows every spike
+        out[0::2] = self.mins
+        out[1::2] = self.maxs
+        return out
+
+
+class EgramRenderer:
+    # Figure, axes and blitted lines for an egram view, independent of Tk.
+    # make_canvas(fig) builds the canvas (TkAgg in the GUI, plain Agg headless).
+    def __init__(self, mode, make_canvas=FigureCanvasAgg, window=10.0, sample_rate=1000):
+        self.mode = mode      # A, V, or BOTH
+        self.window = window          # seconds of signal on screen
+        self.sample_rate = sample_rate  # samples per second; first guess, then measured
 
-class FloatQueue:
-    def __init__(self, max_store=5000):
-        self.buffer = deque()      # live queue for plotting
-        self.history = []          # saved data for reports
-        self.max_store = max_store # max history length
+        # rate measurement from sample timestamps (see _measure_rate)
+        self.rate_start = None
+        self.rate_count = 0
+        self.rate_last = None
 
-    def push(self, sample):
-        # Ensure valid dictionary format
-        if not isinstance(sample, dict):
-            return
+        # create figure layout based on mode
+        if self.mode == "BOTH":
+            self.fig = Figure(figsize=(7, 4), dpi=100)
+            self.axA = self.fig.add_subplot(211)
+            self.axV = self.fig.add_subplot(212)
+        else:
+            self.fig = Figure(figsize=(7, 3), dpi=100)
+            self.ax = self.fig.add_subplot(111)
+
+        self.canvas = make_canvas(self.fig)
+
+        # axes and lines are built once; frames only update line data
+        self.lines = []          # (Line2D, channel label)
+        self.decimators = {}     # channel label -> MinMaxDecimator
+        self.envelopes = {}      # channel label -> interleaved min/max y data
+        self.background = None
+        self.buckets = 0
+        self.overlay = None      # optional stats text drawn over the plot
+        self._setup_axes()
 
-        # Must contain at least one channel
-        if "A" not in sample and "V" not in sample:
+        # blitting needs a cached background, refreshed on every full draw (resize etc.)
+        self.blit = getattr(self.canvas, "supports_blit", False)
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+        self.canvas.draw()
+
+    def hide_numbers_keep_labels(self, axis):
+        axis.set_xticklabels([])        # remove x-axis values
+        axis.tick_params(axis='both', length=4)
+
+    def _setup_axes(self):
+        if self.mode == "BOTH":
+            panels = [(self.axA, "Atrial"), (self.axV, "Ventricular")]
+        elif self.mode == "A":
+            panels = [(self.ax, "Atrial")]
+        else:
+            panels = [(self.ax, "Ventricular")]
+
+        for ax, label in panels:
+            line, = ax.plot([], [], animated=True)
+            ax.set_ylim(0, 5)
+            ax.set_ylabel(label)
+            self.hide_numbers_keep_labels(ax)
+            self.lines.append((line, label))
+
+        panels[-1][0].set_xlabel(f"Last {self.window:g} s")
+        self._resize_buckets()
+
+    def _resize_buckets(self):
+        # one min/max bucket per pixel of plot width
+        ax = self.lines[0][0].axes
+        buckets = max(1, int(ax.bbox.width))
+        self.buckets = buckets
+        per_bucket = self._per_bucket()
+
+        x = np.repeat(np.arange(buckets), 2)
+        for line, label in self.lines:
+            self.decimators[label] = MinMaxDecimator(buckets, per_bucket)
+            self.envelopes[label] = np.zeros(2 * buckets, dtype=np.float32)
+            line.set_data(x, self.envelopes[label])
+            line.axes.set_xlim(0, buckets - 1)
+            line.axes.invert_xaxis()
+
+    def _per_bucket(self):
+        return max(1, int(np.ceil(self.window * self.sample_rate / self.buckets)))
+
+    def _measure_rate(self, t):
+        # Samples per second from the stream's own timestamps, checked about
+        # once a second; a gap in the stream starts the measurement over
+        if self.rate_last is None or t[0] - self.rate_last > 0.5:
+            self.rate_start, self.rate_count = float(t[0]), -1
+        self.rate_last = float(t[-1])
+        self.rate_count += len(t)
+
+        span = self.rate_last - self.rate_start
+        if span < 1.0:
             return
+        rate = self.rate_count / span
+        self.rate_start, self.rate_count = self.rate_last, 0
+
+        # re-bucket only on a real change, not read jitter
+        if abs(rate - self.sample_rate) > 0.05 * self.sample_rate:
+            self.sample_rate = rate
+            for decimator in self.decimators.values():
+                decimator.set_per_bucket(self._per_bucket())
+
+    def set_window(self, seconds):
+        self.window = seconds
+        self.lines[-1][0].axes.set_xlabel(f"Last {seconds:g} s")
+        self._resize_buckets()
+        self.canvas.draw_idle()
 
-        self.buffer.append(sample.copy())
+    def show_overlay(self, on):
+        if on and self.overlay is None:
+            self.overlay = self.fig.text(0.01, 0.99, "", va="top", ha="left", fontsize=8,
+                                         family="monospace", animated=True,
+                                         bbox=dict(facecolor="white", alpha=0.7, lw=0))
+        elif not on and self.overlay is not None:
+            self.overlay.remove()
+            self.overlay = None
+        self.canvas.draw_idle()
+
+    def set_overlay_text(self, text):
+        if self.overlay is not None:
+            self.overlay.set_text(text)
 
-        # Save sample history (bounded)
-        if len(self.history) < self.max_store:
-            self.history.append(sample.copy())
+    def _draw_animated(self):
+        for line, _ in self.lines:
+            line.axes.draw_artist(line)
+        if self.overlay is not None:
+            self.fig.draw_artist(self.overlay)
 
-    def pop(self):
-        if self.buffer:
-            return self.buffer.popleft()
-        return None
+    def _on_draw(self, event):
+        # start over if the plot width changed (e.g. window resize)
+        if int(self.lines[0][0].axes.bbox.width) != self.buckets:
+            self._resize_buckets()
 
-    def empty(self):
-        return len(self.buffer) == 0
+        # Cache everything except the animated artists, then paint them on top
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
 
-    def get_report_data(self):
-        return list(self.history)
+    def render(self, a_vals, v_vals, t_vals=None):
+        # t_vals (sample timestamps, s) keep the window's length right for
+        # whatever rate the device actually streams at
+        if t_vals is not None and len(t_vals):
+            self._measure_rate(t_vals)
 
-    def clear_report_data(self):
-        self.history.clear()
+        for line, label in self.lines:
+            decimator = self.decimators[label]
+            decimator.push(a_vals if label == "Atrial" else v_vals)
+            line.set_ydata(decimator.envelope(self.envelopes[label]))
+
+        # refresh canvas
+        if self.blit and self.background is not None:
+            self.canvas.restore_region(self.background)
+            self._draw_animated()
+            self.canvas.blit(self.fig.bbox)
+        else:
+            self.canvas.draw_idle()
 
 
 class EgramGraph(tk.Frame):
-    def __init__(self, parent, queue, mode):
+    def __init__(self, parent, queue, mode, window=10.0, sample_rate=1000, interval=30,
+                 fake_data=False):
         super().__init__(parent)
         self.queue = queue     # input data queue
         self.mode = mode      # A, V, or BOTH
+        self.interval = interval  # ms between frames
+        self.fake_data = fake_data  # fill idle frames with random samples (demo only)
 
-        # graph buffer sizes
-        self.max_points = 1000
-        self.atrium_data = deque([0.0] * self.max_points, maxlen=self.max_points)
-        self.vent_data = deque([0.0] * self.max_points, maxlen=self.max_points)
+        # each graph reads the shared stream through its own cursor
+        self.reader = queue.subscribe("graph")
+        self.bind("<Destroy>", self._on_destroy)
 
-        # create figure layout based on mode
-        if self.mode == "BOTH":
-            self.fig = Figure(figsize=(7, 4), dpi=100)
-            self.axA = self.fig.add_subplot(211)
-            self.axV = self.fig.add_subplot(212)
-        else:
-            self.fig = Figure(figsize=(7, 3), dpi=100)
-            self.ax = self.fig.add_subplot(111)
+        # perf overlay: counters from the last refresh, to turn into rates.
+        # fps counts this graph's own frames; the global counter adds up
+        # every open graph.
+        self.stats_prev = None
+        self.frames_drawn = 0
+        self.backlog = 0         # unread samples at the start of the last frame
+        self.stats_every = 0.5   # s between overlay refreshes
 
         # embed matplotlib into tkinter
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
+        self.renderer = EgramRenderer(mode, lambda fig: FigureCanvasTkAgg(fig, master=self),
+                                      window=window, sample_rate=sample_rate)
+        self.fig = self.renderer.fig
+        self.canvas = self.renderer.canvas
         self.canvas_widget = self.canvas.get_tk_widget()
         self.canvas_widget.pack(fill="both", expand=True)
 
         # start update loop
-        self.after(50, self.update_plot)
+        self.after(self.interval, self.update_plot)
 
-    def hide_numbers_keep_labels(self, axis):
-        axis.set_xticklabels([])        # remove x-axis values
-        axis.tick_params(axis='both', length=4)
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self.reader.close()
+
+    def set_window(self, seconds):
+        self.renderer.set_window(seconds)
+
+    def show_stats(self, on):
+        self.stats_prev = None
+        self.renderer.show_overlay(on)
+
+    def _update_stats(self):
+        snap = perf_stats.snapshot()
+        snap["frames_drawn"] = self.frames_drawn
+        prev = self.stats_prev
+        if prev is None:
+            self.stats_prev = snap
+            return
+        dt = snap["time"] - prev["time"]
+        if dt < self.stats_every:
+            return
+        self.stats_prev = snap
+
+        def rate(name):
+            return (snap["counters"].get(name, 0) - prev["counters"].get(name, 0)) / dt
+
+        draw = snap["histograms"].get("draw", {})
+        self.renderer.set_overlay_text(
+            f"fps     {(snap['frames_drawn'] - prev['frames_drawn']) / dt:6.1f}\n"
+            f"draw    {draw.get('p50', 0) * 1000:6.2f} ms p50\n"
+            f"backlog {self.backlog:6d}\n"
+            f"q drop  {self.reader.dropped:6d}\n"
+            f"dropped {snap['counters'].get('dropped_bytes', 0):6d} B\n"
+            f"serial  {rate('serial_bytes'):6.0f} B/s"
+        )
 
     def update_plot(self):
+        # stop once the widget has been destroyed
+        if not self.winfo_exists():
+            return
 
         # generate fake data if no real input present
-        if self.queue.empty():
+        if self.fake_data and self.reader.empty():
             fakeA = random.uniform(0, 5)
             fakeV = random.uniform(0, 5)
             self.queue.push({"A": fakeA, "V": fakeV})
 
         # consume all queued samples
-        while not self.queue.empty():
-            sample = self.queue.pop()
-            a_val = sample.get("A")
-            v_val = sample.get("V")
-            if a_val is not None:
-                self.atrium_data.append(float(a_val))
-            if v_val is not None:
-                self.vent_data.append(float(v_val))
-
-        # BOTH channels display
-        if self.mode == "BOTH":
-            self.axA.clear()
-            self.axV.clear()
-
-            self.axA.plot(list(self.atrium_data))
-            self.axV.plot(list(self.vent_data))
-
-            self.axA.set_ylim(0, 5)
-            self.axV.set_ylim(0, 5)
-
-            self.axA.invert_xaxis()
-            self.axV.invert_xaxis()
+        self.backlog = self.reader.count
+        perf_stats.gauge("queue_depth", self.backlog)
+        with perf_stats.timed("draw"):
+            t_vals, a_vals, v_vals = self.reader.drain()
+            self.renderer.render(a_vals, v_vals, t_vals)
+        perf_stats.count("frames_drawn")
+        self.frames_drawn += 1
 
-            self.axA.set_ylabel("Atrial")
-            self.axV.set_ylabel("Ventricular")
-            self.axV.set_xlabel("Samples")
+        if self.renderer.overlay is not None:
+            self._update_stats()
 
-            self.hide_numbers_keep_labels(self.axA)
-            self.hide_numbers_keep_labels(self.axV)
+        self.after(self.interval, self.update_plot)
 
-        # Atrial only
-        elif self.mode == "A":
-            self.ax.clear()
-            self.ax.plot(list(self.atrium_data))
-            self.ax.set_ylim(0, 5)
-            self.ax.invert_xaxis()
-            self.ax.set_ylabel("Atrial")
-            self.ax.set_xlabel("Samples")
-            self.hide_numbers_keep_labels(self.ax)
-
-        # Ventricular only
-        elif self.mode == "V":
-            self.ax.clear()
-            self.ax.plot(list(self.vent_data))
-            self.ax.set_ylim(0, 5)
-            self.ax.invert_xaxis()
-            self.ax.set_ylabel("Ventricular")
-            self.ax.set_xlabel("Samples")
-            self.hide_numbers_keep_labels(self.ax)
-
-        # refresh canvas
-        self.canvas.draw_idle()
-        self.after(50, self.update_plot)
 
-
-def open_egram_window(root, queue, channel_mode="BOTH"):
+def open_egram_window(root, queue, channel_mode="BOTH", window=10.0):
     mode = channel_mode if channel_mode in ("A", "V", "BOTH") else "BOTH"
 
     win = tk.Toplevel(root)
@@ -148,16 +335,55 @@ def open_egram_window(root, queue, channel_mode="BOTH"):
     win.geometry("900x500")
 
     # attach graph widget
-    graph = EgramGraph(win, queue, mode)
+    graph = EgramGraph(win, queue, mode, window=window)
     graph.pack(fill="both", expand=True)
 
     return win
 
 
-def embed_live_egram(parent, queue, mode):
+def embed_live_egram(parent, queue, mode, window=10.0):
     # remove any existing plots
     for w in parent.winfo_children():
         w.destroy()
 
-    graph = EgramGraph(parent, queue, mode)
+    graph = EgramGraph(parent, queue, mode, window=window)
+    graph.pack(fill="both", expand=True)
+
+
+def open_session_playback(root, reader, channel_mode="BOTH", window=10.0, speed=1.0):
+    # Replay a recorded SessionReader into a graph at `speed` x real time
+    mode = channel_mode if channel_mode in ("A", "V", "BOTH") else "BOTH"
+
+    win = tk.Toplevel(root)
+    win.title(f"Egram Review - {reader.filename}")
+    win.geometry("900x500")
+
+    queue = FloatQueue()
+    queue.pause()     # only the graph reads this queue
+    graph = EgramGraph(win, queue, mode, window=window,
+                       sample_rate=reader.sample_rate or 1000, fake_data=False)
     graph.pack(fill="both", expand=True)
+
+    clock = {"pos": reader.bases[0] if len(reader) else 0.0, "last": time.monotonic()}
+
+    # the reader (mmap and file) lives exactly as long as the window, even
+    # when playback reaches the end first
+    win.bind("<Destroy>", lambda e: reader.close() if e.widget is win else None)
+
+    def step():
+        if not win.winfo_exists():
+            return
+
+        now = time.monotonic()
+        clock["pos"] += (now - clock["last"]) * speed
+        clock["last"] = now
+
+        t, a, v = reader.read(reader.index_at(clock["pos"]) - reader.pos)
+        if len(t):
+            queue.push_many(np.column_stack((a, v)), t=t)
+
+        if reader.pos < len(reader):
+            win.after(graph.interval, step)
+
+    step()
+    return win
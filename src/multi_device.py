@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import serial.tools.list_ports
+
+import uart_comm
+from egram_buffer import FloatQueue
+
+
+class MultiDeviceSession:
+    def __init__(self, db, username):
+        self.db = db
+        self.username = username
+        self.devices = {}      # port device path -> UARTComm (each with its own FloatQueue)
+
+    def connect_all(self, ports=None):
+        # Probe and open every port at once; returns the paths that connected
+        if ports is None:
+            ports = list(serial.tools.list_ports.comports())
+        ports = [p for p in ports if p.device not in self.devices]
+        if not ports:
+            return []
+
+        def attach(p):
+            uart = uart_comm.UARTComm(queue=FloatQueue(), db=self.db)
+            return uart if uart.connect(self.username, [p]) else None
+
+        with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+            uarts = list(pool.map(attach, ports))
+
+        connected = []
+        for p, uart in zip(ports, uarts):
+            if uart:
+                self.devices[p.device] = uart
+                connected.append(p.device)
+        return connected
+
+    def connect_simulated(self, count, **options):
+        # `count` simulated pacemakers instead of serial ports, for load tests
+        from device_simulator import connect_loopback
+        connected = []
+        for i in range(count):
+            device = f"loop://simulator{len(self.devices)}"
+            uart = uart_comm.UARTComm(queue=FloatQueue(), db=self.db)
+            connect_loopback(uart, **options)
+            self.devices[device] = uart
+            connected.append(device)
+        return connected
+
+    def disconnect_all(self):
+        for uart in self.devices.values():
+            uart.disconnect()
+        self.devices.clear()
+
+    def program_all(self, mode=None, **verify_args):
+        # Send one saved mode/parameter set to every device concurrently;
+        # each send_and_verify already runs on its own worker thread
+        futures = {}
+        for device, uart in self.devices.items():
+            try:
+                futures[device] = uart.send_and_verify(self.username, mode=mode, **verify_args)
+            except Exception as e:
+                futures[device] = e
+        return futures
+
+    def wait_results(self, futures, timeout=None):
+        # device -> VerifyResult, or the exception that device raised
+        pending = [f for f in futures.values() if not isinstance(f, Exception)]
+        wait(pending, timeout=timeout)
+
+        results = {}
+        for device, f in futures.items():
+            if isinstance(f, Exception):
+                results[device] = f
+            elif not f.done():
+                results[device] = TimeoutError("no result yet")
+            elif f.exception():
+                results[device] = f.exception()
+            else:
+                results[device] = f.result()
+        return results
+
+    def poll(self):
+        # Drain every device's frames into its own queue (call from one thread)
+        echoes = {}
+        for device, uart in self.devices.items():
+            echo = uart.poll_egram()
+            if echo is not None:
+                echoes[device] = echo
+        return echoes
+
+    def queues(self):
+        return {device: uart.queue for device, uart in self.devices.items()}
@@ -0,0 +1,145 @@
+from collections import namedtuple
+from struct import Struct
+from threading import Lock
+
+MODE_BITMASK = {
+    "AOO": 1, "VOO": 2, "AAI": 3, "VVI": 4,
+    "AOOR": 5, "VOOR": 6, "AAIR": 7, "VVIR": 8
+}
+
+HDR1 = 0xAA    # First header byte for parameter packets
+HDR2 = 0x55    # Second header byte for parameter packets
+ECG_HDR = 0xEE # Header byte for ECG packets
+
+ECHO_FMT = "=BBB6f3H5B"
+ECHO_STRUCT = Struct(ECHO_FMT)
+
+# Payload bytes of one parameter packet, and the framed length with headers
+ECHO_LEN = ECHO_STRUCT.size
+FRAME_LEN = 2 + ECHO_LEN
+
+ECHO_LABELS = (
+    "Mode","LRL","URL",
+    "Atrial Amplitude","Atrial Pulse Width","Atrial Sensitivity",
+    "Ventricular Amplitude","Ventricular Pulse Width","Ventricular Sensitivity",
+    "VRP","ARP","PVARP",
+    "Maximum Sensor Rate","Reaction Time","Response Factor","Recovery Time",
+    "Activity Threshold"
+)
+
+# Decoded parameter packet, fields in wire order
+EchoParams = namedtuple("EchoParams", [
+    "mode", "lrl", "url",
+    "atrial_amplitude", "atrial_pulse_width", "atrial_sensitivity",
+    "ventricular_amplitude", "ventricular_pulse_width", "ventricular_sensitivity",
+    "vrp", "arp", "pvarp",
+    "maximum_sensor_rate", "reaction_time", "response_factor", "recovery_time",
+    "activity_threshold",
+])
+
+# Default parameter values (used if database is missing values)
+DEFAULTS = {
+    "Lower Rate Limit": 60,
+    "Upper Rate Limit": 120,
+    "Atrial Amplitude": 5,
+    "Atrial Pulse Width": 1,
+    "Atrial Sensitivity": 0,
+    "Ventricular Amplitude": 5,
+    "Ventricular Pulse Width": 1,
+    "Ventricular Sensitivity": 0,
+    "VRP": 320,
+    "ARP": 250,
+    "PVARP": 250,
+    "Maximum Sensor Rate": 120,
+    "Reaction Time": 30,
+    "Response Factor": 8,
+    "Recovery Time": 5,
+    "Activity Threshold": 4
+}
+
+# Activity Threshold can be a string label or number
+THRESHOLDS = {
+    "V-Low": 1, "Low": 2, "Med-Low": 3,
+    "Med": 4, "Med-High": 5, "High": 6, "V-High": 7
+}
+
+# Payload order after the mode byte, with the type each field is sent as
+PAYLOAD_FIELDS = (
+    ("Lower Rate Limit", int),
+    ("Upper Rate Limit", int),
+    ("Atrial Amplitude", float),
+    ("Atrial Pulse Width", float),
+    ("Atrial Sensitivity", float),
+    ("Ventricular Amplitude", float),
+    ("Ventricular Pulse Width", float),
+    ("Ventricular Sensitivity", float),
+    ("VRP", int),
+    ("ARP", int),
+    ("PVARP", int),
+    ("Maximum Sensor Rate", int),
+    ("Reaction Time", int),
+    ("Response Factor", int),
+    ("Recovery Time", int),
+    ("Activity Threshold", int),
+)
+
+# (mode, params) -> (frame bytes, expected echo); cleared when it gets large
+CACHE_SIZE = 256
+_cache = {}
+_frame = bytearray(FRAME_LEN)
+_frame[0] = HDR1
+_frame[1] = HDR2
+_frame_lock = Lock()
+
+
+def _values(mode, params):
+    values = [MODE_BITMASK.get(mode, 0)]
+
+    for name, kind in PAYLOAD_FIELDS:
+        value = DEFAULTS[name]
+        if params and name in params:
+            value = params[name]
+
+        if name == "Activity Threshold" and isinstance(value, str):
+            value = THRESHOLDS.get(value, 4)
+
+        values.append(kind(value))
+
+    return values
+
+
+def _lookup(mode, params):
+    key = (mode, tuple(sorted(params.items())) if params else ())
+    entry = _cache.get(key)
+
+    if entry is None:
+        with _frame_lock:
+            ECHO_STRUCT.pack_into(_frame, 2, *_values(mode, params))
+            frame = bytes(_frame)
+
+        # what the device should send back: the frame as it went on the wire
+        entry = (frame, decode_echo(frame, 2))
+
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        _cache[key] = entry
+
+    return entry
+
+
+def encode_frame(mode, params):
+    # Framed parameter packet (headers + payload) for a mode and saved params
+    return _lookup(mode, params)[0]
+
+
+def expected_echo(mode, params):
+    return _lookup(mode, params)[1]
+
+
+def decode_echo(buf, offset=0):
+    return EchoParams._make(ECHO_STRUCT.unpack_from(buf, offset))
+
+
+def echo_dict(echo):
+    # Display form keyed by the original labels
+    return dict(zip(ECHO_LABELS, echo))
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+# Off unless switched on (or DCM_PERF=1); every hook is a flag check when off
+_enabled = os.environ.get("DCM_PERF") == "1"
+_lock = Lock()
+
+_counters = {}     # name -> running total
+_gauges = {}       # name -> last value
+_histograms = {}   # name -> Histogram
+
+# Histogram bucket upper bounds in seconds: 10 µs .. ~10 s, x2 per bucket
+BOUNDS = tuple(1e-5 * 2 ** i for i in range(21))
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect_left(BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th percentile, capped at max
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(BOUNDS[i], self.max) if i < len(BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def gauge(name, value):
+    if not _enabled:
+        return
+    _gauges[name] = value
+
+
+def observe(name, seconds):
+    if not _enabled:
+        return
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = Histogram()
+        hist.observe(seconds)
+
+
+@contextmanager
+def timed(name):
+    # Record the duration of the block in histogram `name`
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "time": time.monotonic(),
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {name: h.summary() for name, h in _histograms.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def export_json(filename):
+    with open(filename, "w") as f:
+        json.dump(snapshot(), f, indent=4)
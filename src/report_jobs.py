@@ -0,0 +1,124 @@
+import itertools
+import time
+from queue import Queue, Empty
+from threading import Thread, Event
+
+from reports import generate_report, ReportCancelled
+
+
+class ReportJob:
+    def __init__(self, job_id, name, kwargs):
+        self.id = job_id
+        self.name = name
+        self.kwargs = kwargs           # generate_report arguments, fixed at submit
+        self.output = kwargs.get("output_filename", "report.pdf")
+
+        self.status = "queued"         # queued | running | done | cancelled | failed
+        self.progress = 0.0
+        self.stage = ""
+        self.error = None
+        self.elapsed = None
+        self.cancel_event = Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "cancelled", "failed")
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class ReportRunner:
+    # Builds queued reports one after another on a worker thread. Updates
+    # reach on_update(job) on the Tk thread through a root.after poll.
+    def __init__(self, root, on_update=None, interval=100):
+        self.root = root
+        self.on_update = on_update
+        self.interval = interval       # ms between polls of the update queue
+
+        self.jobs = []                 # every job submitted, in order
+        self.pending = Queue()         # jobs for the worker; None stops it
+        self.updates = Queue()         # job snapshots for the Tk thread
+        self.ids = itertools.count(1)
+        self.stopped = False
+        self.worker = Thread(target=self._worker_loop, name="report-runner", daemon=True)
+        self.worker.start()
+        self.root.after(self.interval, self._poll)
+
+    def submit(self, name, **kwargs):
+        # kwargs must already be a snapshot (copied parameters and egram data)
+        job = ReportJob(next(self.ids), name, kwargs)
+        self.jobs.append(job)
+        self.pending.put(job)
+        self.updates.put(job)
+        return job
+
+    def cancel(self, job):
+        job.cancel()
+
+    def cancel_all(self):
+        for job in self.jobs:
+            if not job.finished:
+                job.cancel()
+
+    def active(self):
+        return [job for job in self.jobs if not job.finished]
+
+    def shutdown(self):
+        self.stopped = True
+        self.cancel_all()
+        self.pending.put(None)
+        self.worker.join(timeout=2.0)
+
+    def _worker_loop(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                return
+            self._run(job)
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            self.updates.put(job)
+            return
+
+        job.status = "running"
+        self.updates.put(job)
+        start = time.perf_counter()
+
+        def progress(fraction, stage):
+            job.progress = fraction
+            job.stage = stage
+            self.updates.put(job)
+
+        try:
+            generate_report(progress=progress, cancel=job.cancel_event, **job.kwargs)
+            job.status = "done"
+            job.progress = 1.0
+        except ReportCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+
+        job.elapsed = time.perf_counter() - start
+        self.updates.put(job)
+
+    def _poll(self):
+        # Tk thread: hand each changed job to on_update once per poll
+        if self.stopped:
+            return
+        changed = {}
+        while True:
+            try:
+                job = self.updates.get_nowait()
+            except Empty:
+                break
+            changed[job.id] = job
+
+        if self.on_update:
+            for job in changed.values():
+                self.on_update(job)
+
+        self.root.after(self.interval, self._poll)
@@ -1,42 +1,314 @@
 from fpdf import FPDF
 from datetime import datetime
-import matplotlib
-matplotlib.use("Agg")  # render without opening a window
-import matplotlib.pyplot as plt
-import tempfile
-import os
+from functools import lru_cache
+import numpy as np
 
+# Samples per block when streaming egram data through the report
+CHUNK_SAMPLES = 4096
 
-def _make_egram_plot(egram_data, out_png):
+# Strip chart layout (mm, A4 portrait), like paper ECG: each row is a fixed
+# number of seconds with the atrial trace above the ventricular one
+STRIP_X = 15
+STRIP_W = 180
+STRIP_TOP = 30
+STRIP_ROW_H = 40
+STRIP_BAND_H = 16          # height of one channel trace (0-5 V)
+STRIP_ROWS = 6             # rows per page
+STRIP_COLUMNS = 720        # min/max columns per row (4 per mm)
+OVERVIEW_COLUMNS = 24      # per row, for the whole-session graph
+
+# Whole-session graph: one panel per channel (mm)
+GRAPH_X = 25
+GRAPH_W = 170
+GRAPH_H = 60
+GRAPH_PANELS = ((40, "Atrial"), (120, "Ventricular"))
+GRAPH_POINTS = 720         # min/max pairs across the panel width
+
+# Full data appendix: sample triples per line and lines per page
+APPENDIX_GROUPS = 3
+APPENDIX_LINES = 75
+
+
+class ReportCancelled(Exception):
+    pass
+
+
+class _Progress:
+    # Reports fractions 0..1 to an optional callback and stops the build
+    # (ReportCancelled) once the optional cancel Event is set
+    def __init__(self, callback=None, cancel=None):
+        self.callback = callback
+        self.cancel = cancel
+
+    def __call__(self, fraction, stage):
+        if self.cancel is not None and self.cancel.is_set():
+            raise ReportCancelled()
+        if self.callback:
+            self.callback(min(1.0, fraction), stage)
+
+
+def _egram_source(egram_data):
+    # Returns a function giving a fresh iterator of (t, A, V) array chunks,
+    # or None when there is nothing to show. egram_data may be a list of
+    # sample dicts, a FloatQueue, a recorded SessionReader, a (t, A, V) tuple
+    # of arrays, or such a function.
+    if egram_data is None:
+        return None
+
+    if callable(egram_data):
+        return egram_data
+
+    if hasattr(egram_data, "chunks"):
+        if not len(egram_data):
+            return None
+        return egram_data.chunks
+
+    if isinstance(egram_data, tuple):
+        arrays = egram_data
+    elif hasattr(egram_data, "get_report_arrays"):
+        arrays = egram_data.get_report_arrays()
+    elif egram_data:
+        # dicts without a time stamp are taken as 1 kHz
+        arrays = (
+            np.array([s.get("t", i / 1000.0) for i, s in enumerate(egram_data)], dtype=np.float64),
+            np.array([s.get("A", np.nan) for s in egram_data], dtype=np.float32),
+            np.array([s.get("V", np.nan) for s in egram_data], dtype=np.float32),
+        )
+    else:
+        return None
+
+    if not len(arrays[0]):
+        return None
+
+    def chunks():
+        for i in range(0, len(arrays[0]), CHUNK_SAMPLES):
+            yield tuple(x[i:i + CHUNK_SAMPLES] for x in arrays)
+
+    return chunks
+
+
+def _fold_row(start, seconds, columns, pieces):
+    # Min/max of each channel per column of one row
+    t, a, v = (np.concatenate(x) for x in zip(*pieces))
+    col = np.clip(((t - start) / seconds * columns).astype(np.int64), 0, columns - 1)
+    first = np.flatnonzero(np.r_[True, col[1:] != col[:-1]])
+    return (start, col[first],
+            np.fmin.reduceat(a, first), np.fmax.reduceat(a, first),
+            np.fmin.reduceat(v, first), np.fmax.reduceat(v, first))
+
+
+def _strip_rows(chunks, seconds, columns):
+    # Regroup a chunk stream into rows of `seconds` each; only one row is
+    # held at a time. Yields (start, columns, A min, A max, V min, V max),
+    # skipping rows with no samples.
+    origin = None
+    row = 0
+    pieces = []
+
+    for t, a, v in chunks:
+        if not len(t):
+            continue
+        if origin is None:
+            origin = float(t[0])
+
+        idx = np.floor((t - origin) / seconds).astype(np.int64)
+        cuts = np.flatnonzero(idx[1:] != idx[:-1]) + 1
+        for s, e in zip(np.r_[0, cuts], np.r_[cuts, len(t)]):
+            if idx[s] != row and pieces:
+                yield _fold_row(origin + row * seconds, seconds, columns, pieces)
+                pieces = []
+            row = int(idx[s])
+            pieces.append((t[s:e], a[s:e], v[s:e]))
+
+    if pieces:
+        yield _fold_row(origin + row * seconds, seconds, columns, pieces)
+
+
+def _counted(chunks, totals):
+    # Pass chunks through, adding up their samples
+    for chunk in chunks:
+        totals["samples"] += len(chunk[0])
+        yield chunk
+
+
+def _egram_overview(chunks, seconds):
+    # Coarse envelope of the whole session, a few points per second, plus
+    # the row and sample counts later sections use for progress; None when
+    # the source turns out to have no samples
+    a_env, v_env = [], []
+    totals = {"samples": 0}
+    for _, _, a_min, a_max, v_min, v_max in _strip_rows(_counted(chunks, totals), seconds,
+                                                        OVERVIEW_COLUMNS):
+        a_env.append(np.column_stack((a_min, a_max)).ravel())
+        v_env.append(np.column_stack((v_min, v_max)).ravel())
+    if not a_env:
+        return None
+    return np.concatenate(a_env), np.concatenate(v_env), len(a_env), totals["samples"]
+
+
+def _fit_envelope(env, pairs):
+    # Fold an interleaved min/max envelope down to at most `pairs` columns
+    env = env.reshape(-1, 2)
+    group = -(-len(env) // pairs)
+    if group > 1:
+        pad = np.full((-len(env) % group, 2), np.nan, dtype=env.dtype)
+        env = np.concatenate((env, pad)).reshape(-1, group, 2)
+        env = np.column_stack((np.fmin.reduce(env[:, :, 0], axis=1),
+                               np.fmax.reduce(env[:, :, 1], axis=1)))
+    return env[:, 0], env[:, 1]
 
-    if not egram_data:
-        return False
 
-    a_vals = [s.get("A", 0.0) for s in egram_data]
-    v_vals = [s.get("V", 0.0) for s in egram_data]
+@lru_cache(maxsize=4)
+def _graph_template(k, h):
+    # PDF drawing operators for the panel frames and 1 V grid lines; built
+    # once per page geometry and reused by every report
+    ops = ["q 0.1 w 0.85 G"]
+    for top, _ in GRAPH_PANELS:
+        for volts in range(1, 5):
+            y = top + GRAPH_H * (1 - volts / 5)
+            ops.append(f"{GRAPH_X * k:.2f} {(h - y) * k:.2f} m "
+                       f"{(GRAPH_X + GRAPH_W) * k:.2f} {(h - y) * k:.2f} l S")
+    ops.append("0.3 w 0 G")
+    for top, _ in GRAPH_PANELS:
+        ops.append(f"{GRAPH_X * k:.2f} {(h - top - GRAPH_H) * k:.2f} "
+                   f"{GRAPH_W * k:.2f} {GRAPH_H * k:.2f} re S")
+    ops.append("Q")
+    return "\n".join(ops)
 
-    plt.figure(figsize=(8, 4))
 
-    plt.subplot(2, 1, 1)
-    plt.plot(a_vals)
-    plt.ylim(0, 5)
-    plt.title("Atrial")
-    plt.ylabel("V")
-    plt.xticks([])
+def _draw_egram_graph(pdf, a_env, v_env):
+    # Whole-session overview as vector polylines, no image round trip
+    if not len(a_env):
+        return False
+
+    pdf._out(_graph_template(pdf.k, pdf.h))
 
-    plt.subplot(2, 1, 2)
-    plt.plot(v_vals)
-    plt.ylim(0, 5)
-    plt.title("Ventricular")
-    plt.ylabel("V")
-    plt.xlabel("Samples")
+    pdf.set_font("Arial", size=9)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_line_width(0.2)
+    for (top, label), env in zip(GRAPH_PANELS, (a_env, v_env)):
+        pdf.text(GRAPH_X, top - 2, label)
+        for volts in (0, 5):
+            pdf.text(GRAPH_X - 4, top + GRAPH_H * (1 - volts / 5) + 1, str(volts))
+        pdf.text(GRAPH_X - 10, top + GRAPH_H / 2, "V")
 
-    plt.tight_layout()
-    plt.savefig(out_png, dpi=150)
-    plt.close()
+        lo, hi = _fit_envelope(env, GRAPH_POINTS)
+        _draw_trace(pdf, GRAPH_X, top, GRAPH_W, GRAPH_H, len(lo), np.arange(len(lo)), lo, hi)
+
+    pdf.text(GRAPH_X + GRAPH_W / 2 - 4, GRAPH_PANELS[-1][0] + GRAPH_H + 6, "Time")
     return True
 
 
+def _polyline(pdf, xs, ys):
+    # One PDF path per run of points (fpdf 1.7 only draws single segments)
+    if len(xs) < 2:
+        return
+    k, h = pdf.k, pdf.h
+    points = [f"{x * k:.2f} {(h - y) * k:.2f}" for x, y in zip(xs.tolist(), ys.tolist())]
+    pdf._out(points[0] + " m " + " l ".join(points[1:]) + " l S")
+
+
+def _draw_trace(pdf, x0, y0, width, height, columns, cols, lo, hi):
+    # Interleaved min/max envelope (0-5 V) in a width x height box, broken
+    # wherever a column has no data
+    x = x0 + (cols + 0.5) * (width / columns)
+    xs = np.repeat(x, 2)
+    ys = np.column_stack((lo, hi)).ravel()
+    ys = y0 + height * (1 - np.clip(ys, 0, 5) / 5)
+
+    bad = np.isnan(lo) | np.isnan(hi)
+    start = np.r_[True, (np.diff(cols) > 1) | bad[:-1]]
+    runs = np.repeat(np.cumsum(start), 2)
+    keep = np.repeat(~bad, 2)
+    for r in np.unique(runs[keep]):
+        sel = keep & (runs == r)
+        _polyline(pdf, xs[sel], ys[sel])
+
+
+def _draw_strip_grid(pdf, y, seconds):
+    # light 0.2 s divisions, darker every second, like ECG paper
+    pdf.set_line_width(0.1)
+    for i in range(int(round(seconds / 0.2)) + 1):
+        x = STRIP_X + i * 0.2 / seconds * STRIP_W
+        if x > STRIP_X + STRIP_W + 1e-6:
+            break
+        pdf.set_draw_color(*((235, 150, 150) if i % 5 == 0 else (250, 215, 215)))
+        pdf.line(x, y, x, y + 2 * STRIP_BAND_H)
+
+    pdf.set_draw_color(235, 150, 150)
+    for band_y in (y, y + STRIP_BAND_H, y + 2 * STRIP_BAND_H):
+        pdf.line(STRIP_X, band_y, STRIP_X + STRIP_W, band_y)
+
+
+def _write_strip_chart(pdf, chunks, seconds, on_row=None):
+    slot = STRIP_ROWS
+    for start, cols, a_min, a_max, v_min, v_max in _strip_rows(chunks, seconds, STRIP_COLUMNS):
+        if on_row:
+            on_row()
+        if slot == STRIP_ROWS:
+            pdf.add_page()
+            pdf.set_font("Arial", "B", 14)
+            pdf.cell(0, 10, f"Egram Strip Chart ({seconds:g} s per row)", ln=True)
+            pdf.set_font("Arial", size=8)
+            slot = 0
+
+        y = STRIP_TOP + slot * STRIP_ROW_H
+        pdf.set_text_color(0, 0, 0)
+        pdf.text(STRIP_X, y - 1.5, f"{start:.1f} s")
+        pdf.text(STRIP_X - 5, y + STRIP_BAND_H / 2, "A")
+        pdf.text(STRIP_X - 5, y + 1.5 * STRIP_BAND_H, "V")
+        _draw_strip_grid(pdf, y, seconds)
+
+        pdf.set_draw_color(0, 0, 0)
+        pdf.set_line_width(0.2)
+        _draw_trace(pdf, STRIP_X, y, STRIP_W, STRIP_BAND_H, STRIP_COLUMNS, cols, a_min, a_max)
+        _draw_trace(pdf, STRIP_X, y + STRIP_BAND_H, STRIP_W, STRIP_BAND_H, STRIP_COLUMNS,
+                    cols, v_min, v_max)
+        slot += 1
+
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_line_width(0.2)
+
+
+def _tail(chunks, count):
+    # Last `count` samples of the stream, holding at most two chunks' worth
+    t, a, v = (np.zeros(0, dtype=np.float32) for _ in range(3))
+    for ct, ca, cv in chunks:
+        t = np.concatenate((t, ct))[-count:]
+        a = np.concatenate((a, ca))[-count:]
+        v = np.concatenate((v, cv))[-count:]
+    return t, a, v
+
+
+def _write_data_appendix(pdf, chunks, on_chunk=None):
+    # Every sample, APPENDIX_GROUPS (t, A, V) triples per line
+    per_page = APPENDIX_GROUPS * APPENDIX_LINES
+    width = STRIP_W / APPENDIX_GROUPS
+    index = 0
+    page_fill = per_page
+
+    for t, a, v in chunks:
+        if on_chunk:
+            on_chunk(index)
+        for ti, ai, vi in zip(t.tolist(), a.tolist(), v.tolist()):
+            if page_fill == per_page:
+                pdf.add_page()
+                pdf.set_font("Arial", "B", 14)
+                pdf.cell(0, 10, "Egram Data (Appendix)", ln=True)
+                pdf.set_font("Courier", size=7)
+                page_fill = 0
+
+            line, group = divmod(page_fill, APPENDIX_GROUPS)
+            x = STRIP_X + group * width
+            y = 28 + line * 3.4
+            a_txt = f"{ai:6.3f}" if ai == ai else "     -"
+            v_txt = f"{vi:6.3f}" if vi == vi else "     -"
+            pdf.text(x, y, f"{index:7d} {ti:9.3f}s {a_txt} {v_txt}")
+
+            index += 1
+            page_fill += 1
+
+
 def generate_report(device_model: str,
                     device_serial: str,
                     application_model: str,
@@ -45,8 +317,15 @@ def generate_report(device_model: str,
                     report_name: str,
                     labels: list[str],
                     parameters: list[float],
-                    egram_data: list[dict] = None,
-                    output_filename: str = "report.pdf"):
+                    egram_data: list[dict] = None,   # or a FloatQueue / SessionReader / chunk source
+                    output_filename: str = "report.pdf",
+                    seconds_per_row: float = 5.0,
+                    data_appendix: bool = False,
+                    progress=None,      # progress(fraction, stage), from the building thread
+                    cancel=None):       # threading.Event; raises ReportCancelled when set
+
+    step = _Progress(progress, cancel)
+    step(0.0, "header")
 
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
@@ -82,45 +361,51 @@ def generate_report(device_model: str,
     pdf.set_font("Arial", "B", 14)
     pdf.cell(0, 10, "Egram Graph", ln=True)
 
-    # Create temp PNG for the plot
-    tmp_png = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as f:
-            tmp_png = f.name
+    # Egram data is streamed in chunks, once per section
+    source = _egram_source(egram_data)
+
+    ok = False
+    if source is not None:
+        step(0.05, "graph")
+        overview = _egram_overview(source(), seconds_per_row)
+        if overview is None:
+            source = None
+        else:
+            a_env, v_env, rows, samples = overview
+            ok = _draw_egram_graph(pdf, a_env, v_env)
+    if not ok:
+        pdf.set_font("Arial", size=12)
+        pdf.ln(10)
+        pdf.cell(0, 8, "No egram data recorded.", ln=True)
 
-        ok = _make_egram_plot(egram_data, tmp_png)
+    if source is not None:
+        # strip chart up to 90%, or 60% when the appendix follows
+        span = 0.4 if data_appendix else 0.7
+        done = iter(range(rows))
+        _write_strip_chart(pdf, source(), seconds_per_row,
+                           lambda: step(0.2 + span * next(done, rows) / rows, "strip chart"))
 
-        if ok and os.path.exists(tmp_png):
-            # fit nicely on page
-            pdf.image(tmp_png, x=15, y=30, w=180)
+        if data_appendix:
+            _write_data_appendix(pdf, source(),
+                                 lambda n: step(0.6 + 0.3 * n / samples, "appendix"))
         else:
-            pdf.set_font("Arial", size=12)
-            pdf.ln(10)
-            pdf.cell(0, 8, "No egram data recorded.", ln=True)
-
-    finally:
-        if tmp_png and os.path.exists(tmp_png):
-            os.remove(tmp_png)
-
-    if egram_data:
-        pdf.add_page()
-        pdf.set_font("Arial", "B", 14)
-        pdf.cell(0, 10, "Egram Data (Table)", ln=True)
-        pdf.set_font("Arial", "B", 11)
-
-        pdf.cell(20, 8, "Idx", 1, 0, "C")
-        pdf.cell(40, 8, "Atrial (V)", 1, 0, "C")
-        pdf.cell(40, 8, "Ventricular (V)", 1, 1, "C")
-        pdf.set_font("Arial", size=11)
-
-        # limit rows so page isn't huge
-        data = egram_data[-100:]
-
-        for i, sample in enumerate(data):
-            a = float(sample.get("A", 0.0))
-            v = float(sample.get("V", 0.0))
-            pdf.cell(20, 8, str(i), 1, 0, "C")
-            pdf.cell(40, 8, f"{a:.3f}", 1, 0, "C")
-            pdf.cell(40, 8, f"{v:.3f}", 1, 1, "C")
+            pdf.add_page()
+            pdf.set_font("Arial", "B", 14)
+            pdf.cell(0, 10, "Egram Data (Table)", ln=True)
+            pdf.set_font("Arial", "B", 11)
+
+            pdf.cell(20, 8, "Idx", 1, 0, "C")
+            pdf.cell(40, 8, "Atrial (V)", 1, 0, "C")
+            pdf.cell(40, 8, "Ventricular (V)", 1, 1, "C")
+            pdf.set_font("Arial", size=11)
+
+            # limit rows so page isn't huge
+            _, a_vals, v_vals = _tail(source(), 100)
+
+            for i, (a, v) in enumerate(zip(a_vals.tolist(), v_vals.tolist())):
+                pdf.cell(20, 8, str(i), 1, 0, "C")
+                pdf.cell(40, 8, f"{a:.3f}" if a == a else "-", 1, 0, "C")
+                pdf.cell(40, 8, f"{v:.3f}" if v == v else "-", 1, 1, "C")
 
+    step(0.9, "writing")
     pdf.output(output_filename)
@@ -5,6 +5,7 @@ if __name__ == "__main__":
     root = tk.Tk()
     root.title("Pacemaker DCM")
     root.state("zoomed")  
-    AppController(root)
+    app = AppController(root)
     root.mainloop()
+    app.close()
     
\ No newline at end of file
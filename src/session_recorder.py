@@ -0,0 +1,281 @@
+import json
+import mmap
+import os
+import time
+from queue import Queue
+from struct import Struct
+from threading import Thread, Event
+
+import numpy as np
+
+# File layout (little endian, 4-byte aligned):
+#   header: magic, version, reserved, samples per chunk, start time (epoch s)
+#   chunks: tag, record count, payload bytes, base time (epoch s), payload
+# SMPL payloads are rows of (t offset from base, A, V) float32. Every SMPL
+# chunk holds exactly chunk_samples rows except the last one a recording
+# session writes and any cut short by SessionRecorder.flush().
+# EVNT payloads are one JSON object padded with spaces to 4 bytes.
+MAGIC = b"DCMEGRM1"
+VERSION = 1
+HEADER = Struct("<8sHHId")
+CHUNK = Struct("<4sIId")
+SAMPLE_TAG = b"SMPL"
+EVENT_TAG = b"EVNT"
+SAMPLE_DTYPE = np.dtype([("t", "<f4"), ("A", "<f4"), ("V", "<f4")])
+
+
+class SessionRecorder:
+    def __init__(self, filename, chunk_samples=4096):
+        self.filename = filename
+        self.chunk_samples = chunk_samples
+
+        # monotonic clock (used by the reader thread) -> wall clock
+        self.mono0 = time.monotonic()
+        self.epoch0 = time.time()
+
+        folder = os.path.dirname(filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        # Only ever appended to; the header is written once for a new file
+        self.file = open(filename, "ab", buffering=1 << 16)
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, 0, chunk_samples, self.epoch0))
+            self.file.flush()
+        else:
+            # keep the chunk size the existing file was started with
+            with open(filename, "rb") as f:
+                magic, _, _, self.chunk_samples, _ = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                self.file.close()
+                raise ValueError(f"{filename} is not an egram session file")
+
+        # rows waiting to fill the current chunk
+        self.pending = np.zeros(self.chunk_samples, dtype=SAMPLE_DTYPE)
+        self.pending_len = 0
+        self.pending_base = 0.0
+        self.samples_written = 0
+
+        # Writes happen on our own thread so the GUI never waits on disk
+        self.items = Queue()
+        self.writer = Thread(target=self._writer_loop, name="session-recorder", daemon=True)
+        self.writer.start()
+
+    def record_samples(self, t, a, v):
+        # t: monotonic timestamps; arrays are copied before leaving the caller
+        if len(t) == 0:
+            return
+        epoch = self.epoch0 + (np.asarray(t, dtype=np.float64) - self.mono0)
+        self.items.put(("S", epoch, np.array(a, dtype=np.float32), np.array(v, dtype=np.float32)))
+
+    def record_event(self, kind, **fields):
+        stamp = self.epoch0 + (time.monotonic() - self.mono0)
+        self.items.put(("E", stamp, dict(fields, kind=kind)))
+
+    def flush(self):
+        # Write the partial chunk now and wait until it is in the file
+        if self.writer.is_alive():
+            done = Event()
+            self.items.put(("F", done))
+            done.wait()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.items.put(None)
+            self.writer.join()
+
+    def _writer_loop(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                break
+
+            if item[0] == "S":
+                self._add_samples(*item[1:])
+            elif item[0] == "F":
+                self._write_samples()
+                item[1].set()
+            else:
+                self._write_event(*item[1:])
+
+        # Partial last chunk, then done
+        self._write_samples()
+        self.file.close()
+
+    def _add_samples(self, epoch, a, v):
+        n = len(epoch)
+        done = 0
+
+        while done < n:
+            if self.pending_len == 0:
+                self.pending_base = float(epoch[done])
+
+            take = min(n - done, self.chunk_samples - self.pending_len)
+            rows = self.pending[self.pending_len:self.pending_len + take]
+            rows["t"] = epoch[done:done + take] - self.pending_base
+            rows["A"] = a[done:done + take]
+            rows["V"] = v[done:done + take]
+            self.pending_len += take
+            done += take
+
+            if self.pending_len == self.chunk_samples:
+                self._write_samples()
+
+    def _write_samples(self):
+        if self.pending_len == 0:
+            return
+
+        payload = self.pending[:self.pending_len].tobytes()
+        self.file.write(CHUNK.pack(SAMPLE_TAG, self.pending_len, len(payload), self.pending_base))
+        self.file.write(payload)
+        self.file.flush()
+
+        self.samples_written += self.pending_len
+        self.pending_len = 0
+
+    def _write_event(self, stamp, fields):
+        payload = json.dumps(fields).encode("utf-8")
+        payload += b" " * (-len(payload) % 4)
+        self.file.write(CHUNK.pack(EVENT_TAG, 1, len(payload), stamp))
+        self.file.write(payload)
+        self.file.flush()
+
+
+def recorded_chunks(filename, count):
+    # Chunk source (see reports) over the first `count` samples of a session
+    # file, which may still be growing; the file is reopened for every pass
+    def chunks():
+        reader = SessionReader(filename)
+        try:
+            left = count
+            for t, a, v in reader.chunks():
+                if left <= 0:
+                    break
+                yield t[:left], a[:left], v[:left]
+                left -= len(t)
+        finally:
+            reader.close()
+    return chunks
+
+
+class SessionReader:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            self.file.close()
+            raise ValueError(f"{filename} is not an egram session file")
+
+        # Samples stay in the page cache; channels are views into the map
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, _, self.chunk_samples, self.start = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{filename} is not an egram session file")
+
+        # Sparse index: one entry per sample chunk
+        offsets, starts, bases = [], [], []
+        self.events = []     # (seconds since start, fields)
+        total = 0
+        off = HEADER.size
+
+        while off + CHUNK.size <= size:
+            tag, count, nbytes, base = CHUNK.unpack_from(self.map, off)
+            payload = off + CHUNK.size
+            if payload + nbytes > size:
+                break        # torn write at the end of an unfinished file
+
+            if tag == SAMPLE_TAG:
+                offsets.append(payload)
+                starts.append(total)
+                bases.append(base - self.start)
+                total += count
+            elif tag == EVENT_TAG:
+                fields = json.loads(bytes(self.map[payload:payload + nbytes]))
+                self.events.append((base - self.start, fields))
+
+            off = payload + nbytes
+
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.starts = np.array(starts + [total], dtype=np.int64)
+        self.bases = np.array(bases, dtype=np.float64)
+        self.length = total
+        self.pos = 0
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def duration(self):
+        if not self.length:
+            return 0.0
+        last = self.chunk(len(self.offsets) - 1)
+        return float(self.bases[-1] + last["t"][-1])
+
+    @property
+    def sample_rate(self):
+        duration = self.duration
+        return self.length / duration if duration > 0 else 0.0
+
+    def chunk(self, c):
+        count = int(self.starts[c + 1] - self.starts[c])
+        return np.frombuffer(self.map, dtype=SAMPLE_DTYPE, count=count, offset=int(self.offsets[c]))
+
+    def chunks(self):
+        # (t, A, V) per chunk; A and V are views into the file
+        for c in range(len(self.offsets)):
+            rows = self.chunk(c)
+            yield rows["t"] + self.bases[c], rows["A"], rows["V"]
+
+    def locate(self, index):
+        # Full chunks make this a division; fall back to bisecting the index
+        c = index // self.chunk_samples
+        if c >= len(self.offsets) or not self.starts[c] <= index < self.starts[c + 1]:
+            c = int(np.searchsorted(self.starts, index, side="right")) - 1
+        return c, index - int(self.starts[c])
+
+    def index_at(self, seconds):
+        # First sample at or after `seconds` since the session start
+        if not self.length:
+            return 0
+        c = max(0, int(np.searchsorted(self.bases, seconds, side="right")) - 1)
+        row = int(np.searchsorted(self.chunk(c)["t"], seconds - self.bases[c]))
+        return min(int(self.starts[c]) + row, self.length)
+
+    def seek(self, index):
+        self.pos = max(0, min(int(index), self.length))
+        return self.pos
+
+    def seek_time(self, seconds):
+        return self.seek(self.index_at(seconds))
+
+    def slice(self, start, stop):
+        # (t, A, V) for samples [start, stop); views when inside one chunk
+        stop = min(stop, self.length)
+        parts = []
+        i = start
+        while i < stop:
+            c, row = self.locate(i)
+            rows = self.chunk(c)[row:row + stop - i]
+            parts.append((rows["t"] + self.bases[c], rows["A"], rows["V"]))
+            i += len(rows)
+
+        if not parts:
+            empty = np.zeros(0, dtype=np.float32)
+            return np.zeros(0), empty, empty
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate(col) for col in zip(*parts))
+
+    def read(self, count):
+        start = self.pos
+        self.seek(start + count)
+        return self.slice(start, self.pos)
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            pass         # views still alive; the map goes when they do
+        self.file.close()
@@ -1,206 +1,454 @@
 from datamanager import DataManager
 import serial
 import serial.tools.list_ports
-from struct import pack, unpack_from, calcsize
-from threading import Lock
-
-MODE_BITMASK = {
-    "AOO": 1, "VOO": 2, "AAI": 3, "VVI": 4,
-    "AOOR": 5, "VOOR": 6, "AAIR": 7, "VVIR": 8
-}
+from threading import Lock, Thread, Event, Condition
+from queue import Queue, Empty, Full
+from concurrent.futures import Future
+from collections import namedtuple
+import math
+import time
+
+import numpy as np
+
+import perf_stats
+from packet_codec import (HDR1, HDR2, ECG_HDR, ECHO_FMT, ECHO_LEN,
+                          encode_frame, expected_echo, decode_echo)
+
+# 0–255 ADC reading to 0–5 V
+ECG_SCALE = 5.0 / 255.0
+
+# Outcome of send_and_verify: latency is seconds from write to echo of the
+# last attempt (None on timeout); mismatches lists (field, sent, echoed)
+VerifyResult = namedtuple("VerifyResult", ["ok", "attempts", "latency", "mismatches", "echo"])
+
+
+def port_serial(p):
+    # Stable key for a port: USB serial number, else device path, else VID:PID
+    return (
+        getattr(p, "serial_number", None)
+        or getattr(p, "device", None)
+        or f"{getattr(p, 'vid', '0')}:{getattr(p, 'pid', '0')}"
+    )
+
+
+def compare_echo(expected, echo, tol=1e-4):
+    # Field-by-field check; floats only need to agree to float32 precision
+    mismatches = []
+    for field, sent, got in zip(expected._fields, expected, echo):
+        if isinstance(sent, float):
+            same = math.isclose(sent, got, rel_tol=tol, abs_tol=tol)
+        else:
+            same = sent == got
+        if not same:
+            mismatches.append((field, sent, got))
+    return mismatches
+
+
+class FrameParser:
+
+    def __init__(self):
+        self.buf = bytearray()    # unparsed bytes carried between reads
+        self.dropped = 0          # junk bytes skipped while resyncing
+
+    def read_from(self, ser):
+        # Block for the first byte, then take everything already waiting
+        data = ser.read(max(1, ser.in_waiting))
+        if not data:
+            return []
+
+        dropped = self.dropped
+        frames = self.feed(data, time.monotonic())
+        perf_stats.count("serial_bytes", len(data))
+        if self.dropped != dropped:
+            perf_stats.count("dropped_bytes", self.dropped - dropped)
+        return frames
+
+    def feed(self, data, stamp=0.0):
+        # ECG frames carry the monotonic time their bytes were read
+        buf = self.buf
+        buf += data
+
+        frames = []
+        n = len(buf)
+        i = 0
+        echo_total = 2 + ECHO_LEN
+
+        while i < n:
+            b = buf[i]
+
+            if b == ECG_HDR:
+                if n - i < 3:
+                    break
+                frames.append(("ECG", (buf[i + 1] * ECG_SCALE, buf[i + 2] * ECG_SCALE, stamp)))
+                i += 3
+
+            elif b == HDR1:
+                if n - i < 2:
+                    break
+                if buf[i + 1] != HDR2:
+                    # Lone HDR1, not a frame start
+                    self.dropped += 1
+                    i += 1
+                    continue
+                # Keep partial echoes until the rest arrives
+                if n - i < echo_total:
+                    break
+                frames.append(("ECHO", decode_echo(buf, i + 2)))
+                i += echo_total
+
+            else:
+                self.dropped += 1
+                i += 1
+
+        # Drop consumed bytes, keep any partial frame for the next call
+        del buf[:i]
+        return frames
+
+    def reset(self):
+        self.buf.clear()
 
-HDR1 = 0xAA    # First header byte for parameter packets
-HDR2 = 0x55    # Second header byte for parameter packets
-ECG_HDR = 0xEE # Header byte for ECG packets
 
 class UARTComm:
 
-    def __init__(self, queue=None, baudrate=57600):
-        self.db = DataManager()      
+    def __init__(self, queue=None, baudrate=57600, db=None, max_frames=65536):
+        # Share the application's store so sends use the parameters just saved
+        self.db = db if db is not None else DataManager()
         self.queue = queue         
         self.baudrate = baudrate   
         self.ser = None            
         self.lock = Lock()         
 
-        # Flags to indicate what data we are waiting for
+        # Decoded frames handed from the reader thread to the GUI thread.
+        # Bounded like FloatQueue: if nobody polls, the oldest frames go.
+        self.frames = Queue(maxsize=max_frames)
+        self.frames_dropped = 0
+        self.reader = None
+        self.stop_event = Event()
+        self.parser = FrameParser()
+        self.recorder = None       # optional SessionRecorder
+
+        # Set while a parameter packet is waiting for its echo
         self.waiting_for_echo = False
-        self.waiting_for_ecg = False
 
-        self.ECHO_FMT = "=BBB6f3H5B"
+        self.ECHO_FMT = ECHO_FMT
 
         # Total number of bytes for one parameter packet
-        self.ECHO_LEN = calcsize(self.ECHO_FMT)
-
-    def connect(self):
-        # Scan all available serial ports
-        ports = list(serial.tools.list_ports.comports())
+        self.ECHO_LEN = ECHO_LEN
+
+        # How long each candidate port gets to answer in connect()
+        self.probe_timeout = 0.5
+
+        # Echoes are also announced here for send_and_verify
+        self.echo_cond = Condition()
+        self.echo_seq = 0
+        self.last_echo = None
+        self.last_echo_time = None
+        self.tx_lock = Lock()
+
+    def connect(self, username=None, ports=None, program=False):
+        # Scan all available serial ports (unless the caller already has the list).
+        # Probes only listen for ECG frames; with program=True they write the
+        # user's saved parameters and wait for the echo instead, which
+        # programs whatever device is on the port.
+        if ports is None:
+            ports = list(serial.tools.list_ports.comports())
 
         if not ports:
             print("NO SERIAL DEVICES FOUND")
             return False
 
-        # Try connecting to each detected serial port
-        for p in ports:
-            try:
-                self.ser = serial.Serial(p.device, self.baudrate, timeout=0.3)
-                print("CONNECTED:", p.device)
-                return True
-            except:
-                pass
+        packet = self._probe_packet(username) if program else None
 
-        # If no ports successfully opened
+        # The port that answered last time gets a single attempt first
+        cached = self._cached_port(username, ports)
+        if cached:
+            ser = self._probe(cached.device, packet)
+            if ser:
+                return self._attach(ser, cached, username)
+
+        # Probe every other port at once and keep the first one that answers
+        rest = [p for p in ports if p is not cached]
+        winner = self._race(rest, packet) if rest else None
+
+        if winner:
+            return self._attach(winner[0], winner[1], username)
+
+        # If no ports answered
         print("NO WORKING SERIAL PORT")
         return False
 
+    def _probe_packet(self, username):
+        # The user's saved settings; without them the probe only listens
+        if not username:
+            return None
+        mode = self.db.get_state(username)
+        if not mode:
+            return None
+        return self._build_packet(mode, self.db.get_parameters(username, state_name=mode))
+
+    def _race(self, ports, packet):
+        # Returns (open port, port info) of the first probe to succeed, or None.
+        # The other probes are told to stop and close their own ports; nothing
+        # waits for them once there is a winner.
+        stop = Event()
+        cond = Condition()
+        state = {"left": len(ports), "winner": None}
+
+        def run(p):
+            ser = self._probe(p.device, packet, stop)
+            with cond:
+                state["left"] -= 1
+                if ser is not None:
+                    if state["winner"] is None:
+                        state["winner"] = (ser, p)
+                        stop.set()
+                    else:
+                        ser.close()
+                cond.notify_all()
+
+        for p in ports:
+            Thread(target=run, args=(p,), name=f"uart-probe-{p.device}", daemon=True).start()
+
+        with cond:
+            cond.wait_for(lambda: state["winner"] or not state["left"])
+            return state["winner"]
+
+    def _cached_port(self, username, ports):
+        if not username:
+            return None
+        for p in ports:
+            if self.db.get_device_port(username, port_serial(p)) == p.device:
+                return p
+        return None
+
+    def _probe(self, device, packet, stop=None):
+        # Returns the open port if a pacemaker answers within probe_timeout;
+        # gives up early once `stop` is set
+        try:
+            ser = serial.Serial(device, self.baudrate, timeout=0.05)
+        except (serial.SerialException, OSError, ValueError):
+            return None
+
+        parser = FrameParser()
+        synced = None     # parser.dropped when the current clean run began
+        clean = 0         # ECG frames since then
+
+        try:
+            ser.reset_input_buffer()
+            if packet:
+                ser.write(packet)
+                ser.flush()
+
+            deadline = time.monotonic() + self.probe_timeout
+            while time.monotonic() < deadline and not (stop and stop.is_set()):
+                frames = parser.read_from(ser)
+                for kind, _ in frames:
+                    if kind == "ECHO":
+                        return self._ready(ser)
+
+                # Listening only: a clean run of ECG frames identifies the
+                # device. Joining the stream mid-frame costs a few bytes, so
+                # the run starts after the read that resynced; any later junk
+                # starts it again.
+                if not packet and frames:
+                    if parser.dropped != synced:
+                        synced = parser.dropped
+                        clean = 0
+                    else:
+                        clean += len(frames)
+                    if clean >= 4:
+                        return self._ready(ser)
+
+        except (serial.SerialException, OSError):
+            pass
+
+        ser.close()
+        return None
+
+    def _ready(self, ser):
+        ser.timeout = 0.3
+        return ser
+
+    def _attach(self, ser, port, username):
+        self.ser = ser
+        print("CONNECTED:", port.device)
+
+        if username:
+            self.db.save_device_port(username, port_serial(port), port.device)
+
+        self.start_reader()
+        return True
+
     def disconnect(self):
+        self.stop_reader()
+
         # Close serial connection if open
         if self.ser:
             self.ser.close()
             self.ser = None
 
-    def send_to_device(self, username):
-        # Get pacemaker mode and parameters from database
-        mode = self.db.get_state(username)
-        params = self.db.get_parameters(username, state_name=mode)
+    def start_reader(self):
+        # Drain the port continuously in the background
+        if self.reader and self.reader.is_alive():
+            return
 
-        # Ensure serial port is connected
-        if not self.ser or not self.ser.is_open:
-            raise Exception("Device not connected")
+        self.stop_event.clear()
+        self.parser.reset()
+        self.reader = Thread(target=self._reader_loop, name="uart-reader", daemon=True)
+        self.reader.start()
 
-        # Build UART packet
-        packet = self._build_packet(mode, params)
+    def stop_reader(self):
+        self.stop_event.set()
+
+        if self.reader and self.reader.is_alive():
+            self.reader.join(timeout=1.0)
+        self.reader = None
+
+    def _reader_loop(self):
+        while not self.stop_event.is_set():
+            ser = self.ser
+            if not ser or not ser.is_open:
+                break
+
+            try:
+                frames = self.parser.read_from(ser)
+            except (serial.SerialException, OSError, TypeError):
+                # Port vanished or was closed under us
+                break
+
+            for frame in frames:
+                self._hand_over(frame)
+
+                if frame[0] == "ECHO":
+                    with self.echo_cond:
+                        self.last_echo = frame[1]
+                        self.last_echo_time = time.perf_counter()
+                        self.echo_seq += 1
+                        self.echo_cond.notify_all()
+
+    def _hand_over(self, frame):
+        # Only the reader thread puts, so after taking one out there is room
+        try:
+            self.frames.put_nowait(frame)
+        except Full:
+            try:
+                self.frames.get_nowait()
+                self.frames_dropped += 1
+                perf_stats.count("frames_dropped")
+            except Empty:
+                pass
+            self.frames.put_nowait(frame)
 
+    def _write_frame(self, packet):
         # Send packet safely using lock
         with self.lock:
             self.ser.reset_output_buffer()
             self.ser.write(packet)
             self.ser.flush()
 
-        # Expect a response from the device
-        self.waiting_for_echo = True
-        self.waiting_for_ecg = True
+    def send_and_verify(self, username, timeout=0.5, retries=3, backoff=0.1, mode=None):
+        # Send the saved parameters (of `mode`, default the user's current one)
+        # and wait for the device to echo them back, on a worker thread.
+        # Returns a Future resolving to a VerifyResult.
+        mode = mode or self.db.get_state(username)
+        params = self.db.get_parameters(username, state_name=mode)
 
-        # Debug output
-        print("TX:", packet.hex())
-        print("MODE SENT:", mode)
+        if not self.ser or not self.ser.is_open:
+            raise Exception("Device not connected")
 
-        return packet
+        packet = self._build_packet(mode, params)
+        expected = expected_echo(mode, params)
+
+        if self.recorder:
+            self.recorder.record_event("params_sent", mode=mode, params=params)
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        Thread(target=self._verify_worker, name="uart-verify", daemon=True,
+               args=(future, packet, expected, timeout, retries, backoff)).start()
+        return future
+
+    def _verify_worker(self, future, packet, expected, timeout, retries, backoff):
+        try:
+            with self.tx_lock:
+                result = self._transact(packet, expected, timeout, retries, backoff)
+        except Exception as e:
+            future.set_exception(e)
+            return
+
+        if self.recorder:
+            self.recorder.record_event("params_verified", ok=result.ok, attempts=result.attempts,
+                                       latency=result.latency)
+        future.set_result(result)
+
+    def _transact(self, packet, expected, timeout, retries, backoff):
+        result = None
+
+        for attempt in range(1, retries + 2):
+            with self.echo_cond:
+                seq = self.echo_seq
+
+            self.waiting_for_echo = True
+            start = time.perf_counter()
+            self._write_frame(packet)
+
+            with self.echo_cond:
+                got = self.echo_cond.wait_for(lambda: self.echo_seq != seq, timeout)
+                echo, echo_time = self.last_echo, self.last_echo_time
+
+            if got:
+                mismatches = compare_echo(expected, echo)
+                result = VerifyResult(not mismatches, attempt, echo_time - start, mismatches, echo)
+                if result.ok:
+                    return result
+            else:
+                result = VerifyResult(False, attempt, None, [], None)
+
+            # back off a little more after every failed attempt
+            if attempt <= retries:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+
+        return result
 
     def _build_packet(self, mode, params):
-        # Default parameter values (used if database is missing values)
-        full = {
-            "Lower Rate Limit": 60,
-            "Upper Rate Limit": 120,
-            "Atrial Amplitude": 5,
-            "Atrial Pulse Width": 1,
-            "Atrial Sensitivity": 0,
-            "Ventricular Amplitude": 5,
-            "Ventricular Pulse Width": 1,
-            "Ventricular Sensitivity": 0,
-            "VRP": 320,
-            "ARP": 250,
-            "PVARP": 250,
-            "Maximum Sensor Rate": 120,
-            "Reaction Time": 30,
-            "Response Factor": 8,
-            "Recovery Time": 5,
-            "Activity Threshold": 4
-        }
-
-        # Override defaults with database values
-        if params:
-            full.update(params)
-
-        # Activity Threshold can be a string label or number
-        thr = full["Activity Threshold"]
-
-        if isinstance(thr, str):
-            mapping = {
-                "V-Low": 1, "Low": 2, "Med-Low": 3,
-                "Med": 4, "Med-High": 5, "High": 6, "V-High": 7
-            }
-            full["Activity Threshold"] = mapping.get(thr, 4)
-        else:
-            full["Activity Threshold"] = int(thr)
-
-        values = [
-            MODE_BITMASK.get(mode, 0),    
-            int(full["Lower Rate Limit"]),
-            int(full["Upper Rate Limit"]),
-            float(full["Atrial Amplitude"]),
-            float(full["Atrial Pulse Width"]),
-            float(full["Atrial Sensitivity"]),
-            float(full["Ventricular Amplitude"]),
-            float(full["Ventricular Pulse Width"]),
-            float(full["Ventricular Sensitivity"]),
-            int(full["VRP"]),
-            int(full["ARP"]),
-            int(full["PVARP"]),
-            int(full["Maximum Sensor Rate"]),
-            int(full["Reaction Time"]),
-            int(full["Response Factor"]),
-            int(full["Recovery Time"]),
-            int(full["Activity Threshold"])
-        ]
-
-        # Pack values into binary payload
-        payload = pack(self.ECHO_FMT, *values)
-
-        # Add framing headers
-        framed = bytes([HDR1, HDR2]) + payload
-
-        return framed
+        # Encoded frames are cached per (mode, params) in packet_codec
+        return encode_frame(mode, params)
 
     def poll_egram(self):
-        # Return immediately if serial is not open
-        if not self.ser or not self.ser.is_open:
-            return None
+        # Hand over everything the reader thread decoded since the last call.
+        # Runs on the GUI thread and never touches the serial port.
+        with perf_stats.timed("poll_egram"):
+            return self._poll_egram()
 
-        with self.lock:
-            # Read while bytes are available
-            while self.ser.in_waiting:
-                byte = self.ser.read(1)[0]   
-
-                # Check for parameter packet header
-                if byte == HDR1:
-                    if self.ser.in_waiting and self.ser.read(1)[0] == HDR2:
-                        # Wait until full payload arrives
-                        if self.ser.in_waiting < self.ECHO_LEN:
-                            return None
-
-                        payload = self.ser.read(self.ECHO_LEN)
-                        decoded = unpack_from(self.ECHO_FMT, payload)
+    def _poll_egram(self):
+        echo = None
+        samples = []
 
-                        self.waiting_for_echo = False
-
-                        labels = [
-                            "Mode","LRL","URL",
-                            "Atrial Amplitude","Atrial Pulse Width","Atrial Sensitivity",
-                            "Ventricular Amplitude","Ventricular Pulse Width","Ventricular Sensitivity",
-                            "VRP","ARP","PVARP",
-                            "Maximum Sensor Rate","Reaction Time","Response Factor","Recovery Time",
-                            "Activity Threshold"
-                        ]
+        while True:
+            try:
+                kind, value = self.frames.get_nowait()
+            except Empty:
+                break
 
-                        # Return dictionary of parameters
-                        return dict(zip(labels, decoded))
+            if kind == "ECHO":
+                self.waiting_for_echo = False
+                echo = value
 
-                if byte == ECG_HDR:
-                    if self.ser.in_waiting < 2:
-                        return None
+            elif kind == "ECG":
+                samples.append(value)
 
-                    # Read atrial and ventricular data
-                    a_raw = self.ser.read(1)[0]
-                    v_raw = self.ser.read(1)[0]
+        perf_stats.count("ecg_frames", len(samples))
 
-                    # Convert 0–255 readings to voltage scale
-                    a_val = (a_raw / 255.0) * 5.0
-                    v_val = (v_raw / 255.0) * 5.0
+        if samples:
+            # rows of (A, V, read time)
+            rows = np.array(samples)
 
-                    # Push values to queue for plotting / processing
-                    if self.queue:
-                        self.queue.push({"A": a_val, "V": v_val})
+            # Push values to queue for plotting / processing
+            if self.queue:
+                self.queue.push_many(rows[:, :2], t=rows[:, 2] - self.queue.t0)
 
-                    return a_val, v_val
+            if self.recorder:
+                self.recorder.record_samples(rows[:, 2], rows[:, 0], rows[:, 1])
 
-        return None
+        # Return the latest echoed parameters (EchoParams), if any
+        return echo
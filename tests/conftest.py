@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules live flat in src/ and import each other by plain name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
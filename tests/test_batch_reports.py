@@ -0,0 +1,88 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import batch_reports
+from datamanager import DataManager
+from session_recorder import SessionRecorder
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / "d.db")
+    db = DataManager(path)
+    db.add_user("alice", "pw")
+    db.save_parameters("alice", {"Lower Rate Limit": 70}, state_name="VVI")
+    db.save_parameters("alice", {"Lower Rate Limit": 65}, state_name="AAI")
+    db.save_state("alice", "VVI")
+    db.add_user("bob", "pw")
+    db.save_parameters("bob", {"Lower Rate Limit": 80}, state_name="AOO")
+    db.save_device_id("bob", "SN9", "PM-9")
+    db.close()
+
+    sessions = tmp_path / "sessions"
+    sessions.mkdir()
+    rec = SessionRecorder(str(sessions / "alice_20260101_120000.egram"))
+    t = rec.mono0 + np.arange(2000) / 1000.0
+    a = np.sin(t).astype(np.float32)
+    rec.record_samples(t, a, -a)
+    rec.record_event("params_sent", mode="AAI", params={"Lower Rate Limit": 65})
+    rec.close()
+    return path, str(sessions)
+
+
+def test_collect_jobs(store):
+    path, sessions = store
+    db = DataManager(path)
+    try:
+        jobs = batch_reports.collect_jobs(db.data, "out", sessions)
+        only_bob = batch_reports.collect_jobs(db.data, "out", sessions, users=["bob"])
+    finally:
+        db.close()
+
+    assert [(j["user"], j["mode"], bool(j["session"])) for j in jobs] == [
+        ("alice", "VVI", False), ("alice", "AAI", False), ("bob", "AOO", False), ("alice", "AAI", True),
+    ]
+    # the session takes the parameters it recorded
+    assert jobs[-1]["report"]["output_filename"] == os.path.join("out", "alice_AAI_20260101_120000_report.pdf")
+    assert jobs[-1]["report"]["report_name"].endswith("(session)")
+    assert [j["report"]["device_serial"] for j in only_bob] == ["PM-9"]
+
+
+def test_main_writes_reports_and_manifest(store, tmp_path, capsys):
+    path, sessions = store
+    out = tmp_path / "reports"
+    assert batch_reports.main(["--db", path, "--sessions", sessions, "--out", str(out), "--jobs", "1"]) == 0
+
+    manifest = json.loads((out / "manifest.json").read_text())
+    assert [e["status"] for e in manifest["reports"]] == ["ok"] * 4
+    for entry in manifest["reports"]:
+        assert os.path.getsize(entry["output"]) > 0
+    assert "4 reports written, 0 failed" in capsys.readouterr().out
+
+
+def test_worker_processes_sort_the_manifest(store, tmp_path):
+    path, sessions = store
+    db = DataManager(path)
+    try:
+        jobs = batch_reports.collect_jobs(db.data, str(tmp_path), sessions)
+    finally:
+        db.close()
+
+    entries = batch_reports.run(jobs, workers=2)
+    outputs = [e["output"] for e in entries]
+    assert outputs == sorted(j["report"]["output_filename"] for j in jobs)
+    assert all(e["status"] == "ok" for e in entries)
+
+
+def test_missing_store_is_an_error(tmp_path, capsys):
+    missing = tmp_path / "nope.db"
+    with pytest.raises(SystemExit) as exc:
+        batch_reports.main(["--db", str(missing), "--out", str(tmp_path / "out")])
+
+    assert exc.value.code == 2
+    assert "no store at" in capsys.readouterr().err
+    assert not missing.exists()
+    assert not (tmp_path / "out").exists()
@@ -0,0 +1,134 @@
+import json
+import time
+
+from datamanager import DataManager, SqliteStore
+
+
+def on_disk(path):
+    store = SqliteStore(str(path))
+    try:
+        return store.load()
+    finally:
+        store.close()
+
+
+def test_writes_through_without_write_behind(tmp_path):
+    path = tmp_path / "d.db"
+    db = DataManager(str(path))
+    db.add_user("alice", "pw")
+    db.save_state("alice", "VVI")
+
+    assert on_disk(path)["states"] == {"alice": "VVI"}
+    db.close()
+
+
+def test_reopen_reads_every_section(tmp_path):
+    path = tmp_path / "d.db"
+    db = DataManager(str(path))
+    db.add_user("alice", "pw")
+    db.save_state("alice", "AAI")
+    db.save_parameters("alice", {"Lower Rate Limit": 65}, state_name="AAI")
+    db.save_device_id("alice", "SN1", "Bench A")
+    db.close()
+
+    db = DataManager(str(path))
+    assert db.validate_user("alice", "pw")
+    assert not db.validate_user("alice", "nope")
+    assert db.get_state("alice") == "AAI"
+    assert db.get_parameters("alice", state_name="AAI") == {"Lower Rate Limit": 65}
+    assert db.get_device_id("alice", "SN1") == "Bench A"
+    db.close()
+
+
+def test_batch_groups_mutations(tmp_path):
+    path = tmp_path / "d.db"
+    db = DataManager(str(path))
+    db.add_user("alice", "pw")
+
+    with db.batch():
+        db.save_state("alice", "VOO")
+        db.save_parameters("alice", {"Upper Rate Limit": 130}, state_name="VOO")
+        # inside the batch nothing has been written
+        assert on_disk(path)["states"] == {}
+
+    data = on_disk(path)
+    assert data["states"]["alice"] == "VOO"
+    assert data["parameters"]["alice"]["VOO"] == {"Upper Rate Limit": 130}
+    db.close()
+
+
+def test_imports_legacy_json_once(tmp_path):
+    legacy = tmp_path / "old.json"
+    legacy.write_text(json.dumps({"users": {"bob": "x"}, "parameters": {}, "states": {"bob": "AOO"}}))
+
+    db = DataManager(str(tmp_path / "d.db"), legacy_json=str(legacy))
+    assert db.get_state("bob") == "AOO"
+    assert db.data["devices"] == {}
+    db.close()
+    assert on_disk(tmp_path / "d.db")["states"] == {"bob": "AOO"}
+
+
+def test_write_behind_waits_until_flush(tmp_path):
+    path = tmp_path / "d.db"
+    db = DataManager(str(path), write_behind=60.0)
+    db.add_user("alice", "pw")
+    db.save_parameters("alice", {"Lower Rate Limit": 70}, state_name="AOO")
+
+    # coalescing: nothing written yet
+    assert on_disk(path)["users"] == {}
+
+    db.flush()
+    data = on_disk(path)
+    assert "alice" in data["users"]
+    assert data["parameters"]["alice"]["AOO"] == {"Lower Rate Limit": 70}
+    db.close()
+
+
+def test_write_behind_flusher_writes_after_delay(tmp_path):
+    path = tmp_path / "d.db"
+    db = DataManager(str(path), write_behind=0.05)
+    db.add_user("alice", "pw")
+
+    deadline = time.monotonic() + 5.0
+    while "alice" not in on_disk(path)["users"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert "alice" in on_disk(path)["users"]
+    db.close()
+
+
+def test_close_flushes_pending_changes(tmp_path):
+    path = tmp_path / "d.db"
+    db = DataManager(str(path), write_behind=60.0)
+    db.add_user("alice", "pw")
+    db.save_state("alice", "AAI")
+    db.close()
+    db.close()      # a second close is harmless
+
+    reopened = DataManager(str(path))
+    assert reopened.get_state("alice") == "AAI"
+    reopened.close()
+
+
+def test_write_behind_copies_only_changed_paths(tmp_path):
+    path = tmp_path / "d.db"
+    db = DataManager(str(path), write_behind=60.0)
+    db.add_user("alice", "pw")
+    for i in range(50):
+        db.save_device_id("alice", f"SN{i}", f"dev{i}")
+    db.flush()
+
+    db.save_device_id("alice", "SN7", "renamed")
+    part = db._snapshot(db.changes)
+    assert part["devices"] == {"alice": {"SN7": part["devices"]["alice"]["SN7"]}}
+    assert part["users"] == {}
+
+    # the copy is detached from the live data
+    part["devices"]["alice"]["SN7"]["device_id"] = "changed later"
+    assert db.get_device_id("alice", "SN7") == "renamed"
+
+    db.flush()
+    data = on_disk(path)
+    assert data["devices"]["alice"]["SN7"]["device_id"] == "renamed"
+    assert len(data["devices"]["alice"]) == 50
+    db.close()
@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+from datamanager import DataManager
+from dcm_session import DCMSession, MODE_PARAMETERS, PARAM_CONFIG, PARAM_DEFAULTS, PARAM_UNITS
+from session_recorder import SessionReader
+
+
+@pytest.fixture
+def session(tmp_path):
+    db = DataManager(str(tmp_path / "d.db"))
+    db.add_user("alice", "pw")
+    session = DCMSession(db, sessions_dir=str(tmp_path / "sessions"))
+    assert session.login("alice", "pw")[0]
+    yield session
+    session.logout()
+    db.close()
+
+
+def test_login(tmp_path):
+    session = DCMSession(DataManager(str(tmp_path / "d.db")))
+    session.register("bob", "secret")
+    assert session.login("bob", "wrong") == (False, "Invalid username or password")
+    assert session.username is None
+    assert session.login("bob", "secret")[0]
+    assert session.username == "bob"
+
+
+def test_parameter_tables_agree():
+    for params in MODE_PARAMETERS.values():
+        for p in params:
+            assert p in PARAM_CONFIG and p in PARAM_DEFAULTS and p in PARAM_UNITS
+    assert PARAM_UNITS["Atrial Sensitivity"] == PARAM_UNITS["Ventricular Sensitivity"] == "mV"
+
+
+def test_select_mode_keeps_the_outgoing_values(session):
+    assert session.select_mode("AOO") == {p: PARAM_DEFAULTS[p] for p in MODE_PARAMETERS["AOO"]}
+    current = dict(session.parameters(), **{"Lower Rate Limit": 72})
+
+    params = session.select_mode("VVI", current)
+    assert session.mode == "VVI"
+    assert list(params) == MODE_PARAMETERS["VVI"]
+    assert session.parameters("AOO")["Lower Rate Limit"] == 72
+
+
+def test_validate(session):
+    session.select_mode("VVI")
+    clean, errors = session.validate({"Lower Rate Limit": "71.4", "VRP": 303})
+    assert errors == []
+    assert clean == {"Lower Rate Limit": 71, "VRP": 305}
+
+    _, errors = session.validate({"Lower Rate Limit": "fast", "ARP": 250})
+    assert errors == ["Lower Rate Limit: not a number", "ARP is not used in VVI"]
+
+    _, errors = session.validate({"Lower Rate Limit": 120, "Upper Rate Limit": 100})
+    assert errors == ["LRL cannot exceed URL"]
+
+    assert session.validate({}, mode="XYZ") == ({}, ["No pacing mode selected."])
+
+
+def test_set_parameters_changes_only_what_it_names(session):
+    session.select_mode("AAI")
+    ok, _ = session.set_parameters({"ARP": 300})
+    assert ok
+    assert session.parameters()["ARP"] == 300
+    assert session.parameters()["Lower Rate Limit"] == PARAM_DEFAULTS["Lower Rate Limit"]
+
+    ok, msg = session.set_parameters({"VRP": 300})
+    assert not ok and "not used in AAI" in msg
+
+
+def test_send_merges_and_verifies(session):
+    session.select_mode("VVI")
+    session.set_parameters({"VRP": 300})
+
+    with pytest.raises(Exception, match="Device not connected"):
+        session.send({"Lower Rate Limit": 75})
+
+    device = session.connect_simulated(seed=1)
+    result = session.send({"Lower Rate Limit": 80}).result(timeout=5)
+
+    assert result.ok
+    assert device.params.lrl == 80
+    assert device.params.vrp == 300
+    assert session.parameters()["VRP"] == 300
+
+    with pytest.raises(ValueError):
+        session.send({"Lower Rate Limit": "fast"})
+
+
+def test_stream_recording_and_report(session, tmp_path):
+    session.select_mode("VOO")
+    session.connect_simulated(seed=1)
+    assert session.connected
+    reader = session.subscribe_egram("test")
+
+    samples = 0
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline:
+        session.poll()
+        samples += len(reader.drain()[0])
+        time.sleep(0.02)
+    assert samples > 100
+
+    output = session.report(output_filename=str(tmp_path / "r.pdf"))
+    assert os.path.getsize(output) > 0
+
+    session.disconnect()
+    assert not session.connected
+    filename, recorded = session.recording
+    assert recorded >= samples
+    recorded_file = SessionReader(filename)
+    try:
+        assert len(recorded_file) == recorded
+    finally:
+        recorded_file.close()
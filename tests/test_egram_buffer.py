@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from egram_buffer import FloatQueue
+
+
+def block(start, n):
+    # A counts samples so tests can see exactly which ones survived
+    a = np.arange(start, start + n, dtype=np.float32)
+    return np.column_stack((a, -a)), a
+
+
+def test_push_and_drain_in_order():
+    q = FloatQueue(capacity=16, max_capacity=16)
+    samples, a = block(0, 10)
+    q.push_many(samples, t=a / 1000)
+
+    t, got_a, got_v = q.drain()
+    np.testing.assert_array_equal(got_a, a)
+    np.testing.assert_array_equal(got_v, -a)
+    np.testing.assert_allclose(t, a / 1000)
+    assert q.empty()
+
+
+def test_wrapping_drain():
+    q = FloatQueue(capacity=8, max_capacity=8)
+    q.push_many(block(0, 6)[0])
+    q.drain()
+    q.push_many(block(6, 6)[0])
+
+    _, a, _ = q.drain()
+    np.testing.assert_array_equal(a, np.arange(6, 12))
+
+
+def test_single_push_and_pop():
+    q = FloatQueue()
+    q.push({"A": 1.5, "t": 0.25})
+    q.push({"V": 2.0, "t": 0.5})
+
+    assert q.pop() == {"t": 0.25, "A": 1.5}
+    assert q.pop() == {"t": 0.5, "V": 2.0}
+    assert q.pop() is None
+
+
+def test_report_history_is_bounded():
+    q = FloatQueue(max_store=5)
+    q.push_many(block(0, 8)[0])
+
+    _, a, _ = q.get_report_arrays()
+    np.testing.assert_array_equal(a, np.arange(5))
+    assert [s["A"] for s in q.get_report_data()] == [0, 1, 2, 3, 4]
+
+    q.clear_report_data()
+    assert len(q.get_report_arrays()[0]) == 0
+
+
+def test_ring_grows_before_dropping():
+    q = FloatQueue(capacity=8, max_capacity=64)
+    q.push_many(block(0, 40)[0])
+
+    assert q.capacity >= 40
+    assert q.dropped == 0
+    _, a, _ = q.drain()
+    np.testing.assert_array_equal(a, np.arange(40))
+
+
+def test_drop_oldest():
+    q = FloatQueue(capacity=16, max_capacity=16, policy="drop-oldest")
+    q.push_many(block(0, 10)[0])
+    q.push_many(block(10, 10)[0])
+
+    assert q.dropped == 4
+    assert q.main.dropped == 4
+    _, a, _ = q.drain()
+    np.testing.assert_array_equal(a, np.arange(4, 20))
+
+
+def test_decimate_keeps_newest_and_halves_backlog():
+    q = FloatQueue(capacity=16, max_capacity=16, policy="decimate")
+    q.push_many(block(0, 16)[0])
+    q.push_many(block(16, 4)[0])
+
+    _, a, _ = q.drain()
+    # every other old sample, counting back from the newest, then the new block
+    np.testing.assert_array_equal(a, np.r_[np.arange(1, 16, 2), np.arange(16, 20)])
+    assert q.main.dropped == 8
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        FloatQueue(policy="keep-everything")
+
+
+def test_paused_queue_skips_live_ring_but_keeps_history():
+    q = FloatQueue(max_store=100)
+    q.pause()
+    assert q.paused
+
+    q.push_many(block(0, 10)[0])
+    assert q.skipped == 10
+    assert q.written == 0
+    np.testing.assert_array_equal(q.get_report_arrays()[1], np.arange(10))
+
+    q.resume()
+    q.push_many(block(10, 2)[0])
+    np.testing.assert_array_equal(q.drain()[1], [10, 11])
+
+
+def test_subscribers_have_independent_cursors():
+    q = FloatQueue(capacity=32, max_capacity=32)
+    q.pause()
+    fast = q.subscribe("fast")
+    q.push_many(block(0, 5)[0])
+    slow = q.subscribe("slow")       # starts at the next sample pushed
+    q.push_many(block(5, 5)[0])
+
+    np.testing.assert_array_equal(fast.drain()[1], np.arange(10))
+    assert fast.empty()
+    assert slow.count == 5
+
+    q.push_many(block(10, 3)[0])
+    np.testing.assert_array_equal(slow.drain()[1], np.arange(5, 13))
+    np.testing.assert_array_equal(fast.drain()[1], np.arange(10, 13))
+
+
+def test_slowest_reader_loses_samples_not_the_fast_one():
+    q = FloatQueue(capacity=16, max_capacity=16, policy="drop-oldest")
+    q.pause()
+    fast = q.subscribe("fast")
+    slow = q.subscribe("slow")
+
+    for start in range(0, 40, 4):
+        q.push_many(block(start, 4)[0])
+        fast.drain()
+
+    assert fast.dropped == 0
+    assert slow.dropped == 24
+    np.testing.assert_array_equal(slow.drain()[1], np.arange(24, 40))
+
+
+def test_closed_subscription_stops_holding_the_ring():
+    q = FloatQueue(capacity=8, max_capacity=8)
+    q.pause()
+    live = q.subscribe("live")
+    gone = q.subscribe("gone")
+    gone.close()
+
+    q.push_many(block(0, 8)[0])
+    live.drain()
+    q.push_many(block(8, 8)[0])
+
+    assert q.dropped == 0
+    assert gone.count == 0
@@ -0,0 +1,74 @@
+import pytest
+
+from packet_codec import HDR1, HDR2, ECG_HDR, encode_frame, expected_echo
+from uart_comm import FrameParser, ECG_SCALE
+
+
+def ecg(a, v):
+    return bytes([ECG_HDR, a, v])
+
+
+def test_decodes_ecg_frames_with_stamp():
+    parser = FrameParser()
+    frames = parser.feed(ecg(0, 255) + ecg(51, 102), stamp=1.5)
+
+    assert [kind for kind, _ in frames] == ["ECG", "ECG"]
+    assert frames[0][1] == (0.0, pytest.approx(255 * ECG_SCALE), 1.5)
+    assert frames[1][1][:2] == (pytest.approx(51 * ECG_SCALE), pytest.approx(102 * ECG_SCALE))
+    assert parser.dropped == 0
+    assert not parser.buf
+
+
+def test_resyncs_after_junk():
+    parser = FrameParser()
+    # junk, a lone HDR1, then a real frame
+    frames = parser.feed(bytes([0x01, 0x02, HDR1, 0x03]) + ecg(10, 20))
+
+    assert len(frames) == 1
+    assert parser.dropped == 4
+
+
+def test_joins_stream_mid_frame():
+    parser = FrameParser()
+    stream = ecg(1, 2) + ecg(3, 4) + ecg(5, 6)
+    frames = parser.feed(stream[1:])
+
+    # the two orphaned data bytes are dropped, the rest decodes
+    assert parser.dropped == 2
+    assert [f[1][:2] for f in frames] == [(pytest.approx(3 * ECG_SCALE), pytest.approx(4 * ECG_SCALE)),
+                                          (pytest.approx(5 * ECG_SCALE), pytest.approx(6 * ECG_SCALE))]
+
+
+def test_ecg_frame_split_across_reads():
+    parser = FrameParser()
+    data = ecg(7, 8) + ecg(9, 10)
+
+    assert len(parser.feed(data[:4])) == 1
+    assert parser.buf == bytearray(data[3:4])
+    assert len(parser.feed(data[4:])) == 1
+    assert parser.dropped == 0
+
+
+def test_echo_split_across_reads():
+    params = {"Lower Rate Limit": 70, "Upper Rate Limit": 130}
+    frame = encode_frame("VVI", params)
+    assert frame[:2] == bytes([HDR1, HDR2])
+
+    parser = FrameParser()
+    frames = []
+    for i in range(len(frame)):
+        frames += parser.feed(frame[i:i + 1])
+
+    assert len(frames) == 1
+    kind, echo = frames[0]
+    assert kind == "ECHO"
+    assert echo == expected_echo("VVI", params)
+    assert parser.dropped == 0
+
+
+def test_reset_discards_partial_frame():
+    parser = FrameParser()
+    parser.feed(bytes([ECG_HDR, 1]))
+    parser.reset()
+
+    assert parser.feed(ecg(2, 3))[0][1][:2] == (pytest.approx(2 * ECG_SCALE), pytest.approx(3 * ECG_SCALE))
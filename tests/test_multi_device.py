@@ -0,0 +1,93 @@
+import types
+
+import pytest
+
+import dcm_cli
+import uart_comm
+from datamanager import DataManager
+from device_simulator import SimulatedPacemaker, LoopbackSerial, connect_loopback
+from multi_device import MultiDeviceSession
+
+
+class Mute(SimulatedPacemaker):
+    def receive(self, data):
+        super().receive(data)
+        return b""
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "d.db")
+    db = DataManager(path)
+    db.add_user("alice", "pw")
+    db.save_state("alice", "VOO")
+    db.save_parameters("alice", {"Lower Rate Limit": 75}, state_name="VOO")
+    db.path = path
+    yield db
+    db.close()
+
+
+def test_connect_all_keeps_ports_that_answer(db, monkeypatch):
+    devices = {}
+
+    def open_port(device, baud, timeout=0.05):
+        if device == "missing":
+            raise uart_comm.serial.SerialException("no such port")
+        devices[device] = LoopbackSerial(SimulatedPacemaker(seed=1), timeout=timeout, port=device)
+        return devices[device]
+
+    monkeypatch.setattr(uart_comm.serial, "Serial", open_port)
+    ports = [types.SimpleNamespace(device=d, serial_number=d) for d in ("A", "missing", "B")]
+
+    multi = MultiDeviceSession(db, "alice")
+    assert sorted(multi.connect_all(ports)) == ["A", "B"]
+    assert [multi.devices[d].ser for d in ("A", "B")] == [devices["A"], devices["B"]]
+
+    # already connected ports are not probed again
+    assert multi.connect_all(ports[:1]) == []
+    multi.disconnect_all()
+    assert multi.devices == {}
+
+
+def test_program_all_verifies_every_device(db):
+    multi = MultiDeviceSession(db, "alice")
+    connected = multi.connect_simulated(3, seed=1)
+    assert len(connected) == 3
+
+    results = multi.wait_results(multi.program_all(timeout=0.5, retries=1), timeout=5)
+    try:
+        assert sorted(results) == sorted(connected)
+        for result in results.values():
+            assert result.ok
+            assert result.echo.lrl == 75
+        assert all(uart.ser.device.params.lrl == 75 for uart in multi.devices.values())
+    finally:
+        multi.disconnect_all()
+
+
+def test_results_are_per_device(db):
+    multi = MultiDeviceSession(db, "alice")
+    multi.connect_simulated(1, seed=1)
+
+    mute = uart_comm.UARTComm(db=db)
+    connect_loopback(mute, Mute(seed=1))
+    multi.devices["mute"] = mute
+    multi.devices["gone"] = uart_comm.UARTComm(db=db)   # never connected
+
+    results = multi.wait_results(multi.program_all(timeout=0.05, retries=1, backoff=0.01), timeout=5)
+    try:
+        assert results["loop://simulator0"].ok
+        assert not results["mute"].ok and results["mute"].echo is None
+        assert isinstance(results["gone"], Exception)
+    finally:
+        multi.disconnect_all()
+
+
+def test_cli_program_all(db, capsys):
+    code = dcm_cli.main(["--db", db.path, "--user", "alice", "--password", "pw",
+                         "--simulate", "program-all", "--devices", "3"])
+    out = capsys.readouterr().out
+
+    assert code == 0
+    assert out.count("VERIFIED VOO") == 3
+    assert "3/3 devices verified VOO" in out
@@ -0,0 +1,76 @@
+import pytest
+
+import packet_codec
+from packet_codec import (HDR1, HDR2, FRAME_LEN, CACHE_SIZE, DEFAULTS, MODE_BITMASK,
+                          encode_frame, expected_echo, decode_echo, echo_dict)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    packet_codec._cache.clear()
+    yield
+    packet_codec._cache.clear()
+
+
+def test_frame_layout():
+    frame = encode_frame("VVI", {"Lower Rate Limit": 70})
+    assert len(frame) == FRAME_LEN
+    assert frame[:2] == bytes([HDR1, HDR2])
+
+    echo = decode_echo(frame, 2)
+    assert echo.mode == MODE_BITMASK["VVI"]
+    assert echo.lrl == 70
+
+
+def test_frames_are_cached_regardless_of_key_order():
+    a = {"Lower Rate Limit": 70, "VRP": 300}
+    b = {"VRP": 300, "Lower Rate Limit": 70}
+
+    first = encode_frame("VVI", a)
+    assert encode_frame("VVI", b) is first
+    assert len(packet_codec._cache) == 1
+
+    # a different mode or value is a different frame
+    assert encode_frame("AAI", a) != first
+    assert encode_frame("VVI", dict(a, VRP=310)) != first
+    assert len(packet_codec._cache) == 3
+
+
+def test_cache_is_cleared_when_full():
+    for vrp in range(CACHE_SIZE):
+        encode_frame("VOO", {"VRP": vrp})
+    assert len(packet_codec._cache) == CACHE_SIZE
+
+    encode_frame("VOO", {"VRP": CACHE_SIZE})
+    assert len(packet_codec._cache) == 1
+
+
+def test_missing_parameters_use_defaults():
+    assert encode_frame("AOO", None) == encode_frame("AOO", dict(DEFAULTS))
+
+    echo = expected_echo("AOO", {"Upper Rate Limit": 150})
+    assert echo.url == 150
+    assert echo.lrl == DEFAULTS["Lower Rate Limit"]
+    assert echo.vrp == DEFAULTS["VRP"]
+
+
+def test_activity_threshold_labels():
+    assert expected_echo("AAIR", {"Activity Threshold": "High"}).activity_threshold == 6
+    assert expected_echo("AAIR", {"Activity Threshold": 3}).activity_threshold == 3
+    # unknown labels fall back to Med
+    assert expected_echo("AAIR", {"Activity Threshold": "?"}).activity_threshold == 4
+
+
+def test_expected_echo_matches_the_wire():
+    params = {"Lower Rate Limit": 65, "Atrial Amplitude": 3.3, "Atrial Pulse Width": 0.4}
+    frame = encode_frame("AAI", params)
+    echo = expected_echo("AAI", params)
+
+    # floats come back at float32 precision, exactly as the device echoes them
+    assert decode_echo(frame, 2) == echo
+    assert echo.atrial_amplitude != 3.3
+    assert echo.atrial_amplitude == pytest.approx(3.3, rel=1e-6)
+
+    labelled = echo_dict(echo)
+    assert labelled["LRL"] == 65
+    assert labelled["Mode"] == MODE_BITMASK["AAI"]
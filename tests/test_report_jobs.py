@@ -0,0 +1,131 @@
+import time
+
+import numpy as np
+
+from report_jobs import ReportRunner, ReportJob
+
+
+class FakeRoot:
+    # Collects root.after callbacks; run() calls the ones due so far
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, callback):
+        self.scheduled.append(callback)
+
+    def run(self):
+        due, self.scheduled = self.scheduled, []
+        for callback in due:
+            callback()
+
+
+def report(path, egram_data=None):
+    n = 3000
+    t = np.arange(n) / 1000.0
+    a = np.sin(t).astype(np.float32)
+    return dict(device_model="DCM", device_serial="SN1", application_model="App",
+                application_version="1.0", dcm_serial="DCM1", report_name="test",
+                labels=["Lower Rate Limit"], parameters=[60],
+                egram_data=(t, a, -a) if egram_data is None else egram_data,
+                output_filename=str(path))
+
+
+def wait_for(job, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+
+
+def test_updates_reach_the_tk_thread_once_per_poll(tmp_path):
+    root = FakeRoot()
+    seen = []
+    runner = ReportRunner(root, on_update=lambda job: seen.append((job.id, job.status)))
+    try:
+        job = runner.submit("report", **report(tmp_path / "r.pdf"))
+        wait_for(job)
+        # queued, running, every progress step and the result
+        assert runner.updates.qsize() > 4
+
+        root.run()
+        assert seen == [(job.id, "done")]
+        assert job.progress == 1.0
+        assert job.stage == "writing"
+        assert job.elapsed > 0
+        assert (tmp_path / "r.pdf").exists()
+
+        # the poll rescheduled itself
+        assert len(root.scheduled) == 1
+        root.run()
+        assert len(seen) == 1
+    finally:
+        runner.shutdown()
+
+
+def test_cancel_before_it_runs(tmp_path):
+    runner = ReportRunner(FakeRoot())
+    try:
+        job = ReportJob(1, "report", report(tmp_path / "r.pdf"))
+        runner.cancel(job)
+        runner._run(job)
+
+        assert job.status == "cancelled"
+        assert job.elapsed is None
+        assert not (tmp_path / "r.pdf").exists()
+    finally:
+        runner.shutdown()
+
+
+def test_cancel_while_running(tmp_path):
+    runner = ReportRunner(FakeRoot())
+    jobs = []
+    t = np.arange(3000) / 1000.0
+    a = np.sin(t).astype(np.float32)
+
+    def chunks():
+        # the first pass over the egram data is the graph stage
+        jobs[0].cancel()
+        yield t, a, -a
+
+    try:
+        jobs.append(runner.submit("report", **report(tmp_path / "r.pdf", chunks)))
+        wait_for(jobs[0])
+
+        assert jobs[0].status == "cancelled"
+        assert jobs[0].stage == "graph"
+        assert not (tmp_path / "r.pdf").exists()
+        assert runner.active() == []
+    finally:
+        runner.shutdown()
+
+
+def test_failure_is_reported(tmp_path):
+    def chunks():
+        raise OSError("session file gone")
+        yield
+
+    runner = ReportRunner(FakeRoot())
+    try:
+        job = runner.submit("report", **report(tmp_path / "r.pdf", chunks))
+        wait_for(job)
+        assert job.status == "failed"
+        assert job.error == "session file gone"
+    finally:
+        runner.shutdown()
+
+
+def test_shutdown_cancels_queued_jobs_and_stops_polling(tmp_path):
+    root = FakeRoot()
+    seen = []
+    runner = ReportRunner(root, on_update=seen.append)
+    jobs = [runner.submit(f"report {i}", **report(tmp_path / f"r{i}.pdf")) for i in range(3)]
+    runner.shutdown()
+
+    # the first one may have finished before it saw the cancel
+    assert not runner.worker.is_alive()
+    assert runner.active() == []
+    assert [job.status for job in jobs[1:]] == ["cancelled", "cancelled"]
+
+    root.run()
+    assert seen == []
+    assert root.scheduled == []
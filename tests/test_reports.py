@@ -0,0 +1,61 @@
+import numpy as np
+
+from reports import generate_report
+from session_recorder import SessionRecorder, SessionReader, recorded_chunks
+
+
+def build(path, egram_data, **options):
+    # writes a report; returns the progress stages seen and the page count
+    stages = []
+    generate_report("DCM", "SN1", "App", "1.0", "DCM1", "test",
+                    ["Lower Rate Limit"], [60], egram_data=egram_data,
+                    output_filename=str(path),
+                    progress=lambda fraction, stage: stages.append(stage), **options)
+    return stages, path.read_bytes().count(b"/Type /Page\n")
+
+
+def record(path, seconds):
+    rec = SessionRecorder(str(path))
+    n = int(seconds * 1000)
+    t = rec.mono0 + np.arange(n) / 1000.0
+    a = np.sin(t).astype(np.float32)
+    rec.record_samples(t, a, -a)
+    rec.close()
+    return n
+
+
+def test_empty_chunk_source_is_no_egram_data(tmp_path):
+    stages, pages = build(tmp_path / "r.pdf", lambda: iter(()))
+
+    assert "graph" in stages
+    assert "strip chart" not in stages
+    # parameters, then the graph page saying there is no data
+    assert pages == 2
+
+
+def test_report_from_recorded_session(tmp_path):
+    session = tmp_path / "s.egram"
+    n = record(session, 12)
+
+    reader = SessionReader(str(session))
+    try:
+        stages, pages = build(tmp_path / "a.pdf", reader, seconds_per_row=5.0)
+    finally:
+        reader.close()
+    assert "strip chart" in stages
+    assert pages >= 4
+
+    # the same samples through a chunk source give the same report
+    same = build(tmp_path / "b.pdf", recorded_chunks(str(session), n), seconds_per_row=5.0)
+    assert same == (stages, pages)
+
+
+def test_appendix_lists_every_sample(tmp_path):
+    session = tmp_path / "s.egram"
+    n = record(session, 2)
+
+    short, _ = build(tmp_path / "a.pdf", recorded_chunks(str(session), n))
+    stages, pages = build(tmp_path / "b.pdf", recorded_chunks(str(session), n),
+                          data_appendix=True)
+    assert "appendix" in stages and "appendix" not in short
+    assert pages > 4
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+from session_recorder import SessionRecorder, SessionReader, recorded_chunks, HEADER, CHUNK
+
+
+def record(path, n, chunk_samples=100, flush_at=None):
+    # n samples at 1 kHz; optionally flush a partial chunk after flush_at
+    rec = SessionRecorder(str(path), chunk_samples=chunk_samples)
+    t = rec.mono0 + np.arange(n) / 1000.0
+    a = np.arange(n, dtype=np.float32)
+    v = -a
+    if flush_at is None:
+        rec.record_samples(t, a, v)
+    else:
+        rec.record_samples(t[:flush_at], a[:flush_at], v[:flush_at])
+        rec.flush()
+        rec.record_samples(t[flush_at:], a[flush_at:], v[flush_at:])
+    rec.record_event("params_sent", mode="VVI")
+    rec.close()
+    return rec
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "s.egram"
+    rec = record(path, 250)
+    assert rec.samples_written == 250
+
+    reader = SessionReader(str(path))
+    assert len(reader) == 250
+    assert reader.duration == pytest.approx(0.249, abs=1e-3)
+
+    t, a, v = reader.slice(0, len(reader))
+    np.testing.assert_array_equal(a, np.arange(250))
+    np.testing.assert_array_equal(v, -np.arange(250))
+    assert np.all(np.diff(t) > 0)
+
+    assert [f["kind"] for _, f in reader.events] == ["params_sent"]
+    assert reader.events[0][1]["mode"] == "VVI"
+    reader.close()
+
+
+def test_full_chunks_then_partial_last(tmp_path):
+    path = tmp_path / "s.egram"
+    record(path, 250)
+
+    reader = SessionReader(str(path))
+    assert [len(t) for t, _, _ in reader.chunks()] == [100, 100, 50]
+    reader.close()
+
+
+def test_flush_writes_partial_chunk_at_once(tmp_path):
+    path = tmp_path / "s.egram"
+    rec = SessionRecorder(str(path), chunk_samples=100)
+    rec.record_samples(rec.mono0 + np.arange(30) / 1000.0, np.ones(30), np.ones(30))
+    rec.flush()
+
+    assert rec.samples_written == 30
+    reader = SessionReader(str(path))
+    assert len(reader) == 30
+    reader.close()
+    rec.close()
+
+
+def test_appending_keeps_the_file_chunk_size(tmp_path):
+    path = tmp_path / "s.egram"
+    record(path, 50, chunk_samples=100)
+
+    rec = SessionRecorder(str(path), chunk_samples=4096)
+    assert rec.chunk_samples == 100
+    rec.close()
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    path = tmp_path / "s.egram"
+    record(path, 250)
+
+    # an unfinished write: a chunk header promising more bytes than exist
+    with open(path, "ab") as f:
+        f.write(CHUNK.pack(b"SMPL", 100, 1200, 0.0))
+        f.write(b"\0" * 40)
+
+    reader = SessionReader(str(path))
+    assert len(reader) == 250
+    _, a, _ = reader.slice(0, 250)
+    assert a[-1] == 249
+    reader.close()
+
+
+def test_locate_and_slice_after_flush(tmp_path):
+    # a flushed partial chunk breaks the "full chunks" shortcut in locate
+    path = tmp_path / "s.egram"
+    record(path, 400, flush_at=150)
+
+    reader = SessionReader(str(path))
+    assert len(reader) == 400
+    assert reader.locate(0) == (0, 0)
+    assert reader.locate(99) == (0, 99)
+    assert reader.locate(149) == (1, 49)
+    assert reader.locate(150) == (2, 0)
+    assert reader.locate(399) == (4, 49)
+
+    _, a, _ = reader.slice(140, 260)
+    np.testing.assert_array_equal(a, np.arange(140, 260))
+    reader.close()
+
+
+def test_index_at_and_seek(tmp_path):
+    path = tmp_path / "s.egram"
+    record(path, 250)
+
+    reader = SessionReader(str(path))
+    assert reader.index_at(0.0) == 0
+    assert reader.index_at(0.1205) == 121
+    assert reader.index_at(10.0) == 250
+    assert reader.sample_rate == pytest.approx(1000, rel=0.01)
+
+    reader.seek_time(0.2)
+    _, a, _ = reader.read(5)
+    np.testing.assert_array_equal(a, np.arange(200, 205))
+    assert reader.pos == 205
+
+    # reads stop at the end
+    reader.seek(248)
+    assert len(reader.read(10)[0]) == 2
+    reader.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "x.egram"
+    path.write_bytes(b"not a session" + b"\0" * HEADER.size)
+    with pytest.raises(ValueError):
+        SessionReader(str(path))
+
+    short = tmp_path / "short.egram"
+    short.write_bytes(b"DCM")
+    with pytest.raises(ValueError):
+        SessionReader(str(short))
+
+
+def test_recorded_chunks_stops_at_count(tmp_path):
+    path = tmp_path / "s.egram"
+    record(path, 250)
+
+    chunks = recorded_chunks(str(path), 130)
+    # the source can be read more than once
+    for _ in range(2):
+        a = np.concatenate([a for _, a, _ in chunks()])
+        np.testing.assert_array_equal(a, np.arange(130))
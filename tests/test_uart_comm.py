@@ -0,0 +1,241 @@
+import time
+import types
+
+import pytest
+
+import uart_comm
+from datamanager import DataManager
+from device_simulator import SimulatedPacemaker, LoopbackSerial, connect_loopback
+from packet_codec import MODE_BITMASK, expected_echo
+
+
+class SilentPort:
+    # Opens fine but nothing ever answers
+    def __init__(self, device, baud, timeout=0.05, closed=None):
+        self.port = device
+        self.timeout = timeout
+        self.is_open = True
+        self.in_waiting = 0
+        self.written = []
+        self.closed = closed
+
+    def reset_input_buffer(self):
+        pass
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read(self, size=1):
+        time.sleep(self.timeout)
+        return b""
+
+    def close(self):
+        self.is_open = False
+        self.closed.append(self.port)
+
+
+class LivePort(LoopbackSerial):
+    # A simulated pacemaker; `skew` drops bytes so the probe joins mid-frame
+    def __init__(self, device, baud, timeout=0.05, skew=0):
+        super().__init__(SimulatedPacemaker(seed=1), timeout=timeout, port=device)
+        self.skew = skew
+        self.written = []
+
+    def reset_input_buffer(self):
+        super().reset_input_buffer()
+        if self.skew:
+            time.sleep(0.01)
+            with self.cond:
+                del self.buf[:self.skew]
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return super().write(data)
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    # serial.Serial opens LivePort for "LIVE" and SilentPort for anything else
+    opened = {}
+    closed = []
+    options = {"skew": 0}
+
+    def open_port(device, baud, timeout=0.05):
+        if device == "LIVE":
+            ser = LivePort(device, baud, timeout, options["skew"])
+        else:
+            ser = SilentPort(device, baud, timeout, closed)
+        opened[device] = ser
+        return ser
+
+    monkeypatch.setattr(uart_comm.serial, "Serial", open_port)
+    return types.SimpleNamespace(opened=opened, closed=closed, options=options)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DataManager(str(tmp_path / "d.db"))
+    db.add_user("alice", "pw")
+    db.save_state("alice", "VVI")
+    db.save_parameters("alice", {"Lower Rate Limit": 70}, state_name="VVI")
+    yield db
+    db.close()
+
+
+def port_info(device):
+    return types.SimpleNamespace(device=device, serial_number=device)
+
+
+def connect(uart, *devices, **kwargs):
+    try:
+        return uart.connect("alice", [port_info(d) for d in devices], **kwargs)
+    finally:
+        # probes that lost the race close their ports on their own thread
+        time.sleep(0.15)
+
+
+def test_listen_only_writes_nothing(ports, db):
+    uart = uart_comm.UARTComm(db=db)
+    assert connect(uart, "S1", "LIVE", "S2")
+
+    assert uart.ser is ports.opened["LIVE"]
+    assert all(not ser.written for ser in ports.opened.values())
+    uart.disconnect()
+
+
+@pytest.mark.parametrize("skew", [1, 2])
+def test_listen_only_joins_mid_frame(ports, db, skew):
+    ports.options["skew"] = skew
+    uart = uart_comm.UARTComm(db=db)
+    assert connect(uart, "LIVE")
+    uart.disconnect()
+
+
+def test_race_closes_the_losers(ports, db):
+    uart = uart_comm.UARTComm(db=db)
+    start = time.perf_counter()
+    ok = uart.connect("alice", [port_info(d) for d in ("S1", "LIVE", "S2")])
+    elapsed = time.perf_counter() - start
+    time.sleep(0.15)
+
+    assert ok
+    # well within one probe_timeout: nothing waits for the silent ports
+    assert elapsed < uart.probe_timeout
+    assert sorted(ports.closed) == ["S1", "S2"]
+    assert db.get_device_port("alice", "LIVE") == "LIVE"
+    uart.disconnect()
+
+
+def test_program_writes_saved_parameters(ports, db):
+    uart = uart_comm.UARTComm(db=db)
+    assert connect(uart, "S1", "LIVE", program=True)
+
+    packet = uart._build_packet("VVI", db.get_parameters("alice", state_name="VVI"))
+    assert ports.opened["LIVE"].written == [packet]
+    assert ports.opened["LIVE"].device.params.lrl == 70
+    uart.disconnect()
+
+
+def test_no_answer_or_no_ports(ports, db):
+    uart = uart_comm.UARTComm(db=db)
+    uart.probe_timeout = 0.1
+
+    assert not uart.connect("alice", [])
+    assert not connect(uart, "S1", "S2")
+    assert sorted(ports.closed) == ["S1", "S2"]
+    assert uart.ser is None
+
+
+class WrongLRL(SimulatedPacemaker):
+    # echoes every frame with the lower rate limit off by one
+    def receive(self, data):
+        reply = bytearray(super().receive(data))
+        if reply:
+            reply[3] += 1
+        return bytes(reply)
+
+
+class Mute(SimulatedPacemaker):
+    def receive(self, data):
+        super().receive(data)
+        return b""
+
+
+class DropsFirst(SimulatedPacemaker):
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.received = 0
+
+    def receive(self, data):
+        reply = super().receive(data)
+        self.received += 1
+        return reply if self.received > 1 else b""
+
+
+def verify(db, device, **kwargs):
+    uart = uart_comm.UARTComm(db=db)
+    connect_loopback(uart, device)
+    try:
+        return uart.send_and_verify("alice", **kwargs).result(timeout=5)
+    finally:
+        uart.disconnect()
+
+
+def test_verify_first_attempt(db):
+    device = SimulatedPacemaker(seed=1)
+    result = verify(db, device)
+
+    assert result.ok
+    assert result.attempts == 1
+    assert result.latency is not None and result.latency < 0.5
+    assert result.mismatches == []
+    assert result.echo == expected_echo("VVI", db.get_parameters("alice", state_name="VVI"))
+    assert device.params.lrl == 70
+
+
+def test_verify_reports_mismatch(db):
+    result = verify(db, WrongLRL(seed=1), timeout=0.2, retries=1, backoff=0.01)
+
+    assert not result.ok
+    assert result.attempts == 2
+    assert result.mismatches == [("lrl", 70, 71)]
+    assert result.echo.lrl == 71
+
+
+def test_verify_times_out(db):
+    start = time.perf_counter()
+    result = verify(db, Mute(seed=1), timeout=0.05, retries=2, backoff=0.01)
+
+    assert not result.ok
+    assert result.attempts == 3
+    assert result.echo is None and result.latency is None
+    # three timeouts plus 0.01 + 0.02 s of backoff
+    assert time.perf_counter() - start < 1.0
+
+
+def test_verify_retries_after_lost_echo(db):
+    device = DropsFirst(seed=1)
+    result = verify(db, device, timeout=0.05, retries=3, backoff=0.01)
+
+    assert result.ok
+    assert result.attempts == 2
+    assert device.received == 2
+
+
+def test_verify_other_mode(db):
+    db.save_parameters("alice", {"Lower Rate Limit": 55}, state_name="AAI")
+    result = verify(db, SimulatedPacemaker(seed=1), mode="AAI")
+
+    assert result.ok
+    assert result.echo.mode == MODE_BITMASK["AAI"]
+    assert result.echo.lrl == 55
+
+
+def test_verify_needs_a_connection(db):
+    uart = uart_comm.UARTComm(db=db)
+    with pytest.raises(Exception, match="Device not connected"):
+        uart.send_and_verify("alice")